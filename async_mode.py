@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from typing import Any, Optional
+
+import telebot
+from telebot.async_telebot import AsyncTeleBot
+
+from outbox import Outbox, not_modified
+
+log = logging.getLogger(__name__)
+
+ASYNC_WORKERS = 64  # number of threads running handlers of different chats at the same time
+
+POLLING_TIMEOUT = 20  # in sec., long polling timeout of getUpdates
+
+
+def update_chat_id(update: telebot.types.Update) -> Optional[int]:
+    """
+    Returns id of the chat an update belongs to (None if an update is not bound to any chat)
+    """
+    if update.message is not None:
+        return update.message.chat.id
+    if update.callback_query is not None:
+        query = update.callback_query
+        if query.message is not None:
+            return query.message.chat.id
+        return query.from_user.id
+    return None
+
+
+class ChatSequencer:
+    """
+    Runs coroutines one by one within a chat, and concurrently for different chats.
+
+    Each chat has a chain of tasks: a new task waits for the last task of its chat to finish.
+    """
+
+    def __init__(self):
+        self._tails: dict[int, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._tails)
+
+    def submit(self, chat_id: int, job: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """
+        Schedules `job` (a callable returning an awaitable) after all jobs submitted earlier for the same chat.
+        Shall be called from the event loop thread.
+        """
+        previous = self._tails.get(chat_id)
+        task = asyncio.get_running_loop().create_task(self._run_after(previous, job))
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda t: self._release(chat_id, t))
+        return task
+
+    @staticmethod
+    async def _run_after(previous: Optional[asyncio.Task], job: Callable[[], Awaitable[Any]]) -> Any:
+        if previous is not None:
+            await asyncio.wait((previous,))
+        try:
+            return await job()
+        except Exception as err:
+            log.exception('Job of chat failed: %s', err)
+
+    def _release(self, chat_id: int, task: asyncio.Task) -> None:
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    async def join(self) -> None:
+        """Waits until all submitted jobs are done"""
+        while self._tails:
+            await asyncio.wait(tuple(self._tails.values()))
+
+
+class AsyncOutbox(Outbox):
+    """
+    Outbox for the asyncio mode: Bot API calls are made by ``AsyncTeleBot`` in the event loop.
+
+    Methods are called by handlers in worker threads and return immediately;
+    calls are queued to the chat's chain of `sequencer`, so they are sent in the order of calls.
+    """
+
+    def __init__(self, bot: AsyncTeleBot, loop: asyncio.AbstractEventLoop, sequencer: ChatSequencer):
+        self.bot = bot
+        self.loop = loop
+        self.sequencer = sequencer
+
+    def _submit(self, chat_id: int, job: Callable[[], Awaitable[Any]]) -> None:
+        self.loop.call_soon_threadsafe(self.sequencer.submit, chat_id, job)
+
+    def send_message(self, chat_id: int, text: str, reply_markup: Any = None,
+                     parse_mode: Optional[str] = None) -> None:
+        self._submit(chat_id, lambda: self.bot.send_message(chat_id, text, reply_markup=reply_markup,
+                                                            parse_mode=parse_mode))
+
+    def send_transient(self, chat_id: int, text: str, reply_markup: Any = None,
+                       parse_mode: Optional[str] = None) -> None:
+        async def send_and_delete():
+            message = await self.bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+            await self._delete(chat_id, message.id)
+        self._submit(chat_id, send_and_delete)
+
+    def edit_message(self, chat_id: int, message_id: int, text: str, reply_markup: Any = None,
+                     parse_mode: Optional[str] = None) -> None:
+        self._submit(chat_id, lambda: self._edit(chat_id, message_id, text, reply_markup, parse_mode))
+
+    def send_then_edit(self, chat_id: int, first_text: str, first_markup: Any, text: str,
+                       reply_markup: Any = None, parse_mode: Optional[str] = None) -> None:
+        async def send_and_edit():
+            message = await self.bot.send_message(chat_id, first_text, reply_markup=first_markup)
+            await self._edit(chat_id, message.id, text, reply_markup, parse_mode)
+        self._submit(chat_id, send_and_edit)
+
+    async def _edit(self, chat_id: int, message_id: int, text: str, reply_markup: Any,
+                    parse_mode: Optional[str]) -> None:
+        try:
+            await self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id,
+                                             reply_markup=reply_markup, parse_mode=parse_mode)
+        except telebot.apihelper.ApiTelegramException as err:
+            if not_modified(err):
+                return
+            await self._delete(chat_id, message_id)
+            await self.bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+
+    def delete_message(self, chat_id: int, message_id: int) -> None:
+        self._submit(chat_id, lambda: self._delete(chat_id, message_id))
+
+    async def _delete(self, chat_id: int, message_id: int) -> None:
+        try:
+            await self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except telebot.apihelper.ApiTelegramException as err:
+            log.warning('%s is not deleted: %s', message_id, err.description)
+
+    def answer_callback_query(self, chat_id: int, callback_query_id: str) -> None:
+        self._submit(chat_id, lambda: self.bot.answer_callback_query(callback_query_id))
+
+
+async def polling(bot: telebot.TeleBot, token: str, set_outbox: Callable[[Outbox], None],
+                  workers: int = ASYNC_WORKERS, timeout: int = POLLING_TIMEOUT) -> None:
+    """
+    Asyncio runtime mode: receives updates with ``AsyncTeleBot`` and processes updates of different chats
+    concurrently. Handlers registered in the synchronous `bot` run in a pool of `workers` threads;
+    updates of the same chat (and replies to them) are processed strictly in order.
+
+    :param bot: telebot.TeleBot (a bot with registered handlers)
+    :param token: str (the bot's token)
+    :param set_outbox: callable, installs an outbox used by handlers
+    :param workers: int (number of worker threads)
+    :param timeout: int (long polling timeout, in sec.)
+    """
+    loop = asyncio.get_running_loop()
+    async_bot = AsyncTeleBot(token)
+    sequencer = ChatSequencer()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+    bot.threaded = False  # handlers shall run in the worker thread of their chat
+    set_outbox(AsyncOutbox(async_bot, loop, sequencer))
+
+    def dispatch(update: telebot.types.Update) -> None:
+        job = lambda: loop.run_in_executor(executor, bot.process_new_updates, [update])
+        chat_id = update_chat_id(update)
+        if chat_id is None:
+            loop.create_task(job())
+        else:
+            sequencer.submit(chat_id, job)
+
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await async_bot.get_updates(offset=offset, timeout=timeout)
+            except Exception as err:
+                log.error('getUpdates failed: %s', err)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                dispatch(update)
+    finally:
+        await sequencer.join()
+        executor.shutdown(wait=True)
+        await async_bot.close_session()
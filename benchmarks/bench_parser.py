@@ -0,0 +1,94 @@
+"""
+Throughput of the questionnaire parser on large generated questionnaires.
+
+Generates questionnaires with common and specific answers, parses every one several times with
+``quiz_parser.parse_file`` and reports MB/s, lines/s and peak memory allocated while parsing.
+The file is streamed, so the peak is mostly the parsed data itself. Run from the repository root:
+    python -m benchmarks.bench_parser [--questions 1000 10000 100000] [--scales 4] [--repeat 3]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from quiz_parser import parse_file
+
+
+def generate(filename: str, questions: int, scales: int, specific: bool, seed: int = 0) -> int:
+    """
+    Writes a questionnaire in the format of README.md.
+
+    :return: int (number of lines)
+    """
+    rng = random.Random(seed)
+    scale_ids = [f'S{i}' for i in range(scales)]
+
+    def answer(text: str) -> str:
+        scores = ", ".join(f'{scale_id} {rng.randint(0, 3)}' for scale_id in rng.sample(scale_ids, 2))
+        return f'{text} {{{scores}}}'
+
+    lines = [f'# generated questionnaire: {questions} questions', "TITLE Generated questionnaire", "==="]
+    lines += ["DESCRIPTION", "{This questionnaire is generated by benchmarks/bench_parser.py.",
+              "It has many questions.}", "==="]
+    lines += ["SCALES"] + [f'{scale_id} Scale number {i}' for i, scale_id in enumerate(scale_ids)] + ["==="]
+    if specific:
+        lines += ["ANSWERS SPECIFIC", "==="]
+    else:
+        lines += ["ANSWERS COMMON"] + [answer(text) for text in ("Yes", "Rather yes", "Rather no", "No")] + ["==="]
+    for question_id in range(questions):
+        lines.append(f'QUESTION Is this question number {question_id} about something important to you?')
+        if specific:
+            lines += [answer(f'Answer {i} to question {question_id}') for i in range(rng.randint(2, 5))]
+        lines.append("===")
+    lines.append("RESULTS")
+    for scale_id in scale_ids:
+        lines += [f'{scale_id} ...{questions} {{A low score on the scale {scale_id}.',
+                  "The interpretation spans two lines.}",
+                  f'{scale_id} {questions + 1}... {{A high score on the scale {scale_id}.}}']
+    with open(filename, "w", encoding="utf8") as f:
+        f.write("\n".join(lines))  # the last block is not followed by a delimiter
+    return len(lines)
+
+
+def measure(filename: str, repeat: int) -> tuple[float, int]:
+    """
+    :return: best time of parsing, in sec., and peak memory allocated while parsing, in bytes
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse_file(filename)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    raw_data = parse_file(filename)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del raw_data
+    return best, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Throughput of the questionnaire parser")
+    parser.add_argument("--questions", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--scales", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        for questions in args.questions:
+            for specific in (False, True):
+                filename = os.path.join(directory, f'q{questions}.txt')
+                lines = generate(filename, questions, args.scales, specific)
+                size = os.path.getsize(filename)
+                seconds, peak = measure(filename, args.repeat)
+                answers = "specific" if specific else "common"
+                print(f'{questions:>7} questions, {answers:<8} answers: {size / 2**20:7.2f} MB, {lines:>8} lines '
+                      f'in {seconds * 1000:8.1f} ms: {size / 2**20 / seconds:6.2f} MB/s, '
+                      f'{lines / seconds:10.0f} lines/s, peak memory {peak / 2**20:.2f} MB')
+
+
+if __name__ == "__main__":
+    main()
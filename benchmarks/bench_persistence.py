@@ -0,0 +1,86 @@
+"""
+Per-answer overhead of durable sessions.
+
+Simulates users answering a questionnaire and compares the time spent per answer with
+sessions kept in memory only, with write-behind ``SessionDB`` and with a synchronous commit
+after every answer. Run from the repository root:
+    python -m benchmarks.bench_persistence [--users 1000] [--questions 20]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from persistence import SCHEMA, UPSERT, SessionDB, SessionRecord
+
+
+def _record(user_id: int, question_id: int, scores: np.ndarray) -> SessionRecord:
+    now = time.time()
+    return SessionRecord(user_id, user_id, "quiz", question_id, scores.tobytes(), now, now, False)
+
+
+def memory_only(users: int, questions: int, scales: int) -> float:
+    scores = [np.zeros(scales, dtype=np.int32) for _ in range(users)]
+    start = time.perf_counter()
+    for question_id in range(questions):
+        for user_id in range(users):
+            scores[user_id][question_id % scales] += 1
+    return time.perf_counter() - start
+
+
+def write_behind(path: str, users: int, questions: int, scales: int) -> float:
+    db = SessionDB(path)
+    scores = [np.zeros(scales, dtype=np.int32) for _ in range(users)]
+    start = time.perf_counter()
+    for question_id in range(questions):
+        for user_id in range(users):
+            scores[user_id][question_id % scales] += 1
+            db.save(_record(user_id, question_id, scores[user_id]))
+    elapsed = time.perf_counter() - start
+    db.close()
+    print(f'  write-behind: {db.written} rows written in {db.flushes} transaction(s)')
+    return elapsed
+
+
+def synchronous(path: str, users: int, questions: int, scales: int) -> float:
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=FULL")
+    db.execute(SCHEMA)
+    scores = [np.zeros(scales, dtype=np.int32) for _ in range(users)]
+    start = time.perf_counter()
+    for question_id in range(questions):
+        for user_id in range(users):
+            scores[user_id][question_id % scales] += 1
+            db.execute(UPSERT, _record(user_id, question_id, scores[user_id]))  # a commit per answer
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-answer overhead of durable sessions")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--scales", type=int, default=4)
+    args = parser.parse_args()
+    answers = args.users * args.questions
+    with tempfile.TemporaryDirectory() as directory:
+        results = {"memory only": memory_only(args.users, args.questions, args.scales),
+                   "write-behind": write_behind(os.path.join(directory, "wb.db"),
+                                                args.users, args.questions, args.scales),
+                   "commit per answer": synchronous(os.path.join(directory, "sync.db"),
+                                                    args.users, args.questions, args.scales),
+                   }
+    print(f'{answers} answers ({args.users} users x {args.questions} questions):')
+    for name, elapsed in results.items():
+        print(f'  {name:<18} {elapsed * 1e6 / answers:9.2f} us per answer')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Rendering of results with and without caches of rendered results.
+
+Every questionnaire of a directory is completed by simulated respondents choosing random answers
+(scored at once by ``Quiz.score_batch``). Results of all respondents are rendered by ``Quiz.get_result``
+on a fresh cache and without it; the report shows the score space, the mode and the hit rate of the cache.
+Run from the repository root:
+    python -m benchmarks.bench_results [--respondents 10000] [--directory tests]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from config import TESTS_DIR, TEST_EXTN
+from quiz import Quiz
+from result_cache import ResultCache
+
+
+def respond(quiz: Quiz, respondents: int, seed: int = 0) -> np.ndarray:
+    """
+    :return: int array of shape (respondents, number of scales) with totals of random answers
+    """
+    rng = np.random.default_rng(seed)
+    answers = quiz.answer_counts
+    responses = (rng.random((respondents, len(answers))) * answers).astype(np.int64)
+    return quiz.score_batch(responses)
+
+
+def measure(quiz: Quiz, totals: np.ndarray, cached: bool) -> float:
+    """
+    :return: time of rendering results of all respondents, in sec.
+    """
+    quiz.result_cache = quiz._result_cache()
+    if not cached:
+        quiz.result_cache.mode = "off"
+    start = time.perf_counter()
+    for scores in totals:
+        quiz.get_result(scores)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rendering of results with and without caches")
+    parser.add_argument("--respondents", type=int, default=10_000)
+    parser.add_argument("--directory", default=TESTS_DIR, help="a directory with questionnaires")
+    args = parser.parse_args()
+    for name in sorted(os.listdir(args.directory)):
+        if not name.endswith(TEST_EXTN):
+            continue
+        quiz = Quiz.quiz_from_file(os.path.join(args.directory, name))
+        totals = respond(quiz, args.respondents)
+        uncached = measure(quiz, totals, cached=False)
+        cached = measure(quiz, totals, cached=True)
+        result_cache: ResultCache = quiz.result_cache
+        print(f'{name:<24} {result_cache.space:>8} score vector(s), cache: {result_cache.mode:<5} '
+              f'hit rate {result_cache.hit_rate:6.1%}, {len(result_cache):>5} text(s): '
+              f'{uncached / len(totals) * 1e6:6.2f} -> {cached / len(totals) * 1e6:6.2f} us per result')
+
+
+if __name__ == "__main__":
+    main()
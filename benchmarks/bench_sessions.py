@@ -0,0 +1,86 @@
+"""
+Memory per session.
+
+Fills a ``SessionStore`` with sessions taking a quiz and reports bytes per session (including the store itself)
+for compact ``Session`` objects and for the previous representation of a user: an object with ``__dict__``,
+a bound lambda and a ``NamedTuple`` wrapper with the start time. Run from the repository root:
+    python -m benchmarks.bench_sessions [--sessions 10000 100000 1000000] [--quiz tests/UMPS.txt]
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any, NamedTuple
+
+from quiz import Quiz
+from sessions import Session, SessionStore
+
+FIRST_USER_ID = 5_000_000_000  # Telegram ids do not fit in small cached ints
+
+
+class DictUser:
+    """A session as it was before ``Session``: attributes in ``__dict__`` and a lambda per session"""
+
+    def __init__(self, user_id: int, chat_id: int):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.scores = None
+        self.quiz = None
+        self.question_id = None
+        self.answer_id = None
+        self._on_press_ok = lambda x: True
+        self.last_activity_time = time.time()
+
+
+class RegisteredUser(NamedTuple):
+    ref: Any
+    timestamp: float
+
+
+def dict_session(user_id: int, quiz: Quiz) -> Any:
+    user = DictUser(user_id, int(str(user_id)))  # chat id is parsed from an update separately
+    user.quiz, user.scores, user.question_id = quiz, quiz.new_scores(), 3
+    return RegisteredUser(user, time.time())
+
+
+def compact_session(user_id: int, quiz: Quiz) -> Any:
+    session = Session(user_id, int(str(user_id)))
+    session.quiz, session.scores, session.question_id = quiz, quiz.new_scores(), 3
+    return session
+
+
+def measure(make: Callable[[int, Quiz], Any], sessions: int, quiz: Quiz) -> float:
+    """
+    :return: bytes allocated per session
+    """
+    gc.collect()
+    tracemalloc.start()
+    store = SessionStore(sessions, idle_ttl=3600, session_ttl=3600)
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + sessions):
+        store.add(user_id, make(user_id, quiz))
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(store) == sessions
+    del store
+    return allocated / sessions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Memory per session")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--quiz", default="tests/UMPS.txt", help="a questionnaire taken by all sessions")
+    args = parser.parse_args()
+    quiz = Quiz.quiz_from_file(args.quiz)
+    print(f'{quiz.title}: {len(quiz.scale_ids)} scale(s)')
+    for sessions in args.sessions:
+        before = measure(dict_session, sessions, quiz)
+        after = measure(compact_session, sessions, quiz)
+        print(f'{sessions:>9} sessions: {before:7.1f} bytes per session with __dict__, '
+              f'{after:7.1f} with __slots__ ({after * sessions / 2**20:7.1f} MiB in total)')
+
+
+if __name__ == "__main__":
+    main()
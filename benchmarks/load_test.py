@@ -0,0 +1,271 @@
+"""
+Load test of the bot against a local fake Bot API.
+
+The bot runs in a separate process (see run_bot.py) and receives updates from ``fake_api.FakeBotAPI``
+with long polling. Virtual users walk questionnaires of `tests/*.txt` concurrently, like real users do:
+/start, a title from the menu, *Next*, an answer to every question and *OK* on the result screen.
+Every user waits for the bot's reply before the next step, and latency of a step is the time
+from pushing an update to the Bot API call carrying the reply.
+
+Run from the repository root:
+    python -m benchmarks.load_test [--users 200] [--mode polling|async|workers] [--rate-limit 0] [--stateless 0]
+
+Reports throughput, p50/p95/p99 latency and memory per session (growth of RSS of the bot process
+divided by the number of users; Linux only).
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Callable
+from typing import Any, NamedTuple, Optional
+
+from fake_api import FakeBotAPI
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REPLY_TIMEOUT = 30  # in sec., a virtual user gives up if the bot does not reply
+
+READY_TIMEOUT = 60  # in sec., time for the bot to load questionnaires and start polling
+
+RSS_SAMPLING = 0.05  # in sec.
+
+
+class Reply(NamedTuple):
+    time: float
+    message_id: int
+    text: str
+    markup: dict
+
+
+class LoadTestAPI(FakeBotAPI):
+    """Fake Bot API passing messages sent by the bot to inboxes of virtual users"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.polled = threading.Event()  # the bot has called getUpdates
+        self._inboxes: dict[int, queue.Queue] = {}
+
+    def inbox(self, chat_id: int) -> queue.Queue:
+        return self._inboxes.setdefault(chat_id, queue.Queue())
+
+    def call(self, method: str, params: dict[str, Any]) -> tuple[Any, dict]:
+        status, response = super().call(method, params)
+        if method == "getUpdates":
+            self.polled.set()
+        elif method in ("sendMessage", "editMessageText") and response.get("ok"):
+            markup = params.get("reply_markup") or {}
+            if isinstance(markup, str):
+                markup = json.loads(markup)
+            inbox = self._inboxes.get(int(params["chat_id"]))
+            if inbox is not None:
+                inbox.put(Reply(time.perf_counter(), response["result"]["message_id"],
+                                params.get("text", ""), markup))
+        return status, response
+
+
+def inline_buttons(reply: Reply) -> list[str]:
+    return [button["callback_data"] for row in reply.markup.get("inline_keyboard", []) for button in row]
+
+
+class VirtualUser(threading.Thread):
+    """
+    A user taking `quizes` questionnaires one after another with random answers.
+
+    :param api: LoadTestAPI
+    :param user_id: int (also used as chat id)
+    :param quizes: int (number of questionnaires to take)
+    :param seed: int (seed of random answers)
+    """
+    _message_ids = itertools.count(1)
+
+    def __init__(self, api: LoadTestAPI, user_id: int, quizes: int = 1, seed: int = 0):
+        super().__init__(daemon=True, name=f"user-{user_id}")
+        self.api = api
+        self.user_id = user_id
+        self.quizes = quizes
+        self.rng = random.Random(seed + user_id)
+        self.inbox = api.inbox(user_id)
+        self.latencies: list[float] = []
+        self.answers = 0
+        self.error: Optional[str] = None
+
+    def _message(self, text: str, command: bool = False) -> dict:
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "text": text,
+                   "from": {"id": self.user_id, "is_bot": False, "first_name": "user"},
+                   "chat": {"id": self.user_id, "type": "private"}}
+        if command:
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return {"message": message}
+
+    def _callback(self, data: str, message_id: int) -> dict:
+        return {"callback_query": {"id": str(next(self._message_ids)), "chat_instance": "load-test", "data": data,
+                                   "from": {"id": self.user_id, "is_bot": False, "first_name": "user"},
+                                   "message": {"message_id": message_id, "date": int(time.time()), "text": "",
+                                               "chat": {"id": self.user_id, "type": "private"}}}}
+
+    def step(self, update: dict, expected: Callable[[Reply], bool]) -> Reply:
+        """Sends an update and waits for the expected reply"""
+        start = time.perf_counter()
+        self.api.push_update(update)
+        deadline = start + REPLY_TIMEOUT
+        while True:
+            try:
+                reply = self.inbox.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                raise TimeoutError(f'no reply to {json.dumps(update, ensure_ascii=False)[:80]}') from None
+            if expected(reply):
+                self.latencies.append(reply.time - start)
+                return reply
+
+    def take_quiz(self) -> None:
+        menu = self.step(self._message("/start", command=True), lambda r: "keyboard" in r.markup)
+        titles = [button["text"] for row in menu.markup["keyboard"] for button in row]
+        reply = self.step(self._message(self.rng.choice(titles)), lambda r: bool(inline_buttons(r)))
+        while True:
+            buttons = inline_buttons(reply)
+            if buttons == ["ok"]:  # the result screen
+                self.step(self._callback("ok", reply.message_id), lambda r: True)
+                return
+            if "quit" in buttons:  # the description of a quiz: *Next* and *Quit*
+                data = next(button for button in buttons if button != "quit")
+            else:
+                data = self.rng.choice(buttons)
+                self.answers += 1
+            reply = self.step(self._callback(data, reply.message_id), lambda r: bool(inline_buttons(r)))
+
+    def run(self) -> None:
+        try:
+            for _ in range(self.quizes):
+                self.take_quiz()
+        except Exception as err:
+            self.error = f'{err.__class__.__name__}: {err}'
+
+
+def rss(pid: int) -> Optional[int]:
+    """Returns resident set size of a process in bytes (None if it is unknown)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, pid: int):
+        super().__init__(daemon=True, name="rss-sampler")
+        self.pid = pid
+        self.peak = rss(pid)
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(RSS_SAMPLING):
+            value = rss(self.pid)
+            if value is not None and (self.peak is None or value > self.peak):
+                self.peak = value
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of sorted `values`"""
+    return values[max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def run(users: int, quizes: int = 1, mode: str = "polling", rate_limit: bool = False, stateless: bool = False,
+        latency: float = 0, seed: int = 0, bot_log: Optional[str] = None) -> dict[str, Any]:
+    """
+    Runs a load test.
+
+    :return: dictionary of measurements
+    """
+    api = LoadTestAPI(latency=latency)
+    threading.Thread(target=api.serve_forever, daemon=True, name="fake-bot-api").start()
+    env = dict(os.environ, TOKEN="1:load-test", BOT_API_URL=api.url, PYTHONUNBUFFERED="1")
+    output = open(bot_log, "w") if bot_log else subprocess.DEVNULL
+    bot = subprocess.Popen([sys.executable, "-m", "benchmarks.run_bot", "--rate-limit", str(int(rate_limit)),
+                            "--stateless", str(int(stateless)), "--max-users", str(max(users, 1)),
+                            "--mode", mode],
+                           cwd=REPO_DIR, env=env, stdout=output, stderr=subprocess.STDOUT)
+    try:
+        if not api.polled.wait(READY_TIMEOUT):
+            raise RuntimeError("the bot has not started polling")
+        base_rss = rss(bot.pid)
+        sampler = RSSSampler(bot.pid)
+        sampler.start()
+        virtual_users = [VirtualUser(api, user_id, quizes, seed) for user_id in range(1, users + 1)]
+        start = time.perf_counter()
+        for user in virtual_users:
+            user.start()
+        for user in virtual_users:
+            user.join()
+        elapsed = time.perf_counter() - start
+        sampler.stop()
+    finally:
+        bot.terminate()
+        bot.wait()
+        api.shutdown()
+        api.server_close()
+        if bot_log:
+            output.close()
+    latencies = sorted(itertools.chain.from_iterable(user.latencies for user in virtual_users))
+    errors = [user.error for user in virtual_users if user.error is not None]
+    result = {"users": users, "mode": mode, "seconds": elapsed, "updates": len(latencies),
+              "answers": sum(user.answers for user in virtual_users), "failed_users": len(errors),
+              "errors": errors[:5], "calls": dict(api.calls), "flood_errors": api.flood_errors,
+              "base_rss": base_rss, "peak_rss": sampler.peak}
+    if latencies:
+        result.update({f'p{p}': percentile(latencies, p) for p in (50, 95, 99)})
+        result["max"] = latencies[-1]
+    return result
+
+
+def print_result(result: dict[str, Any]) -> None:
+    seconds = result["seconds"]
+    print(f'mode {result["mode"]}, {result["users"]} users')
+    print(f'  {result["updates"]} updates ({result["answers"]} answers) in {seconds:.2f} s: '
+          f'{result["updates"] / seconds:.1f} updates/s, {result["answers"] / seconds:.1f} answers/s')
+    if "p50" in result:
+        print(f'  update-to-reply latency: p50 {result["p50"] * 1000:.1f} ms, p95 {result["p95"] * 1000:.1f} ms, '
+              f'p99 {result["p99"] * 1000:.1f} ms, max {result["max"] * 1000:.1f} ms')
+    if result["base_rss"] is not None and result["peak_rss"] is not None:
+        per_session = (result["peak_rss"] - result["base_rss"]) / max(result["users"], 1)
+        print(f'  memory: RSS {result["base_rss"] / 2**20:.1f} MiB at start, {result["peak_rss"] / 2**20:.1f} MiB '
+              f'at peak, {per_session / 1024:.1f} KiB per session')
+    print(f'  Bot API calls: {result["calls"]}, flood errors: {result["flood_errors"]}')
+    if result["failed_users"]:
+        print(f'  FAILED users: {result["failed_users"]}, e.g. {result["errors"][0]}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test of the bot against a local fake Bot API")
+    parser.add_argument("--users", type=int, default=200, help="number of concurrent virtual users")
+    parser.add_argument("--quizes", type=int, default=1, help="questionnaires taken by every user")
+    parser.add_argument("--mode", choices=("polling", "async", "workers"), default="polling")
+    parser.add_argument("--rate-limit", type=int, choices=(0, 1), default=0,
+                        help="queue Bot API calls under Telegram limits (see scheduler.py)")
+    parser.add_argument("--stateless", type=int, choices=(0, 1), default=0, help="stateless sessions")
+    parser.add_argument("--latency", type=float, default=0, help="delay of every Bot API response, in sec.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bot-log", default=None, help="a file for output of the bot")
+    args = parser.parse_args()
+    print_result(run(args.users, args.quizes, args.mode, bool(args.rate_limit), bool(args.stateless),
+                     args.latency, args.seed, args.bot_log))
+
+
+if __name__ == "__main__":
+    main()
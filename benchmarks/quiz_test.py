@@ -0,0 +1,61 @@
+"""
+Tests of scoring by ``quiz.Quiz``: an answer is scored the same way one by one (as the bot does)
+and in batches (as bulk_score.py does). Run from the repository root:
+    python -m benchmarks.quiz_test
+(or with pytest, the functions are plain assertions)
+"""
+from __future__ import annotations
+
+import os
+
+import numpy as np
+
+from config import TESTS_DIR
+from quiz import Quiz
+
+QUIZ_FILENAME = os.path.join(TESTS_DIR, "UMPS.txt")  # questions have from 1 to 4 answers
+
+
+def _raises(error: type[Exception], function, *args) -> bool:
+    try:
+        function(*args)
+    except error:
+        return True
+    return False
+
+
+def test_batch_equals_answers() -> None:
+    quiz = Quiz.quiz_from_file(QUIZ_FILENAME)
+    rng = np.random.default_rng(0)
+    responses = (rng.random((20, len(quiz.answer_counts))) * quiz.answer_counts).astype(np.int64)
+    totals = quiz.score_batch(responses)
+    for row, answers in enumerate(responses.tolist()):
+        scores = quiz.new_scores()
+        for question_id, answer_id in enumerate(answers):
+            quiz.add_answer_scores(scores, question_id, answer_id)
+        assert totals[row].tolist() == scores.tolist()
+
+
+def test_answer_ids_are_checked_per_question() -> None:
+    quiz = Quiz.quiz_from_file(QUIZ_FILENAME)
+    question_id = int(np.argmin(quiz.answer_counts))
+    answer_id = int(quiz.answer_counts.max()) - 1  # valid for other questions, a padded row of the tensor here
+    assert quiz.answer_counts[question_id] <= answer_id
+    assert _raises(IndexError, quiz.add_answer_scores, quiz.new_scores(), question_id, answer_id)
+    responses = np.zeros((3, len(quiz.answer_counts)), dtype=np.int64)
+    responses[2, question_id] = answer_id
+    try:
+        quiz.score_batch(responses)
+    except ValueError as err:
+        assert 'respondent #2' in str(err) and f'question id# {question_id}' in str(err)
+    else:
+        raise AssertionError("an answer id invalid for its question is scored")
+    responses[2, question_id] = -1
+    assert _raises(ValueError, quiz.score_batch, responses)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f'{name}: ok')
@@ -0,0 +1,32 @@
+"""
+Runs psy-test-bot.py with settings overridden for a benchmark. Other arguments are passed to the bot:
+    python -m benchmarks.run_bot --rate-limit 0 --stateless 0 --mode async
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import runpy
+import sys
+
+import config
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "psy-test-bot.py")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Runs the bot with overridden settings of config.py")
+    parser.add_argument("--rate-limit", type=int, choices=(0, 1), default=int(config.RATE_LIMIT))
+    parser.add_argument("--stateless", type=int, choices=(0, 1), default=int(config.STATELESS))
+    parser.add_argument("--max-users", type=int, default=config.MAX_USERS)
+    args, bot_args = parser.parse_known_args()
+    config.RATE_LIMIT = bool(args.rate_limit)
+    config.STATELESS = bool(args.stateless)
+    config.MAX_USERS = args.max_users
+    config.RELOAD_INTERVAL = 0
+    sys.argv = [BOT_SCRIPT] + bot_args
+    runpy.run_path(BOT_SCRIPT, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Tests of ``scheduler.ScheduledOutbox`` against the local fake Bot API: coalescing of calls, retries
+after 429 responses and token buckets. Run from the repository root:
+    python -m benchmarks.scheduler_test
+(or with pytest, the functions are plain assertions)
+"""
+from __future__ import annotations
+
+import time
+
+import telebot
+
+import fake_api
+from scheduler import ScheduledOutbox, TokenBucket
+
+FLUSH_TIMEOUT = 10  # in sec.
+
+
+def _start(**limits) -> tuple[fake_api.FakeBotAPI, telebot.TeleBot]:
+    """Starts a fake Bot API and returns it with a bot calling it"""
+    api = fake_api.start(**limits)
+    telebot.apihelper.API_URL = api.url + '/bot{0}/{1}'
+    return api, telebot.TeleBot("1:scheduler-test", threaded=False)
+
+
+def _stop(api: fake_api.FakeBotAPI, outbox: ScheduledOutbox) -> None:
+    outbox.close()
+    api.shutdown()
+    api.server_close()
+
+
+def _times(api: fake_api.FakeBotAPI, method: str, chat_id: int) -> list[float]:
+    return [call_time for call_time, name, params in api.log
+            if name == method and int(params.get("chat_id", 0) or 0) == chat_id]
+
+
+def test_token_bucket() -> None:
+    bucket = TokenBucket(rate=2, capacity=3, now=0)
+    assert bucket.wait_time(3, now=0) == 0
+    bucket.take(3, now=0)
+    assert bucket.wait_time(1, now=0) == 0.5
+    assert bucket.wait_time(1, now=0.5) == 0
+    bucket.block(2, now=0.5)  # nothing passes for 2 seconds
+    assert bucket.wait_time(0.001, now=2.4) > 0
+    assert bucket.wait_time(1, now=3) == 0
+    assert bucket.wait_time(5, now=4) == 0  # a call above the capacity waits for a full bucket, not forever
+    bucket.take(5, now=4)
+    assert bucket.wait_time(1, now=4) == 1.5
+
+
+def test_coalescing() -> None:
+    api, bot = _start()
+    message_id = bot.send_message(1, "question 1").id
+    outbox = ScheduledOutbox(bot, workers=1)
+    try:
+        with outbox._cond:  # calls are queued while no worker can take them
+            outbox.edit_message(1, message_id, "question 2")
+            outbox.edit_message(1, message_id, "question 3")  # only the last state of the message is sent
+            outbox.delete_message(2, 100)
+            outbox.send_message(2, "new question")  # delete + send = edit (message 100 does not exist)
+        assert outbox.flush(FLUSH_TIMEOUT)
+        assert outbox.stats()["coalesced"] == 2
+        assert api.calls["editMessageText"] == 2
+        assert api.messages[(1, message_id)] == "question 3"
+        # the failed edit falls back to delete + send (failed calls are counted too)
+        assert api.calls["deleteMessage"] == 1 and api.calls["sendMessage"] == 2
+        assert "new question" in api.messages.values()
+    finally:
+        _stop(api, outbox)
+
+
+def test_retry_after_blocks_all_chats() -> None:
+    api, bot = _start(chat_rate=1, retry_after=1)
+    outbox = ScheduledOutbox(bot, chat_rate=100, chat_burst=100)  # the fake API floods the chat, not the outbox
+    try:
+        start = time.monotonic()
+        for n in range(2):
+            outbox.send_message(1, f'message {n}')
+        while not outbox.stats()["retried"] and time.monotonic() - start < FLUSH_TIMEOUT:  # 429 is handled
+            time.sleep(0.01)
+        flooded = time.monotonic()
+        outbox.send_message(2, "another chat")
+        assert outbox.flush(FLUSH_TIMEOUT)
+        assert api.flood_errors == 1
+        assert outbox.stats()["retried"] == 1 and outbox.stats()["sent"] == 3
+        assert _times(api, "sendMessage", 2)[0] >= flooded + 0.9  # retry_after is applied to all chats
+    finally:
+        _stop(api, outbox)
+
+
+def test_retries_are_limited() -> None:
+    api, bot = _start(chat_rate=1, retry_after=1)
+    outbox = ScheduledOutbox(bot, chat_rate=100, chat_burst=100, max_retries=0)
+    try:
+        outbox.send_message(1, "first")
+        outbox.send_message(1, "second")
+        assert outbox.flush(FLUSH_TIMEOUT)
+        assert outbox.stats()["dropped"] == 1 and outbox.stats()["sent"] == 1
+    finally:
+        _stop(api, outbox)
+
+
+def test_chat_bucket_limits_new_messages() -> None:
+    api, bot = _start()
+    outbox = ScheduledOutbox(bot, chat_rate=10, chat_burst=1)
+    try:
+        for n in range(4):
+            outbox.send_message(1, f'message {n}')
+        assert outbox.flush(FLUSH_TIMEOUT)
+        times = _times(api, "sendMessage", 1)
+        assert len(times) == 4 and times[-1] - times[0] >= 0.25
+    finally:
+        _stop(api, outbox)
+
+
+def test_edits_and_answers_bypass_chat_bucket() -> None:
+    api, bot = _start()
+    message_id = bot.send_message(1, "question").id
+    outbox = ScheduledOutbox(bot, chat_rate=1, chat_burst=1)
+    try:
+        start = time.monotonic()
+        for n in range(5):  # answers to a question: the button is answered, the message is edited
+            outbox.answer_callback_query(1, str(n))
+            outbox.edit_message(1, message_id, f'question {n}')
+            assert outbox.flush(FLUSH_TIMEOUT)
+        assert time.monotonic() - start < 1
+        outbox.send_message(1, "first")
+        outbox.send_message(1, "second")  # waits for a token of the chat for a second
+        outbox.answer_callback_query(1, "pressed")
+        assert outbox.flush(FLUSH_TIMEOUT)
+        answered = [call_time for call_time, name, params in api.log
+                    if name == "answerCallbackQuery" and params.get("callback_query_id") == "pressed"]
+        assert answered[0] < _times(api, "sendMessage", 1)[-1]  # the answer does not wait for the message
+    finally:
+        _stop(api, outbox)
+
+
+def test_global_bucket_is_fair() -> None:
+    api, bot = _start()
+    outbox = ScheduledOutbox(bot, global_rate=20, global_burst=1)
+    try:
+        with outbox._cond:
+            outbox.send_then_edit(1, "...", None, "quiz")  # two messages
+            for chat_id in range(2, 12):
+                outbox.send_message(chat_id, "single")
+        assert outbox.flush(FLUSH_TIMEOUT)
+        # calls of single messages queued later do not keep a call of two messages waiting
+        assert _times(api, "editMessageText", 1)[0] < max(_times(api, "sendMessage", 11))
+    finally:
+        _stop(api, outbox)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f'{name}: ok')
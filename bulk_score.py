@@ -0,0 +1,323 @@
+"""
+Offline scoring of responses to a questionnaire exported from paper or web forms.
+
+A response file (CSV or Parquet) has a row per respondent and a column per question. A cell is an answer
+text of the question (matched as is, then ignoring case and surrounding spaces) or its number (0 is the first
+answer, see ``--base``). Scores and interpretations are computed exactly as in the bot: totals are sums
+of ``Quiz.score_tensor`` rows of chosen answers, and an interpretation is the record ``Quiz.get_result``
+shows for a total. The output has a row per respondent: its id (if ``--id`` is given), totals of all scales,
+numbers of interpretations of scales having them (in the order of the RESULTS block, empty if a total has
+none) and an error (a row with an unknown answer is not scored).
+
+The input is read in chunks of ``--chunk`` rows, which are scored by a pool of processes; at most
+`QUEUED_CHUNKS` chunks per process are in flight and results are written in order as they come,
+so memory does not grow with the size of the input. Parquet files need ``pyarrow``.
+    python bulk_score.py tests/GAD7.txt responses.csv -o scores.csv [--id respondent] [--base 1]
+"""
+from __future__ import annotations
+
+import csv
+import io
+import os
+import sys
+import time
+from collections import deque
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+
+from quiz import Quiz
+from quiz_cache import load_quiz
+
+CHUNK_ROWS = 50_000  # respondents scored by a process at once
+QUEUED_CHUNKS = 2  # chunks per process read ahead of the writer
+
+
+class ScoringSpec(NamedTuple):
+    """What a process scoring chunks has to know about the input and the output"""
+    quiz_filename: str
+    input_format: str  # "csv" | "parquet"
+    output_format: str  # "csv" | "parquet"
+    id_column: Optional[int]  # index of the column with ids of respondents
+    answer_columns: list[int]  # indexes of columns with answers, in the order of questions
+    base: int  # number of the first answer in the input
+    delimiter: str  # of CSV files
+
+
+class Scored(NamedTuple):
+    """Results of a chunk of respondents"""
+    ids: Optional[list]
+    totals: np.ndarray  # (respondents, scales)
+    result_ids: np.ndarray  # (respondents, scales having interpretations), -1 - no interpretation
+    errors: list[str]  # "" - the row is scored
+
+
+def answer_maps(quiz: Quiz, base: int = 0) -> list[dict[str, int]]:
+    """
+    Returns ids of answers by cell values (texts and numbers of answers) for every question.
+    Questions with the same answer options share a dictionary.
+    """
+    maps: dict[tuple, dict[str, int]] = {}
+    question_maps = []
+    for payload in quiz.payloads:
+        key = tuple(map(tuple, payload.answers))
+        mapping = maps.get(key)
+        if mapping is None:
+            mapping = {str(answer_id + base): answer_id for answer_id, _ in key}
+            mapping.update({text.strip().casefold(): answer_id for answer_id, text in key})
+            mapping.update({text: answer_id for answer_id, text in key})  # texts win over numbers
+            maps[key] = mapping
+        question_maps.append(mapping)
+    return question_maps
+
+
+def _cell(value: Any) -> str:
+    """Returns a value of a Parquet cell as a CSV cell"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def result_scales(quiz: Quiz) -> list[str]:
+    return [scale_id for scale_id in quiz.scale_ids if scale_id in quiz.results]
+
+
+def interpretation_ids(quiz: Quiz, scale_id: str, totals: np.ndarray) -> np.ndarray:
+    """Returns numbers of interpretations of totals of a scale (-1 - a total has no interpretation)"""
+    numbers = {id(record): number for number, record in enumerate(quiz.results.get(scale_id, ()))}
+    values, inverse = np.unique(totals, return_inverse=True)
+    ids = [numbers.get(id(quiz.results.get_by_interval(scale_id, value)), -1) for value in values.tolist()]
+    return np.array(ids, dtype=np.int64)[inverse.reshape(-1)]
+
+
+def score_columns(quiz: Quiz, maps: list[dict[str, int]], answer_columns: Sequence[Sequence[str]],
+                  ids: Optional[list] = None) -> Scored:
+    """
+    Scores respondents.
+
+    :param answer_columns: cells of respondents by questions
+    """
+    respondents = len(answer_columns[0]) if answer_columns else len(ids or ())
+    responses = np.empty((respondents, len(answer_columns)), dtype=np.int64)
+    for question_id, (mapping, cells) in enumerate(zip(maps, answer_columns)):
+        responses[:, question_id] = [mapping[cell] if cell in mapping else mapping.get(cell.strip().casefold(), -1)
+                                     for cell in cells]
+    invalid = (responses < 0).any(axis=1)
+    errors = [""] * respondents
+    for row in np.flatnonzero(invalid).tolist():
+        question_id = int(np.argmax(responses[row] < 0))
+        errors[row] = f'question {question_id + 1}: unknown answer {answer_columns[question_id][row]!r}'
+    totals = np.zeros((respondents, len(quiz.scale_ids)), dtype=np.int64)
+    if not invalid.all():
+        totals[~invalid] = quiz.score_batch(responses[~invalid])
+    scales = result_scales(quiz)
+    result_ids = np.full((respondents, len(scales)), -1, dtype=np.int64)
+    for i, scale_id in enumerate(scales):
+        result_ids[~invalid, i] = interpretation_ids(quiz, scale_id, totals[~invalid, quiz.scale_ids.index(scale_id)])
+    return Scored(ids, totals, result_ids, errors)
+
+
+def output_header(quiz: Quiz, id_name: Optional[str]) -> list[str]:
+    header = [id_name] if id_name is not None else []
+    return header + quiz.scale_ids + [f'{scale_id}_result' for scale_id in result_scales(quiz)] + ["error"]
+
+
+def format_csv(scored: Scored, delimiter: str = ",") -> str:
+    f = io.StringIO()
+    writer = csv.writer(f, delimiter=delimiter, lineterminator="\n")
+    result_ids = [["" if number < 0 else number for number in row] for row in scored.result_ids.tolist()]
+    for row, (totals, results, error) in enumerate(zip(scored.totals.tolist(), result_ids, scored.errors)):
+        if error:
+            totals, results = [""] * len(totals), [""] * len(results)
+        writer.writerow(([scored.ids[row]] if scored.ids is not None else []) + totals + results + [error])
+    return f.getvalue()
+
+
+def format_arrow(scored: Scored, header: list[str]) -> Any:
+    import pyarrow as pa
+
+    invalid = np.array([bool(error) for error in scored.errors], dtype=bool)
+    columns = [pa.array(scored.ids)] if scored.ids is not None else []
+    columns += [pa.array(totals, mask=invalid) for totals in scored.totals.T]
+    columns += [pa.array(numbers, mask=numbers < 0) for numbers in scored.result_ids.T]
+    columns.append(pa.array(scored.errors))
+    return pa.RecordBatch.from_arrays(columns, names=header)
+
+
+_quiz: Optional[Quiz] = None  # the questionnaire and the settings of a scoring process
+_maps: list[dict[str, int]] = []
+_spec: Optional[ScoringSpec] = None
+_header: list[str] = []
+
+
+def _init_worker(spec: ScoringSpec, header: list[str]) -> None:
+    global _quiz, _maps, _spec, _header
+    _quiz = load_quiz(spec.quiz_filename)
+    _maps = answer_maps(_quiz, spec.base)
+    _spec = spec
+    _header = header
+
+
+def _score_chunk(chunk: Any) -> tuple[Any, int, int]:
+    """
+    Scores a chunk of the input (lines of a CSV file or a ``pyarrow.RecordBatch``).
+
+    :return: the output (CSV text or a ``pyarrow.RecordBatch``), numbers of rows and of rows with errors
+    """
+    if _spec.input_format == "csv":
+        rows = list(csv.reader(chunk, delimiter=_spec.delimiter))
+        width = max(_spec.answer_columns + [_spec.id_column or 0]) + 1
+        rows = [row if len(row) >= width else row + [""] * (width - len(row)) for row in rows]
+        answers = [[row[column] for row in rows] for column in _spec.answer_columns]
+        ids = [row[_spec.id_column] for row in rows] if _spec.id_column is not None else None
+    else:
+        answers = [[_cell(value) for value in chunk.column(column).to_pylist()] for column in _spec.answer_columns]
+        ids = chunk.column(_spec.id_column).to_pylist() if _spec.id_column is not None else None
+    scored = score_columns(_quiz, _maps, answers, ids)
+    output = format_csv(scored, _spec.delimiter) if _spec.output_format == "csv" else format_arrow(scored, _header)
+    return output, len(scored.errors), len(scored.errors) - scored.errors.count("")
+
+
+def read_csv(filename: str, chunk_rows: int = CHUNK_ROWS,
+             delimiter: str = ",") -> tuple[list[str], Iterator[list[str]]]:
+    """
+    :return: the header and chunks of lines; a row with a quoted line break is kept in one chunk
+    """
+    f = open(filename, "r", encoding="utf-8-sig", newline="")
+    header = next(csv.reader(f, delimiter=delimiter), None)
+    if header is None:
+        f.close()
+        raise ValueError(f'{filename} is empty')
+
+    def chunks() -> Iterator[list[str]]:
+        with f:
+            lines: list[str] = []
+            quotes = 0  # an odd number of quotes - the last row goes on in the next line
+            for line in f:
+                lines.append(line)
+                quotes += line.count('"')
+                if len(lines) >= chunk_rows and quotes % 2 == 0:
+                    yield lines
+                    lines, quotes = [], 0
+            if lines:
+                yield lines
+
+    return header, chunks()
+
+
+def read_parquet(filename: str, chunk_rows: int = CHUNK_ROWS) -> tuple[list[str], Iterator[Any]]:
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(filename)
+    return parquet_file.schema_arrow.names, parquet_file.iter_batches(batch_size=chunk_rows)
+
+
+def file_format(filename: str) -> str:
+    return "parquet" if filename.lower().endswith((".parquet", ".pq")) else "csv"
+
+
+def score_file(quiz_filename: str, input_filename: str, output_filename: str, id_name: Optional[str] = None,
+               columns: Optional[list[str]] = None, base: int = 0, processes: Optional[int] = None,
+               chunk_rows: int = CHUNK_ROWS, delimiter: str = ",") -> tuple[int, int]:
+    """
+    Scores a file of responses.
+
+    :param id_name: str (a column with ids of respondents copied to the output), None - no ids
+    :param columns: list of columns with answers in the order of questions, None - all columns except `id_name`
+    :param processes: int (number of scoring processes), None - number of CPUs
+    :return: numbers of scored respondents and of rows with errors
+    :raise ValueError: if columns of the input do not match questions
+    """
+    quiz = load_quiz(quiz_filename)
+    input_format, output_format = file_format(input_filename), file_format(output_filename)
+    if input_format == "csv":
+        header, chunks = read_csv(input_filename, chunk_rows, delimiter)
+    else:
+        header, chunks = read_parquet(input_filename, chunk_rows)
+    if id_name is not None and id_name not in header:
+        raise ValueError(f'no column {id_name!r} in {input_filename}')
+    if columns is None:
+        columns = [name for name in header if name != id_name]
+    missing = [name for name in columns if name not in header]
+    if missing:
+        raise ValueError(f'no columns {", ".join(map(repr, missing))} in {input_filename}')
+    if len(columns) != len(quiz.questions):
+        raise ValueError(f'{len(columns)} columns with answers are given, {quiz.title} has '
+                         f'{len(quiz.questions)} questions')
+    spec = ScoringSpec(quiz_filename, input_format, output_format,
+                       header.index(id_name) if id_name is not None else None,
+                       [header.index(name) for name in columns], base, delimiter)
+    out_header = output_header(quiz, id_name)
+    scored = errors = 0
+    writer: Any = None
+    if output_format == "csv":
+        writer = open(output_filename, "w", encoding="utf8", newline="")
+        csv.writer(writer, delimiter=delimiter, lineterminator="\n").writerow(out_header)
+
+    def write(result: tuple[Any, int, int]) -> None:
+        nonlocal writer, scored, errors
+        output, rows, failed = result
+        if output_format == "csv":
+            writer.write(output)
+        else:
+            import pyarrow.parquet as pq
+
+            if writer is None:
+                writer = pq.ParquetWriter(output_filename, output.schema)
+            writer.write_batch(output)
+        scored += rows
+        errors += failed
+
+    processes = processes if processes is not None else (os.cpu_count() or 1)
+    try:
+        if processes < 2:
+            _init_worker(spec, out_header)
+            for chunk in chunks:
+                write(_score_chunk(chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                     initargs=(spec, out_header)) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.submit(_score_chunk, chunk))
+                    if len(pending) >= processes * QUEUED_CHUNKS:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+    finally:
+        if writer is not None:
+            writer.close()
+    return scored, errors
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Scores responses to a questionnaire exported to CSV or Parquet")
+    parser.add_argument("quiz", help="a questionnaire file (see README.md)")
+    parser.add_argument("input", help="responses: a CSV file (with a header) or a Parquet file (.parquet)")
+    parser.add_argument("-o", "--output", required=True, help="scores: a CSV or a Parquet file (.parquet)")
+    parser.add_argument("--id", default=None, help="a column with ids of respondents copied to the output")
+    parser.add_argument("--columns", default=None,
+                        help="comma separated columns with answers in the order of questions "
+                             "(default: all columns except --id)")
+    parser.add_argument("--base", type=int, default=0, help="number of the first answer of a question (e.g. 1)")
+    parser.add_argument("--processes", type=int, default=None, help="number of processes (default: number of CPUs)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_ROWS, help="rows scored by a process at once")
+    parser.add_argument("--delimiter", default=",", help="delimiter of CSV files")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    try:
+        respondents, failed = score_file(args.quiz, args.input, args.output, args.id,
+                                         args.columns.split(",") if args.columns else None, args.base,
+                                         args.processes, args.chunk, args.delimiter)
+    except ImportError as err:
+        sys.exit(f'Parquet files need pyarrow: {err}')
+    except (OSError, ValueError) as err:
+        sys.exit(str(err))
+    seconds = time.perf_counter() - start
+    print(f'{respondents} respondent(s) scored in {seconds:.1f} sec. ({respondents / max(seconds, 1e-9):.0f} rows/s), '
+          f'{failed} row(s) with errors', file=sys.stderr)
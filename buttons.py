@@ -1,7 +1,11 @@
 from __future__ import annotations
 
+import json
+from typing import NamedTuple, Optional
+
 import telebot
 from config import LANGUAGE
+from messages import LOCALES
 
 BTN = telebot.types.InlineKeyboardButton
 
@@ -18,6 +22,24 @@ def make_button(key: str, language=LANGUAGE):
     return BTN(button_text[key][language], callback_data=key)
 
 
+class ButtonSet(NamedTuple):
+    """The standard buttons of a locale"""
+    next: telebot.types.InlineKeyboardButton
+    ok: telebot.types.InlineKeyboardButton
+    quit: telebot.types.InlineKeyboardButton
+
+
+button_sets: dict[str, ButtonSet] = {locale: ButtonSet(make_button("next", locale), make_button("ok", locale),
+                                                       make_button("quit", locale))
+                                     for locale in LOCALES}
+
+
+def buttons_for(locale: Optional[str]) -> ButtonSet:
+    """Returns the standard buttons of a locale (of `LANGUAGE` if the locale is None or not supported)"""
+    buttons = button_sets.get(locale)
+    return buttons if buttons is not None else button_sets[LANGUAGE]
+
+
 BTN_QUIT = make_button("quit")
 
 BTN_OK = make_button("ok")
@@ -33,5 +55,42 @@ def make_inline_buttons(buttons_text: list[str],
 def make_inline_kb(buttons_text: list[str], buttons_callback_data: list[str],
                    row_width: int = 1) -> telebot.types.InlineKeyboardMarkup:
     btns = make_inline_buttons(buttons_text, buttons_callback_data)
-    return telebot.types.InlineKeyboardMarkup(*btns, row_width=row_width)
+    return telebot.types.InlineKeyboardMarkup(row_width=row_width).add(*btns)
+
+
+def answer_callback_data(question_id: int, answer_id: int) -> str:
+    """Returns callback data of an answer button (parsed back by ``_parse_answer_callback``)"""
+    return f'Q#{question_id}_A#{answer_id}'
+
+
+def answers_kb_json(answers: list[tuple[int, str]], question_id: int) -> str:
+    """
+    Returns serialized inline keyboard with answer options of a question.
+    Bot API accepts it as `reply_markup` as is, so it can be computed once and reused.
+
+    :param answers: list of pairs of answer id and answer text
+    :param question_id: int
+    """
+    return make_inline_kb([text for _, text in answers],
+                          [answer_callback_data(question_id, answer_id) for answer_id, _ in answers]).to_json()
+
+
+QUESTION_PLACEHOLDER = "\x00"  # stands for a question id in keyboard templates (escaped in JSON)
+
+
+def answers_kb_template(answers: list[tuple[int, str]]) -> Optional[tuple[str, ...]]:
+    """
+    Returns serialized inline keyboard with answer options split at the places of the question id,
+    so keyboards of all questions with the same answer options are made from one template
+    by ``render_answers_kb``.
+
+    :param answers: list of pairs of answer id and answer text
+    :return: tuple of strings, or None if answer texts contain the placeholder
+    """
+    parts = tuple(answers_kb_json(answers, QUESTION_PLACEHOLDER).split(json.dumps(QUESTION_PLACEHOLDER)[1:-1]))
+    return parts if len(parts) == len(answers) + 1 else None
+
 
+def render_answers_kb(template: tuple[str, ...], question_id: int) -> str:
+    """Returns serialized inline keyboard of a question made from a template (see ``answers_kb_template``)"""
+    return str(question_id).join(template)
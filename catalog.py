@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+
+from quiz import Quiz
+from quiz_cache import load_quiz, refresh_cache
+
+log = logging.getLogger(__name__)
+
+PARALLEL_THRESHOLD = 32  # smaller catalogs are loaded in the main process (a pool costs more than it saves)
+
+
+class LoadReport(NamedTuple):
+    filename: str
+    quiz: Optional[Quiz]
+    error: Optional[str]  # description of a parse error, None if the questionnaire is loaded
+    seconds: float  # time spent on loading (parsing) the questionnaire
+
+
+def _load(filename: str, seconds: float = 0.0) -> LoadReport:
+    start = time.perf_counter() - seconds
+    try:
+        quiz = load_quiz(filename)
+    except Exception as err:
+        return LoadReport(filename, None, f'{err.__class__.__name__}: {err}', time.perf_counter() - start)
+    return LoadReport(filename, quiz, None, time.perf_counter() - start)
+
+
+def _compile(filename: str) -> LoadReport:
+    """Is run in a pool: compiles a questionnaire to the quiz cache, the report has no ``Quiz``"""
+    start = time.perf_counter()
+    try:
+        refresh_cache(filename)
+    except Exception as err:
+        return LoadReport(filename, None, f'{err.__class__.__name__}: {err}', time.perf_counter() - start)
+    return LoadReport(filename, None, None, time.perf_counter() - start)
+
+
+def compile_catalog(filenames: list[str], workers: Optional[int] = None) -> list[LoadReport]:
+    """
+    Compiles stale questionnaires to the quiz cache (see quiz_cache.py) across a pool of processes,
+    without loading them: e.g. the dispatcher of the multi-process mode compiles the catalog for its workers,
+    which are daemonic processes and cannot have a pool of their own (see workers.py).
+
+    :param filenames: list of filenames of questionnaires
+    :param workers: int (number of processes), None means the number of CPUs
+    :return: list of ``LoadReport`` without quizzes, in the order of sorted filenames
+    """
+    filenames = sorted(filenames)
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    if workers < 2 or len(filenames) < PARALLEL_THRESHOLD:
+        return [_compile(filename) for filename in filenames]
+    chunksize = max(1, len(filenames) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_compile, filenames, chunksize=chunksize))
+
+
+def load_catalog(filenames: list[str], workers: Optional[int] = None) -> list[LoadReport]:
+    """
+    Loads questionnaires across a pool of processes. Processes of the pool compile stale questionnaires
+    to the quiz cache (see ``compile_catalog``), and the main process loads them from the cache, so compiled
+    questionnaires are not pickled back through the pool.
+
+    Reports are returned in the order of sorted filenames, so the catalog is the same on every start.
+    A file which cannot be parsed does not abort loading of the others, its report contains the error.
+
+    :param filenames: list of filenames of questionnaires
+    :param workers: int (number of processes), None means the number of CPUs
+    :return: list of ``LoadReport``
+    """
+    filenames = sorted(filenames)
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    if workers < 2 or len(filenames) < PARALLEL_THRESHOLD:
+        return [_load(filename) for filename in filenames]
+    compiled = compile_catalog(filenames, workers)
+    return [report if report.error is not None else _load(report.filename, report.seconds) for report in compiled]
+
+
+def _report(reports: list[LoadReport], slowest: int) -> Iterator[tuple[int, str]]:
+    """Yields lines of a report on loading with their logging levels"""
+    loaded = [report for report in reports if report.error is None]
+    yield logging.INFO, (f'{len(loaded)} of {len(reports)} questionnaire(s) loaded in '
+                         f'{sum(report.seconds for report in reports):.3f} sec. (total per-file time)')
+    for report in reports:
+        if report.error is not None:
+            yield logging.WARNING, f'FAILED {report.filename}: {report.error}'
+        elif report.quiz.result_issues:
+            for issue in report.quiz.result_issues:
+                yield logging.WARNING, f'WARNING {report.filename}: {issue}'
+    for report in sorted(loaded, key=lambda r: r.seconds, reverse=True)[:slowest]:
+        result_cache = report.quiz.result_cache
+        yield logging.DEBUG, (f'{report.seconds * 1000:8.2f} ms  {report.filename}  ({report.quiz.answer_sets} '
+                              f'answer set(s), dedup ratio {report.quiz.dedup_ratio:.1f}, {result_cache.space} '
+                              f'score vector(s), results cache: {result_cache.mode})')
+
+
+def log_report(reports: list[LoadReport], slowest: int = 5) -> None:
+    """
+    Logs the number of loaded questionnaires and parse errors; the slowest questionnaires are logged
+    at DEBUG level with their dedup ratios of answer sets (questions per distinct set of answer options)
+    and sizes of score spaces (see result_cache.py)
+    """
+    for level, line in _report(reports, slowest):
+        log.log(level, '%s', line)
+
+
+def print_report(reports: list[LoadReport], slowest: int = 5) -> None:
+    """Prints the report of ``log_report`` (all of its lines)"""
+    for level, line in _report(reports, slowest):
+        print(line if level == logging.INFO else f'  {line}')
+
+
+if __name__ == "__main__":
+    import argparse
+    from config import TESTS_DIR, TEST_EXTN
+    parser = argparse.ArgumentParser(description="Loads all questionnaires and reports parse errors and timings")
+    parser.add_argument("directory", nargs="?", default=TESTS_DIR, help="a directory with questionnaires")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes")
+    args = parser.parse_args()
+    names = [os.path.join(args.directory, name) for name in os.listdir(args.directory) if name.endswith(TEST_EXTN)]
+    all_reports = load_catalog(names, args.workers)
+    print_report(all_reports, slowest=len(all_reports))
@@ -1,8 +1,12 @@
 # CONFIGURATION FILE FOR PSY-TEST-BOT
+import json
+import os
 
-LANGUAGE = "RU"  # RU | EN supported
+LANGUAGE = "RU"  # RU | EN supported, the language of users with other languages
 
-MAX_USERS = 10
+AUTO_LOCALE = True  # messages are in the language of a user's Telegram app (False - LANGUAGE for everyone)
+
+MAX_USERS = 200_000  # upper bound of sessions kept in memory at the same time
 
 MAX_TIME = 900  # in sec.
 
@@ -10,6 +14,37 @@ MAX_SESSION_TIME = 1800  # in sec.
 
 MAX_IDLE_TIME = 420  # in sec.
 
+SWEEP_INTERVAL = 1  # in sec., how often expired sessions are removed in background (0 - only when MAX_USERS is reached)
+
+GOODBYE_RATE = 10  # goodbye messages per sec. to users whose sessions are removed in background
+
 TESTS_DIR = "tests"  # a directory where tests (questionnaires) are stored
 
 TEST_EXTN = "txt"  # files' extension for files with tests (questionnaires)
+
+QUIZ_CACHE_DIR = "__quizcache__"  # a subdirectory of TESTS_DIR where precompiled questionnaires are stored
+
+LAZY_QUESTIONS = 1000  # questionnaires with more questions read them from the file on demand (None - never)
+
+LOAD_WORKERS = None  # number of processes loading questionnaires at start (None - number of CPUs)
+
+RELOAD_INTERVAL = 5  # in sec., how often TESTS_DIR is checked for new and changed questionnaires (0 - never)
+
+EDIT_IN_PLACE = True  # a quiz advances by editing the message with a question (False - delete it and send new one)
+
+RATE_LIMIT = True  # Bot API calls are queued and sent under rate limits of Telegram (see scheduler.py)
+
+SESSION_DB = None  # path to a SQLite file where sessions are saved to survive restarts (None - memory only)
+
+NORMS_DIR = None  # directory where completions are logged to show users their percentiles (None - off)
+
+STATELESS = False  # progress of a quiz is kept in callback data of buttons instead of memory (see stateless.py)
+
+LOG_LEVEL = "INFO"  # DEBUG | INFO | WARNING | ERROR (None - no logging at all)
+
+METRICS_PORT = None  # port of a local endpoint with metrics in Prometheus text format (None - off)
+
+# worker processes of the multi-process mode import this file anew: settings of the main process
+# (including ones changed at run time, e.g. by benchmarks) are passed to them in this environmental variable
+SETTINGS_ENV = "PSYBOT_SETTINGS"
+globals().update(json.loads(os.getenv(SETTINGS_ENV) or "{}"))
@@ -18,4 +18,37 @@ class MaximumUsersNumberReached(Err):
         self.msg = msg
 
     def __str__(self):
-        return self.msg
\ No newline at end of file
+        return self.msg
+
+
+class InvalidCallbackData(Err):
+    """
+    Raises when callback data of a stateless session is malformed, forged or made for another user.
+    """
+    pass
+
+
+class QuizSyntaxError(Err, ValueError):
+    """
+    Raises when a questionnaire file is malformed. Points to the line and the column of the error.
+    """
+    def __init__(self, filename: str, line: int, column: int, message: str):
+        self.filename = filename
+        self.line = line
+        self.column = column
+        self.msg = message
+
+    def __str__(self):
+        return f'{self.filename}:{self.line}:{self.column}: {self.msg}'
+
+
+class QuizFileChanged(Err):
+    """
+    Raises when a question of a large questionnaire is read on demand, but the questionnaire file
+    has changed since its questions were indexed (see question_bank.py).
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+
+    def __str__(self):
+        return f'{self.filename} has changed since its questions were indexed'
@@ -0,0 +1,201 @@
+"""
+Local stand-in for Telegram Bot API, for offline tests and benchmarks.
+
+It implements getUpdates (updates are pushed by a test with ``push_update``), sendMessage, editMessageText,
+deleteMessage and answerCallbackQuery, counts calls by methods and can emulate flood limits of Telegram
+(429 responses with `retry_after`).
+Point the bot to it with the environmental variable BOT_API_URL, e.g.:
+    python fake_api.py --port 8081 --chat-rate 1
+    BOT_API_URL=http://127.0.0.1:8081 python psy-test-bot.py
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeBotAPI(ThreadingHTTPServer):
+    """
+    HTTP server answering Bot API requests (``/bot<token>/<method>``).
+
+    :param address: tuple of host and port (port 0 means any free port)
+    :param chat_rate: float (messages per second allowed for a chat, 0 - no limit)
+    :param global_rate: float (messages per second allowed for all chats, 0 - no limit)
+    :param retry_after: int (in sec., `retry_after` of 429 responses)
+    :param latency: float (in sec., delay of every response)
+    """
+    daemon_threads = True
+    RATE_LIMITED = ("sendMessage", "editMessageText", "deleteMessage")
+
+    def __init__(self, address: tuple[str, int] = ("127.0.0.1", 0), chat_rate: float = 0,
+                 global_rate: float = 0, retry_after: int = 1, latency: float = 0):
+        super().__init__(address, FakeBotAPIHandler)
+        self.chat_rate = chat_rate
+        self.global_rate = global_rate
+        self.retry_after = retry_after
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.flood_errors = 0
+        self.messages: dict[tuple[int, int], str] = {}  # (chat id, message id) -> text of existing messages
+        self.log: list[tuple[float, str, dict]] = []  # (time, method, params) of all successful calls
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._updates: deque[dict] = deque()  # updates not confirmed by the bot yet
+        self._chat_calls: defaultdict[int, deque[float]] = defaultdict(deque)
+        self._all_calls: deque[float] = deque()
+        self._lock = threading.Lock()
+        self._new_updates = threading.Condition(self._lock)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def push_update(self, update: dict) -> int:
+        """
+        Queues an update for getUpdates. `update` is an update without `update_id`, e.g. {"message": {...}}.
+
+        :return: update id
+        """
+        with self._lock:
+            update_id = next(self._update_ids)
+            self._updates.append({"update_id": update_id, **update})
+            self._new_updates.notify_all()
+        return update_id
+
+    def _get_updates(self, params: dict[str, Any]) -> list[dict]:
+        """Confirms updates before `offset` and waits up to `timeout` seconds for new ones (long polling)"""
+        offset = int(params.get("offset") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        timeout = float(params.get("timeout") or 0)
+        if not self._updates and timeout > 0:
+            self._new_updates.wait_for(lambda: self._updates, timeout)
+        limit = int(params.get("limit") or 100)
+        return list(itertools.islice(self._updates, limit))
+
+    def _flooded(self, chat_id: int, now: float) -> bool:
+        """Tells if a call exceeds limits (calls of the last second are counted)"""
+        chat_calls = self._chat_calls[chat_id]
+        for calls in (chat_calls, self._all_calls):
+            while calls and calls[0] <= now - 1:
+                calls.popleft()
+        if (self.chat_rate and len(chat_calls) >= self.chat_rate) or \
+                (self.global_rate and len(self._all_calls) >= self.global_rate):
+            return True
+        chat_calls.append(now)
+        self._all_calls.append(now)
+        return False
+
+    def call(self, method: str, params: dict[str, Any]) -> tuple[HTTPStatus, dict]:
+        """Executes a Bot API method and returns status and JSON response"""
+        with self._lock:
+            now = time.monotonic()
+            chat_id = int(params.get("chat_id", 0) or 0)
+            if method in self.RATE_LIMITED and self._flooded(chat_id, now):
+                self.flood_errors += 1
+                return HTTPStatus.TOO_MANY_REQUESTS, {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after}}
+            self.calls[method] += 1
+            self.log.append((now, method, params))
+            return self._result(method, params, chat_id)
+
+    def _result(self, method: str, params: dict[str, Any], chat_id: int) -> tuple[HTTPStatus, dict]:
+        if method == "getUpdates":
+            return HTTPStatus.OK, {"ok": True, "result": self._get_updates(params)}
+        if method == "getMe":
+            return HTTPStatus.OK, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "fake",
+                                                          "username": "fake_bot"}}
+        if method == "sendMessage":
+            message_id = next(self._message_ids)
+            self.messages[(chat_id, message_id)] = params.get("text", "")
+            return HTTPStatus.OK, {"ok": True, "result": self._message(chat_id, message_id, params)}
+        if method == "editMessageText":
+            message_id = int(params.get("message_id", 0))
+            if (chat_id, message_id) not in self.messages:
+                return self._error(HTTPStatus.BAD_REQUEST, "Bad Request: message to edit not found")
+            if self.messages[(chat_id, message_id)] == params.get("text") and "reply_markup" not in params:
+                return self._error(HTTPStatus.BAD_REQUEST, "Bad Request: message is not modified")
+            self.messages[(chat_id, message_id)] = params.get("text", "")
+            return HTTPStatus.OK, {"ok": True, "result": self._message(chat_id, message_id, params)}
+        if method == "deleteMessage":
+            if self.messages.pop((chat_id, int(params.get("message_id", 0))), None) is None:
+                return self._error(HTTPStatus.BAD_REQUEST, "Bad Request: message to delete not found")
+            return HTTPStatus.OK, {"ok": True, "result": True}
+        if method == "answerCallbackQuery":
+            return HTTPStatus.OK, {"ok": True, "result": True}
+        return self._error(HTTPStatus.NOT_FOUND, "Not Found: method not found")
+
+    @staticmethod
+    def _message(chat_id: int, message_id: int, params: dict[str, Any]) -> dict:
+        return {"message_id": message_id, "date": int(time.time()), "text": params.get("text", ""),
+                "chat": {"id": chat_id, "type": "private"}}
+
+    @staticmethod
+    def _error(status: HTTPStatus, description: str) -> tuple[HTTPStatus, dict]:
+        return status, {"ok": False, "error_code": int(status), "description": description}
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    server: FakeBotAPI
+
+    def _handle(self) -> None:
+        url = urlsplit(self.path)
+        method = url.path.rsplit("/", 1)[-1]
+        params: dict[str, Any] = dict(parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = self.rfile.read(length)
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params.update(json.loads(body))
+            else:
+                params.update(parse_qsl(body.decode()))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        status, response = self.server.call(method, params)
+        payload = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def start(chat_rate: float = 0, global_rate: float = 0, retry_after: int = 1, latency: float = 0,
+          address: tuple[str, int] = ("127.0.0.1", 0)) -> FakeBotAPI:
+    """Starts a fake Bot API server in a background thread"""
+    server = FakeBotAPI(address, chat_rate=chat_rate, global_rate=global_rate,
+                        retry_after=retry_after, latency=latency)
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-bot-api").start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Local stand-in for Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--chat-rate", type=float, default=0, help="messages per second per chat (0 - no limit)")
+    parser.add_argument("--global-rate", type=float, default=0, help="messages per second (0 - no limit)")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after of 429 responses, in sec.")
+    parser.add_argument("--latency", type=float, default=0, help="delay of every response, in sec.")
+    args = parser.parse_args()
+    fake = FakeBotAPI((args.host, args.port), chat_rate=args.chat_rate, global_rate=args.global_rate,
+                      retry_after=args.retry_after, latency=args.latency)
+    print(f'Fake Bot API is listening at {fake.url}')
+    fake.serve_forever()
@@ -0,0 +1,125 @@
+"""
+Catalog of messages of the bot in all supported languages.
+
+Translations are compiled once at import into a ``Messages`` tuple per locale, so a handler takes a message
+by attribute (``messages_for(locale).session_over``) instead of building a dictionary of translations
+on every call. The locale of a user is chosen by the language of the user's Telegram app (see ``locale_of``)
+and is kept in the user's session. Buttons of every locale are prebuilt in buttons.py.
+"""
+from __future__ import annotations
+
+import functools
+from typing import NamedTuple, Optional
+
+from config import AUTO_LOCALE, LANGUAGE
+
+LOCALES = ("RU", "EN")
+
+_LOCALES = {locale: locale for locale in LOCALES}
+
+LANGUAGE_CODES = {"ru": "RU", "en": "EN"}  # locales by primary subtags of IETF language tags
+
+
+class Messages(NamedTuple):
+    quiz_starting: str
+    session_over: str
+    max_users: str
+    unregistered: str
+    quiz_changed: str  # the questionnaire file has changed while a user was taking the quiz
+    start_menu: str
+    disclaimer: str
+    author: str
+    credits: str
+    results: str  # the first line of results
+    about_scale: str  # is followed by a name of a scale in results
+    percentiles: str  # the first line of percentiles of scales (see norms.py)
+    percentile: str  # a line of percentiles, formatted with a name of a scale and a percentile
+
+
+TRANSLATIONS: dict[str, dict[str, str]] = {
+    "quiz_starting": {"RU": "загружается текст опросника...",
+                      "EN": "quiz is starting..."},
+    "session_over": {"RU": "Ваш сеанс работы завершён. Для возобновления работы выберите команду /start .",
+                     "EN": "Your session is over. Please, select a /start command to start a new session"},
+    "max_users": {"RU": "Достигнуто максимально количество пользователей, попробуйте позднее",
+                  "EN": "Max number of users is reached. Try again later"},
+    "unregistered": {"RU": "Для начала работы введите команду /start",
+                     "EN": "To start a session type the command /start"},
+    "quiz_changed": {"RU": "Тест изменён, пока вы его проходили. Выберите тест заново.",
+                     "EN": "The test has been changed while you were taking it. Please, choose a test again."},
+    "start_menu": {"RU": "В этом чатботе можно пройти несколько проверенных психологических тестов.\n"
+                         "Выбирите тест из списка ниже.",
+                   "EN": "You can take few psychological assessments (test) using this chatbot.\n"
+                         "Please, choose a test from the list below."},
+    "disclaimer": {"RU": "Представленная здесь информация не является профессиональной консультацией "
+                         "и не заменяет обращения к специалисту. Не воспринимайте результаты тестов как "
+                         "истину в последней инстанции. Вся информация размещена в информацонных и развлекательных "
+                         "целях.",
+                   "EN": "Information in this chatbot is not a professional advice, and is not any "
+                         "kind of substitution for seeking a professional advice. Please, do not take test "
+                         "results as ultimate truth. All information is presented for informational "
+                         "and entertainment purposes."},
+    "author": {"RU": "Разработчик чатбота @EdFromChelly. Обращайтесь по вопросам развития чатбота, "
+                     "присылайте сообщения о выявленных ошибках, предложения новых тестов.\n"
+                     "Заказывайте разработку своего чатбота :).",
+               "EN": "This chatbot is developed by @EdFromChelly. Send a message regarding a "
+                     "development of this chatbot, report about errors discovered by you, offer new "
+                     "tests (questionnaire). \nOrder your own chatbot:)."},
+    "credits": {"RU": "Разработчик благодарит за профессиональную помощь в развитии бота телеграм-каналы "
+                      "@mariamalko и @psyhologia",
+                "EN": "A developer of this chatbot appreciates telegram-channels @mariamalko and "
+                      "@psyhologia for professional help with the chatbot's development"},
+    "results": {"RU": "Ваши результаты:\n",
+                "EN": "That is your results:\n"},
+    "about_scale": {"RU": "По шкале ",
+                    "EN": "Measurements of the scale "},
+    "percentiles": {"RU": "\nВ сравнении с другими прошедшими тест (процент результатов ниже вашего):\n",
+                    "EN": "\nCompared with others who took the test (percent of results lower than yours):\n"},
+    "percentile": {"RU": "{scale}: {percentile}%\n",
+                   "EN": "{scale}: {percentile}%\n"},
+}
+
+
+def compile_catalog(translations: dict[str, dict[str, str]]) -> dict[str, Messages]:
+    """
+    Compiles translations to ``Messages`` by locales.
+
+    :raise ValueError: if a message is not translated to a locale of `LOCALES`
+    """
+    for key, texts in translations.items():
+        missing = [locale for locale in LOCALES if locale not in texts]
+        if missing:
+            raise ValueError(f'message {key!r} has no translation to {", ".join(missing)}')
+    return {locale: Messages(**{key: texts[locale] for key, texts in translations.items()}) for locale in LOCALES}
+
+
+CATALOG: dict[str, Messages] = compile_catalog(TRANSLATIONS)
+
+
+def messages_for(locale: Optional[str]) -> Messages:
+    """Returns messages of a locale (of `LANGUAGE` if the locale is None or not supported)"""
+    return CATALOG[_LOCALES.get(locale, LANGUAGE)]
+
+
+def resolve_locale(locale: Optional[str]) -> str:
+    """Returns the locale whose messages are shown for `locale` (`LANGUAGE` if it is None or not supported)"""
+    return _LOCALES.get(locale, LANGUAGE)
+
+
+def supported_locale(locale: Optional[str]) -> Optional[str]:
+    """
+    Returns the string of `LOCALES` equal to `locale` (None if it is not supported), so sessions restored
+    from a database share one string per locale.
+    """
+    return _LOCALES.get(locale)
+
+
+@functools.lru_cache(maxsize=256)
+def locale_of(language_code: Optional[str]) -> str:
+    """
+    Returns the locale for the language of a Telegram user (``telebot.types.User.language_code``,
+    e.g. "en-US"). `LANGUAGE` is returned for unsupported languages and if AUTO_LOCALE is off.
+    """
+    if not AUTO_LOCALE or not language_code:
+        return LANGUAGE
+    return LANGUAGE_CODES.get(language_code.split("-")[0].lower(), LANGUAGE)
@@ -0,0 +1,250 @@
+"""
+Low-overhead metrics of the bot exposed in Prometheus text format.
+
+Metrics are kept in memory by ``Counter``, ``Gauge`` and ``Histogram`` objects of a ``Registry``.
+Observing a value takes a lock and a bisect over fixed buckets, so it is cheap enough for every update.
+``serve`` runs an HTTP server answering ``GET /metrics`` in a background thread.
+"""
+from __future__ import annotations
+
+import bisect
+import functools
+import threading
+import time
+from collections.abc import Callable
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+import telebot
+import telebot.asyncio_helper
+
+METRICS_HOST = "127.0.0.1"
+
+# in sec., upper bounds of histogram buckets (+Inf is implied)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """
+    Base class of a metric family: values by tuples of label values.
+
+    :param name: str (name of the metric)
+    :param help: str (description)
+    :param labels: tuple of label names
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._lock = threading.Lock()
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_labels(self.label_names, labels)} {value}' for labels, value in values]
+
+
+class Gauge(Metric):
+    """A value read by a function when metrics are collected (e.g. a number of sessions)"""
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        super().__init__(name, help)
+        self.read = read
+
+    def samples(self) -> list[str]:
+        return [f'{self.name} {self.read()}']
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: dict[tuple[str, ...], list[int]] = {}  # per bucket (the last one is +Inf)
+        self._sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+                self._sums[labels] = 0.0
+            counts[index] += 1
+            self._sums[labels] += value
+
+    def count(self, *labels: str) -> int:
+        return sum(self._counts.get(labels, ()))
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            families = sorted((labels, list(counts), self._sums[labels]) for labels, counts in self._counts.items())
+        lines = []
+        for labels, counts, total in families:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Any:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+registry = Registry()
+
+handler_seconds: Histogram = registry.register(
+    Histogram("psybot_handler_seconds", "Time of processing an update by a handler", ("handler",)))
+handler_errors: Counter = registry.register(
+    Counter("psybot_handler_errors_total", "Exceptions raised by handlers", ("handler",)))
+api_call_seconds: Histogram = registry.register(
+    Histogram("psybot_bot_api_call_seconds", "Duration of Bot API calls", ("method",)))
+api_errors: Counter = registry.register(
+    Counter("psybot_bot_api_errors_total", "Failed Bot API calls by error codes (0 - network errors)",
+            ("method", "code")))
+rejected_users: Counter = registry.register(
+    Counter("psybot_rejected_users_total", "New users rejected because MAX_USERS is reached"))
+
+
+def timed(handler: Callable) -> Callable:
+    """Decorator of a handler: observes its duration in `handler_seconds` and counts its exceptions"""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return handler(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+def _error_code(err: Exception) -> str:
+    if isinstance(err, telebot.apihelper.ApiTelegramException):
+        return str(err.error_code)
+    return "0"
+
+
+def instrument_bot_api() -> None:
+    """
+    Wraps the functions making HTTP requests of telebot (sync and asyncio), so every Bot API call
+    is timed in `api_call_seconds` and failures are counted in `api_errors`.
+    """
+    make_request = telebot.apihelper._make_request
+    if getattr(make_request, "instrumented", False):
+        return
+
+    @functools.wraps(make_request)
+    def timed_request(token, method_name, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return make_request(token, method_name, *args, **kwargs)
+        except Exception as err:
+            api_errors.inc(method_name, _error_code(err))
+            raise
+        finally:
+            api_call_seconds.observe(time.perf_counter() - start, method_name)
+
+    process_request = telebot.asyncio_helper._process_request
+
+    @functools.wraps(process_request)
+    async def timed_async_request(token, url, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await process_request(token, url, *args, **kwargs)
+        except Exception as err:
+            api_errors.inc(url, _error_code(err))
+            raise
+        finally:
+            api_call_seconds.observe(time.perf_counter() - start, url)
+
+    timed_request.instrumented = True
+    telebot.apihelper._make_request = timed_request
+    telebot.asyncio_helper._process_request = timed_async_request
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    server: MetricsServer
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_response(HTTPStatus.NOT_FOUND)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        payload = self.server.registry.render().encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], registry: Registry):
+        super().__init__(address, MetricsHandler)
+        self.registry = registry
+
+
+def serve(port: int, host: str = METRICS_HOST, metrics: Optional[Registry] = None) -> MetricsServer:
+    """Starts the metrics endpoint (``http://host:port/metrics``) in a background thread"""
+    server = MetricsServer((host, port), metrics if metrics is not None else registry)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
@@ -0,0 +1,313 @@
+"""
+Population norms of questionnaires: percentiles of users' scores among all completions.
+
+Every completed quiz is appended to a binary log of its questionnaire (``<quiz id>.log`` in NORMS_DIR):
+a header with reachable ranges of scales, then fixed-size records of a timestamp and scale totals.
+Distributions of totals are kept as fixed histograms, one per scale: scores are integers with small reachable
+ranges, so a bin is a single score unless a range is wider than `NORM_BINS`. Memory and time of a percentile
+are bounded by `NORM_BINS`, however many completions are logged.
+
+Histograms follow the log rather than the bot's own completions: a completion is appended to the log and
+then all records appended since the last read (by any process) are added. So processes sharing NORMS_DIR
+(see workers.py) see each other's completions, and a snapshot of histograms (``<quiz id>.npz``) records
+the position in the log it is consistent with. At start, a snapshot is loaded and the rest of the log is
+replayed. Snapshots are rebuilt from logs by:
+    python -m norms [NORMS_DIR]
+A changed questionnaire gets a new id (``Quiz.quiz_id``), so its norms start anew.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import struct
+import threading
+import time
+from collections.abc import Sequence
+from typing import Optional
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+NORM_BINS = 1024  # maximum number of bins of a histogram of a scale
+NORM_MIN_COMPLETIONS = 100  # percentiles are not reported until a questionnaire is completed this many times
+SNAPSHOT_INTERVAL = 10_000  # histograms are saved after this many new completions of a questionnaire
+READ_CHUNK = 1 << 16  # records read at once when a log is replayed
+
+LOG_EXTN = "log"
+SNAPSHOT_EXTN = "npz"
+MAGIC = b"PSYNORM1"
+HEADER = struct.Struct("<8sIH")  # magic, quiz id, number of scales; followed by (min, max) of every scale
+RANGE = struct.Struct("<ii")
+
+
+def record_dtype(scales: int) -> np.dtype:
+    """Returns the type of a record of a log: time of a completion and totals of scales"""
+    return np.dtype([("time", "<u4"), ("scores", "<i4", (scales,))])
+
+
+def read_header(f) -> tuple[int, list[tuple[int, int]]]:
+    """
+    Reads the header of a log.
+
+    :return: quiz id and reachable ranges of scales (min, max)
+    :raise ValueError: if the file is not a log of norms
+    """
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("the header is truncated")
+    magic, quiz_id, scales = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("not a log of norms")
+    ranges = f.read(RANGE.size * scales)
+    if len(ranges) < RANGE.size * scales:
+        raise ValueError("the header is truncated")
+    return quiz_id, [RANGE.unpack_from(ranges, i * RANGE.size) for i in range(scales)]
+
+
+class Histograms:
+    """
+    Histograms of totals of scales.
+
+    :param score_ranges: list of reachable ranges of scores (min, max) of scales
+    :param bins: int (maximum number of bins of a scale)
+    """
+
+    def __init__(self, score_ranges: Sequence[tuple[int, int]], bins: int = NORM_BINS):
+        self.lows = np.array([low for low, _ in score_ranges], dtype=np.int64)
+        spans = np.array([high - low + 1 for low, high in score_ranges], dtype=np.int64)
+        self.widths = np.maximum(1, -(-spans // bins))  # scores per bin
+        self.bins = -(-spans // self.widths)  # bins of every scale
+        self.counts = np.zeros((len(score_ranges), int(self.bins.max(initial=1))), dtype=np.int64)
+        self.total = 0
+
+    def _bins_of(self, scores: np.ndarray) -> np.ndarray:
+        """Bins of score vectors (an array of shape (vectors, scales)); scores out of ranges fall to edge bins"""
+        return np.clip((scores - self.lows) // self.widths, 0, self.bins - 1)
+
+    def add(self, scores: np.ndarray) -> None:
+        """Adds score vectors (an array of shape (vectors, scales))"""
+        if not len(scores) or not self.counts.shape[0]:
+            self.total += len(scores)
+            return
+        flat = self._bins_of(scores) + np.arange(self.counts.shape[0]) * self.counts.shape[1]
+        self.counts += np.bincount(flat.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+        self.total += len(scores)
+
+    def percentiles(self, scores: Sequence[int]) -> list[int]:
+        """
+        Returns percentile ranks of a score vector: percents of completions with lower totals
+        (a half of completions with the same totals is counted as lower)
+        """
+        positions = self._bins_of(np.asarray(scores, dtype=np.int64)).tolist()
+        ranks = []
+        for counts, position in zip(self.counts, positions):
+            below = int(counts[:position].sum())
+            ranks.append(round(100 * (below + counts[position] / 2) / max(self.total, 1)))
+        return ranks
+
+
+class QuizNorms:
+    """
+    The log of completions of a questionnaire and histograms of its scales in step with it.
+
+    :param prefix: str (path to files of the questionnaire without extensions)
+    :param quiz_id: int (``Quiz.quiz_id``)
+    :param score_ranges: list of reachable ranges of scores (min, max) of scales
+    :param bins: int (maximum number of bins of a scale)
+    """
+
+    def __init__(self, prefix: str, quiz_id: int, score_ranges: Sequence[tuple[int, int]], bins: int = NORM_BINS):
+        self.log_name = f'{prefix}.{LOG_EXTN}'
+        self.snapshot_name = f'{prefix}.{SNAPSHOT_EXTN}'
+        self.quiz_id = quiz_id
+        self.score_ranges = [tuple(score_range) for score_range in score_ranges]
+        self.bins = bins
+        self.dtype = record_dtype(len(self.score_ranges))
+        self.histograms = Histograms(self.score_ranges, bins)
+        self._lock = threading.Lock()
+        if not os.path.exists(self.log_name):
+            self._create_log()
+        self._fd = os.open(self.log_name, os.O_RDWR | os.O_APPEND)
+        with open(self.log_name, "rb") as f:
+            logged_id, logged_ranges = read_header(f)
+            self.start = f.tell()  # of the first record
+        if logged_id != quiz_id or logged_ranges != self.score_ranges:
+            os.close(self._fd)
+            raise ValueError(f'{self.log_name} is a log of another version of the questionnaire')
+        self.position = self.start  # the log is added to histograms up to this byte
+        self._saved = 0  # total of histograms when they were saved
+        self._load_snapshot()
+        self._catch_up()
+
+    def _create_log(self) -> None:
+        """Creates a log with a header; another process may create it at the same time, the first one wins"""
+        temp_name = f'{self.log_name}.{os.getpid()}.tmp'
+        with open(temp_name, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.quiz_id, len(self.score_ranges)))
+            f.write(b"".join(RANGE.pack(*score_range) for score_range in self.score_ranges))
+        try:
+            os.link(temp_name, self.log_name)  # unlike a rename, it fails if the log exists
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_name)
+
+    def _load_snapshot(self) -> None:
+        try:
+            with np.load(self.snapshot_name) as snapshot:
+                counts, position, total = snapshot["counts"], int(snapshot["position"]), int(snapshot["total"])
+        except FileNotFoundError:
+            return
+        except (OSError, KeyError, ValueError) as err:
+            log.warning('Snapshot %s is ignored: %s', self.snapshot_name, err)
+            return
+        if counts.shape != self.histograms.counts.shape or not self.start <= position <= os.path.getsize(self.log_name):
+            log.warning('Snapshot %s does not match %s, the log is replayed', self.snapshot_name, self.log_name)
+            return
+        self.histograms.counts[:] = counts
+        self.histograms.total = self._saved = total
+        self.position = position
+
+    def _catch_up(self) -> None:
+        """Adds records appended to the log since the last read (complete records only)"""
+        records = (os.fstat(self._fd).st_size - self.position) // self.dtype.itemsize
+        while records > 0:
+            chunk = min(records, READ_CHUNK)
+            data = os.pread(self._fd, chunk * self.dtype.itemsize, self.position)
+            self.histograms.add(np.frombuffer(data, dtype=self.dtype)["scores"])
+            self.position += len(data)
+            records -= chunk
+
+    def record(self, scores: Sequence[int]) -> list[int]:
+        """
+        Appends a completion to the log.
+
+        :param scores: score vector (in the order of ``Quiz.scale_ids``)
+        :return: percentile ranks of the vector among all logged completions (including this one)
+        """
+        record = np.zeros(1, dtype=self.dtype)
+        record["time"], record["scores"] = int(time.time()), scores
+        with self._lock:
+            os.write(self._fd, record.tobytes())  # a single write to a file opened with O_APPEND is not interleaved
+            self._catch_up()
+            if self.histograms.total - self._saved >= SNAPSHOT_INTERVAL:
+                self._save()
+            return self.histograms.percentiles(scores)
+
+    @property
+    def total(self) -> int:
+        return self.histograms.total
+
+    def _save(self) -> None:
+        temp_name = f'{self.snapshot_name}.{os.getpid()}.tmp'
+        with open(temp_name, "wb") as f:
+            np.savez(f, counts=self.histograms.counts, position=self.position, total=self.histograms.total)
+        os.replace(temp_name, self.snapshot_name)
+        self._saved = self.histograms.total
+
+    def save(self) -> None:
+        """Saves histograms, so the log is not replayed at start"""
+        with self._lock:
+            self._catch_up()
+            self._save()
+
+    def close(self) -> None:
+        self.save()
+        os.close(self._fd)
+
+
+class Norms:
+    """
+    Norms of all questionnaires, files are in a directory.
+
+    :param directory: str (created if it does not exist)
+    :param bins: int (maximum number of bins of a histogram of a scale)
+    :param min_completions: int (percentiles are not reported until a questionnaire is completed this many times)
+    """
+
+    def __init__(self, directory: str, bins: int = NORM_BINS, min_completions: int = NORM_MIN_COMPLETIONS):
+        self.directory = directory
+        self.bins = bins
+        self.min_completions = min_completions
+        self._quizes: dict[int, Optional[QuizNorms]] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _for_quiz(self, quiz) -> Optional[QuizNorms]:
+        norms = self._quizes.get(quiz.quiz_id)
+        if norms is None and quiz.quiz_id not in self._quizes:
+            with self._lock:
+                if quiz.quiz_id not in self._quizes:
+                    prefix = os.path.join(self.directory, f'{quiz.quiz_id:08x}')
+                    try:
+                        norms = QuizNorms(prefix, quiz.quiz_id, [quiz.score_ranges[s] for s in quiz.scale_ids],
+                                          self.bins)
+                    except (OSError, ValueError) as err:  # norms of the quiz are off, the bot goes on
+                        log.error('Norms of %s are not kept: %s', quiz.title, err)
+                    self._quizes[quiz.quiz_id] = norms
+                norms = self._quizes[quiz.quiz_id]
+        return norms
+
+    def record(self, quiz, scores: np.ndarray) -> Optional[list[int]]:
+        """
+        Appends a completion of a quiz to its log.
+
+        :return: percentile ranks of scales (in the order of ``Quiz.scale_ids``),
+                 None if the quiz is completed too few times
+        """
+        norms = self._for_quiz(quiz)
+        if norms is None:
+            return None
+        try:
+            percentiles = norms.record(scores.tolist())
+        except OSError as err:
+            log.error('Completion of %s is not logged: %s', quiz.title, err)
+            return None
+        return percentiles if norms.total >= self.min_completions else None
+
+    def close(self) -> None:
+        with self._lock:
+            for norms in self._quizes.values():
+                if norms is not None:
+                    norms.close()
+            self._quizes.clear()
+
+
+def rebuild(directory: str, bins: int = NORM_BINS) -> int:
+    """
+    Rebuilds snapshots of histograms from logs of a directory (e.g. if a snapshot is lost or `NORM_BINS` is changed).
+
+    :return: number of rebuilt snapshots
+    """
+    rebuilt = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith("." + LOG_EXTN):
+            continue
+        prefix = os.path.join(directory, name[:-len(LOG_EXTN) - 1])
+        start = time.perf_counter()
+        try:
+            with open(f'{prefix}.{LOG_EXTN}', "rb") as f:
+                quiz_id, score_ranges = read_header(f)
+            if os.path.exists(f'{prefix}.{SNAPSHOT_EXTN}'):
+                os.remove(f'{prefix}.{SNAPSHOT_EXTN}')
+            norms = QuizNorms(prefix, quiz_id, score_ranges, bins)  # the whole log is replayed
+            norms.close()
+        except (OSError, ValueError) as err:
+            print(f'  FAILED {name}: {err}')
+            continue
+        rebuilt += 1
+        print(f'  {name}: {norms.total} completion(s), {len(score_ranges)} scale(s) '
+              f'in {time.perf_counter() - start:.3f} sec.')
+    return rebuilt
+
+
+if __name__ == "__main__":
+    import argparse
+    from config import NORMS_DIR
+    parser = argparse.ArgumentParser(description="Rebuilds histograms of population norms from logs of completions")
+    parser.add_argument("directory", nargs="?", default=NORMS_DIR, help="a directory with logs of completions")
+    args = parser.parse_args()
+    if args.directory is None:
+        parser.error("NORMS_DIR is not set in config.py, give a directory")
+    print(f'{rebuild(args.directory)} snapshot(s) rebuilt')
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Optional
+
+import telebot
+
+log = logging.getLogger(__name__)
+
+
+class Outbox:
+    """
+    Outbound side of the chatbot: all calls of Telegram Bot API made by handlers go through an outbox.
+
+    This outbox calls the Bot API immediately with a blocking ``telebot.TeleBot`` client.
+    Other runtime modes replace it with an outbox having the same methods.
+    """
+
+    def __init__(self, bot: telebot.TeleBot):
+        self.bot = bot
+
+    def send_message(self, chat_id: int, text: str, reply_markup: Any = None,
+                     parse_mode: Optional[str] = None) -> None:
+        self.bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+
+    def send_transient(self, chat_id: int, text: str, reply_markup: Any = None,
+                       parse_mode: Optional[str] = None) -> None:
+        """
+        Sends a message and deletes it right away
+        (a reply keyboard can be removed only by sending a message).
+        """
+        message = self.bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+        self.delete_message(chat_id, message.id)
+
+    def edit_message(self, chat_id: int, message_id: int, text: str, reply_markup: Any = None,
+                     parse_mode: Optional[str] = None) -> None:
+        """
+        Replaces text and inline keyboard of a message. If the message cannot be edited
+        (e.g. it is too old or deleted), it is deleted and a new message is sent instead.
+        """
+        try:
+            self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id,
+                                       reply_markup=reply_markup, parse_mode=parse_mode)
+        except telebot.apihelper.ApiTelegramException as err:
+            if not_modified(err):
+                return
+            self.delete_message(chat_id, message_id)
+            self.send_message(chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+
+    def send_then_edit(self, chat_id: int, first_text: str, first_markup: Any, text: str,
+                       reply_markup: Any = None, parse_mode: Optional[str] = None) -> None:
+        """
+        Sends a message (e.g. removing a reply keyboard) and then edits it into the final message,
+        instead of deleting the first message and sending the second one.
+        """
+        message = self.bot.send_message(chat_id, first_text, reply_markup=first_markup)
+        self.edit_message(chat_id, message.id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+
+    def delete_message(self, chat_id: int, message_id: int) -> None:
+        try:
+            self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except telebot.apihelper.ApiTelegramException as err:
+            log.warning('%s is not deleted: %s', message_id, err.description)
+
+    def answer_callback_query(self, chat_id: int, callback_query_id: str) -> None:
+        self.bot.answer_callback_query(callback_query_id)
+
+
+def not_modified(err: telebot.apihelper.ApiTelegramException) -> bool:
+    """Tells if an edit failed only because new content is the same as the current one"""
+    return "message is not modified" in str(err.description)
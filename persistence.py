@@ -0,0 +1,170 @@
+"""
+Durable storage of users' sessions, so quizzes in progress survive a restart of the bot.
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+from typing import NamedTuple, Optional
+
+log = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.5  # in sec., how often pending changes are written to the database
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    quiz_title TEXT,
+    question_id INTEGER,
+    scores BLOB,
+    enter_time REAL NOT NULL,
+    last_activity REAL NOT NULL,
+    finished INTEGER NOT NULL DEFAULT 0,
+    locale TEXT,
+    quiz_id INTEGER
+)
+"""
+
+# columns added since the first version of SCHEMA: databases made by older versions are altered at start
+MIGRATIONS = {"locale": "ALTER TABLE sessions ADD COLUMN locale TEXT",
+              "quiz_id": "ALTER TABLE sessions ADD COLUMN quiz_id INTEGER",
+              }
+
+UPSERT = """
+INSERT INTO sessions (user_id, chat_id, quiz_title, question_id, scores, enter_time, last_activity, finished,
+                      locale, quiz_id)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id) DO UPDATE SET
+    chat_id = excluded.chat_id, quiz_title = excluded.quiz_title, question_id = excluded.question_id,
+    scores = excluded.scores, enter_time = excluded.enter_time, last_activity = excluded.last_activity,
+    finished = excluded.finished, locale = excluded.locale, quiz_id = excluded.quiz_id
+"""
+
+
+class SessionRecord(NamedTuple):
+    """A snapshot of a user's session"""
+    user_id: int
+    chat_id: int
+    quiz_title: Optional[str]
+    question_id: Optional[int]
+    scores: Optional[bytes]  # score vector (int32) as bytes
+    enter_time: float
+    last_activity: float
+    finished: bool  # results are shown, the session ends when OK is pressed
+    locale: Optional[str] = None  # language of messages (None - the default language)
+    quiz_id: Optional[int] = None  # ``Quiz.quiz_id`` of the quiz in progress, it changes with the questionnaire
+
+
+class SessionDB:
+    """
+    Durable storage of sessions in SQLite (WAL mode) with write-behind.
+
+    `save` and `delete` only put a change to a dictionary of pending changes (the last change
+    of a user wins), so the hot path never waits for the disk. A background thread writes
+    pending changes in a single transaction every `flush_interval` seconds.
+
+    :param path: str (path to a database file)
+    :param flush_interval: float (in sec.)
+    """
+
+    def __init__(self, path: str, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flushes = 0
+        self.written = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")  # WAL is synced on checkpoints, not on every commit
+        self._db.execute(SCHEMA)
+        self._migrate()
+        self._db_lock = threading.Lock()
+        self._pending: dict[int, Optional[SessionRecord]] = {}  # None means the session shall be deleted
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="session-db")
+        self._thread.start()
+
+    def _migrate(self) -> None:
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(sessions)")}
+        for column, statement in MIGRATIONS.items():
+            if column not in columns:
+                self._db.execute(statement)
+                log.info('Column %s is added to sessions of %s', column, self.path)
+
+    def save(self, record: SessionRecord) -> None:
+        with self._pending_lock:
+            self._pending[record.user_id] = record
+
+    def delete(self, user_id: int) -> None:
+        with self._pending_lock:
+            self._pending[user_id] = None
+
+    def load(self, user_id: int) -> Optional[SessionRecord]:
+        """Returns the last saved state of a user's session (None if there is no session)"""
+        with self._pending_lock:
+            if user_id in self._pending:
+                return self._pending[user_id]
+        with self._db_lock:
+            row = self._db.execute("SELECT user_id, chat_id, quiz_title, question_id, scores, enter_time, "
+                                   "last_activity, finished, locale, quiz_id FROM sessions WHERE user_id = ?",
+                                   (user_id,)).fetchone()
+        if row is None:
+            return None
+        return SessionRecord(*row[:7], finished=bool(row[7]), locale=row[8], quiz_id=row[9])
+
+    def purge(self, idle_before: float, started_before: float) -> int:
+        """
+        Deletes sessions which are inactive since `idle_before` or started before `started_before`
+        (expired while the bot was stopped).
+
+        :return: number of deleted sessions
+        """
+        self.flush()
+        with self._db_lock:
+            cursor = self._db.execute("DELETE FROM sessions WHERE last_activity < ? OR enter_time < ?",
+                                      (idle_before, started_before))
+        return cursor.rowcount
+
+    def flush(self) -> int:
+        """
+        Writes pending changes.
+
+        :return: number of written changes
+        """
+        with self._db_lock:  # `load` waits for the commit if it misses a change taken from `_pending`
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            upserts = [record for record in pending.values() if record is not None]
+            deletes = [(user_id,) for user_id, record in pending.items() if record is None]
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(UPSERT, upserts)
+                self._db.executemany("DELETE FROM sessions WHERE user_id = ?", deletes)
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                with self._pending_lock:  # changes made after this flush are newer
+                    for user_id, record in pending.items():
+                        self._pending.setdefault(user_id, record)
+                raise
+            self._db.execute("COMMIT")
+        self.flushes += 1
+        self.written += len(pending)
+        return len(pending)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as err:
+                log.error('Sessions are not saved: %s', err)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        with self._db_lock:
+            self._db.close()
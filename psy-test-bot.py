@@ -1,21 +1,37 @@
 from __future__ import annotations
 
 import telebot
+import telebot.asyncio_helper
 from dotenv import load_dotenv
 import os
-from collections import OrderedDict, namedtuple
-from config import LANGUAGE, MAX_USERS, MAX_TIME, MAX_SESSION_TIME, MAX_IDLE_TIME
+from collections import namedtuple
+from config import MAX_USERS, MAX_TIME, MAX_SESSION_TIME, MAX_IDLE_TIME
 # config.TEST_EXTN stores an extension of files containing questionnaires ("txt" by default)
 # config.TEST_DIR stores a directory (full path) where questionnaires are located
-from config import TEST_EXTN, TESTS_DIR
+from config import TEST_EXTN, TESTS_DIR, LOAD_WORKERS, RELOAD_INTERVAL, EDIT_IN_PLACE, RATE_LIMIT, SESSION_DB
+from config import STATELESS, LOG_LEVEL, METRICS_PORT, NORMS_DIR, SWEEP_INTERVAL, GOODBYE_RATE
+import logging
+import threading
 import time
+import numpy as np
 from typing import Sequence, Callable, Any, Literal
 from typing import NamedTuple
 from quiz import Quiz
-from buttons import BTN_NEXT, BTN_OK, BTN_QUIT, BTN, make_inline_kb, make_inline_buttons
-from errors import MaximumUsersNumberReached
-from quiz import Scale
+from catalog import compile_catalog, load_catalog, log_report
+from watcher import CatalogWatcher
+from buttons import BTN_NEXT, BTN_OK, BTN_QUIT, BTN, make_inline_kb, make_inline_buttons, buttons_for
+from errors import MaximumUsersNumberReached, InvalidCallbackData, QuizFileChanged
+from sessions import ExpirySweeper, Session, SessionStore
+from persistence import SessionDB, SessionRecord
+from norms import Norms
+from outbox import Outbox
+from scheduler import ScheduledOutbox
+import stateless
+from stateless import CallbackCodec, CALLBACK_PREFIX
 from commands import Commands, all_commands
+import metrics
+from metrics import timed
+from messages import locale_of, messages_for, supported_locale
 
 # CREDENTIALS
 load_dotenv()
@@ -23,8 +39,24 @@ TOKEN = os.getenv('TOKEN')
 if TOKEN is None:
     raise ValueError(f'TOKEN {TOKEN} is not valid')
 
+# a local Bot API server (or a fake one for tests and benchmarks) may be used instead of api.telegram.org
+BOT_API_URL = os.getenv('BOT_API_URL')
+if BOT_API_URL is not None:
+    telebot.apihelper.API_URL = BOT_API_URL.rstrip('/') + '/bot{0}/{1}'
+    telebot.asyncio_helper.API_URL = telebot.apihelper.API_URL
+metrics.instrument_bot_api()  # Bot API calls are timed and their errors are counted
+
+log = logging.getLogger("psy-test-bot")
+
 bot = telebot.TeleBot(TOKEN)
+outbox: Outbox = Outbox(bot)  # all Bot API calls of handlers go through the outbox
 all_quizes = {}
+session_db: SessionDB | None = SessionDB(SESSION_DB) if SESSION_DB else None  # None - sessions are not saved
+norms: Norms | None = Norms(NORMS_DIR) if NORMS_DIR else None  # None - completions are not logged
+# signs progress of stateless sessions in callback data (the key shall be the same for all workers)
+codec = CallbackCodec(os.getenv('CALLBACK_SECRET', TOKEN).encode())
+completions = stateless.Completions()  # messages with results of stateless sessions, recorded to norms once
+quizes_by_id: dict[int, Quiz] = {}  # quizes which may be taken in stateless sessions, by `Quiz.quiz_id`
 
 BUTTONS = {"next": BTN_NEXT,
            "ok": BTN_OK,
@@ -32,167 +64,218 @@ BUTTONS = {"next": BTN_NEXT,
            }
 
 
-def first(d: Sequence):
-    """
-    Returns the first element of any sequence
-    """
-    return next(iter(d))
-
-
-class User:
-    users: OrderedDict[int, RegisteredUser] = OrderedDict()  # dictionary of all instances of the class
+class User(Session):
+    __slots__ = ()  # the state of a session is defined by ``Session``
+    # storage of all registered instances of the class (in LRU order)
+    users: SessionStore = SessionStore(MAX_USERS, idle_ttl=MAX_IDLE_TIME, session_ttl=MAX_SESSION_TIME,
+                                       on_evict=lambda user_id, user: user._expire())
+    _restore_lock = threading.Lock()
 
     @classmethod
     def register_user(cls, user: User) -> None:
         """
-        Adds a new user to class attribute `users` if the maximum number of users is not reached
+        Adds a new user to class attribute `users` if the maximum number of users is not reached.
+        Expired sessions are evicted (and their users get a goodbye message) to make room for a new user.
 
         :param user: instance of the ``User`` class
         :return: None
         """
-        if user.user_id in cls.users:
-            del cls.users[user.user_id]
-            cls._add_new_user(user)
-            return None
-        if len(cls.users) < MAX_USERS:
-            cls._add_new_user(user)
-            return None
-        if cls._inactive_user() is None:
+        if not cls.users.add(user.user_id, user):
+            metrics.rejected_users.inc()
             raise MaximumUsersNumberReached(MAX_USERS, "few")
-        else:
-            inactive_user = cls._inactive_user()
-            inactive_user.session_over(inactive_user.chat_id)
-            cls._add_new_user(user)
-            return None
-
-    @classmethod
-    def _add_new_user(cls, user: User):
-        cls.users[user.user_id] = RegisteredUser(user, time.time())
 
     @classmethod
-    def _is_user_inactive(cls, user: User) -> bool:
-        current_time = time.time()
-        return all(((current_time - user.enter_time) > MAX_SESSION_TIME,
-                    (current_time - user.last_activity_time) > MAX_IDLE_TIME))
+    def unregister_user(cls, user_id: int):
+        cls.users.pop(user_id, None)
+        if session_db is not None:
+            session_db.delete(user_id)
 
     @classmethod
-    def _inactive_user(cls) -> User | None:
+    def get_user(cls, user_id: int) -> User | None:
         """
+        Returns a registered user. If the user is not in memory (e.g. the bot has been restarted),
+        the session saved to `session_db` is restored.
 
-        :return: returns inactive user if such one is detected, or None
+        :param user_id: int
+        :return: instance of the ``User`` class, or None if the user has no session
         """
-        first_user_id = first(cls.users)
-        if cls._is_user_inactive(cls.users[first_user_id].ref):
-            return cls.users[first_user_id].ref
-        return None # if there is no inactive user
+        user = cls.users.get(user_id)
+        if user is not None or session_db is None:
+            return user
+        with cls._restore_lock:  # two updates of a user shall not restore two sessions
+            user = cls.users.get(user_id)
+            if user is not None:
+                return user
+            record = session_db.load(user_id)
+            return None if record is None else cls.restore(record)
 
     @classmethod
-    def unregister_user(cls, user_id: int):
-        cls.users.pop(user_id)
+    def restore(cls, record: SessionRecord) -> User | None:
+        """
+        Makes a user from a saved session. A quiz is restored if it is still in the catalog and
+        its questionnaire has not changed (the same ``Quiz.quiz_id``), otherwise the user is returned
+        to the start menu.
 
-    def __init__(self, user_id: int, chat_id: int):
-        self.user_id = user_id
-        self.chat_id = chat_id
-        self.scores = None
-        self.quiz = None
-        self.question_id = None
-        self.answer_id = None
+        :param record: SessionRecord
+        :return: instance of the ``User`` class, or None if the saved session has expired
+        """
+        now = time.time()
+        if now - record.last_activity > MAX_IDLE_TIME or now - record.enter_time > MAX_SESSION_TIME:
+            session_db.delete(record.user_id)
+            return None
+        user = cls.__new__(cls)
+        Session.__init__(user, record.user_id, record.chat_id, supported_locale(record.locale))
+        quiz = all_quizes.get(record.quiz_title)
+        if quiz is not None and quiz.quiz_id == record.quiz_id:  # scores of a changed quiz are meaningless
+            scores = quiz.new_scores()
+            question_id = record.question_id
+            if (record.scores is not None and len(record.scores) == scores.nbytes
+                    and (question_id is None or question_id < len(quiz.questions))):
+                scores[:] = np.frombuffer(record.scores, dtype=scores.dtype)
+                user.quiz, user.scores, user.question_id = quiz, scores, question_id
+                user.finished = record.finished
+        if not cls.users.add(user.user_id, user, created=record.enter_time):
+            raise MaximumUsersNumberReached(MAX_USERS, "few")
+        return user
+
+    def __init__(self, user_id: int, chat_id: int, locale: str | None = None):
+        super().__init__(user_id, chat_id, locale)
         self.__class__.register_user(self)
-        self._on_press_ok = lambda x: True
-        self.last_activity_time = self.enter_time
+        self._persist()
 
     @property
     def enter_time(self) -> float:
-        return self.__class__.users[self.user_id].timestamp
+        return self.__class__.users.created(self.user_id)
+
+    @property
+    def last_activity_time(self) -> float:
+        return self.__class__.users.touched(self.user_id)
+
+    def _touch(self) -> None:
+        """Marks the user as active right now"""
+        if self.user_id in self.__class__.users:
+            self.__class__.users.touch(self.user_id)
+
+    def _persist(self) -> None:
+        """
+        Saves the state of the session to `session_db` (the write happens in background).
+        A session which is no longer in memory (e.g. it has been evicted as expired meanwhile) is not saved.
+        """
+        if session_db is None:
+            return
+        entry = self.__class__.users.lookup(self.user_id)
+        if entry is None or entry[0] is not self:
+            return
+        _, enter_time, last_activity = entry
+        session_db.save(SessionRecord(user_id=self.user_id,
+                                      chat_id=self.chat_id,
+                                      quiz_title=self.quiz.title if self.quiz is not None else None,
+                                      question_id=self.question_id,
+                                      scores=self.scores.tobytes() if self.scores is not None else None,
+                                      enter_time=enter_time,
+                                      last_activity=last_activity,
+                                      finished=self.finished,
+                                      locale=self.locale,
+                                      quiz_id=self.quiz.quiz_id if self.quiz is not None else None))
 
     def start_quiz(self, title: str, chat_id: int):
-        self.last_activity_time = time.time()
+        self._touch()
         if title not in all_quizes:
             return
-        # print(f'Quiz start for user: {self.user_id}')
-        QUIZ_STARTING_MSG = {"EN": "quiz is starting...",
-                             "RU": "загружается текст опросника..."}[LANGUAGE]
-        remove_menu(chat_id, QUIZ_STARTING_MSG)
+        log.debug('Quiz start for user: %s', self.user_id)
         quiz = all_quizes[title]
         self.quiz = quiz
-        self.scores = {}
+        self.scores = quiz.new_scores()
         self.question_id = None
-        scale_id: str
-        scale: Scale
-        for scale_id, scale in self.quiz.scales.items():
-            self.scores[scale_id] = Scale(name=scale.name)
+        self.finished = False
+        self._persist()
         start_quiz_msg = quiz.title + "\n" + quiz.description
-        show_msg(chat_id, msg=start_quiz_msg, btns=[BTN_NEXT, BTN_QUIT])
+        buttons = buttons_for(self.locale)
+        replace_menu(chat_id, messages_for(self.locale).quiz_starting, msg=start_quiz_msg,
+                     btns=[buttons.next, buttons.quit])
 
-    def next_question(self, chat_id: int):
-        self.last_activity_time = time.time()
+    def next_question(self, chat_id: int, message_id: int | None = None):
+        """
+        Shows the next question (or results after the last one).
+        If `message_id` is given, that message is edited instead of sending a new one.
+        """
+        self._touch()
         if self.quiz is None:
             return
         if self.question_id == len(self.quiz.questions) - 1:
-            self.show_results(chat_id)
+            self.show_results(chat_id, message_id)
         else:
             try:
                 self.question_id += 1
             except TypeError:  # if this is the first question, self.question_id is None
                 self.question_id = 0
-            question_num = str(self.question_id)
-            prefix = f'({str(self.question_id+1)}/{str(len(self.quiz.questions))}) '
-            question_text: str = prefix + self.quiz.question_text(self.question_id)
-            answers_text = self.quiz.answers_text(self.question_id)
-            btns = self._answers_buttons(question_num, answers_text)
-            show_msg(chat_id, msg=question_text, btns=btns)
-
-    @staticmethod
-    def _answers_buttons(question_num: str, answers_text) -> list[telebot.types.InlineKeyboardButton]:
-        prefix = "Q#" + question_num + "_A#"
-        btns_txt = []
-        btns_cb_data = []
-        for ans_num, text in answers_text:
-            print(text, ans_num)
-            btns_txt.append(text)
-            btns_cb_data.append(prefix + str(ans_num))
-        return make_inline_buttons(btns_txt, btns_cb_data)
+            self._persist()  # the answer to the previous question is saved with the new question_id
+            try:
+                payload = self.quiz.payloads[self.question_id]  # text and keyboard are prepared at load time
+            except QuizFileChanged as err:  # questions of a large questionnaire are read on demand
+                log.warning('Quiz of user %s is stopped: %s', self.user_id, err)
+                self.reset_user_data()
+                quiz_changed(chat_id, self.locale, message_id)
+                return
+            show_msg(chat_id, msg=payload.text, markup=payload.markup, message_id=message_id)
 
     def session_over(self, chat_id: int):
         self._say_goodbye(chat_id)
         self.__class__.unregister_user(self.user_id)
 
-    def show_results(self, chat_id: int):
-        self.last_activity_time = time.time()
-        results: str = self.quiz.get_result(self.scores)
-        show_msg(chat_id, msg=results, btns=[BTN_OK,])
-        self._on_press_ok = self.session_over
+    def show_results(self, chat_id: int, message_id: int | None = None):
+        self._touch()
+        if self.finished:  # results are shown, and the completion is recorded, once
+            return
+        self.finished = True
+        percentiles = norms.record(self.quiz, self.scores) if norms is not None else None
+        results: str = self.quiz.get_result(self.scores, self.locale, percentiles)
+        show_msg(chat_id, msg=results, btns=[buttons_for(self.locale).ok], message_id=message_id)
+        self._persist()
 
     def update_scores(self, question_id: int, answer_id: int):
-        new_scores: dict[str, int] = self.quiz.get_answer_scores(question_id, answer_id)
-        for scale, score in new_scores.items():
-            self.scores[scale].value += score
-        print(self.scores)
+        self.quiz.add_answer_scores(self.scores, question_id, answer_id)
+        log.debug('Scores of user %s: %s', self.user_id, self.scores)
+
+    def _expire(self):
+        """
+        Is called when the session is evicted from memory as expired (by the sweeper, it may be called
+        a while later, see ``ExpirySweeper``)
+        """
+        if self._forget():
+            self._say_goodbye(self.chat_id)
+
+    def _forget(self) -> bool:
+        """
+        Deletes the saved state of the expired session (the sweeper calls it without a goodbye
+        if the goodbye would be too late).
+
+        :return: False if the user has started a new session meanwhile (nothing is deleted)
+        """
+        if self.__class__.users.get(self.user_id) is not None:
+            return False
+        if session_db is not None:
+            session_db.delete(self.user_id)
+        return True
 
     def _say_goodbye(self, chat_id):
-        msg = {"RU": "Ваш сеанс работы завершён. Для возобновления работы выберите команду /start .",
-               "EN": "Your session is over. Please, select a /start command to start a new session"}[LANGUAGE]
-        show_msg(chat_id, msg=msg)
+        say_goodbye(chat_id, self.locale)
 
     def send_ok(self, chat_id: int):
-        self._on_press_ok(chat_id)
+        if self.finished:
+            self.session_over(chat_id)
 
     def reset_user_data(self):
         self.scores = None
         self.quiz = None
         self.question_id = None
-        self.answer_id = None
-
-
-class RegisteredUser(NamedTuple):
-    ref: User
-    timestamp: float
+        self.finished = False
+        self._persist()
 
 
 class Menu(NamedTuple):
-    msg: str
     kb: telebot.types.ReplyKeyboardMarkup
-    handler: Callable
+    handler: Callable  # is called with the ``User`` and the message with a choice
 
 
 start_menu = None
@@ -200,42 +283,81 @@ start_menu = None
 
 def show_msg(chat_id: int, msg: str,
              btns: list[telebot.types.InlineKeyboardButton] | None = None,
-             parse_mode: Literal['markdown', 'html', 'plain'] = "markdown") -> None:
-    if '\\n' in msg:
-        msg = cr_processing(msg)
-    if btns is not None:
+             parse_mode: Literal['markdown', 'html', 'plain'] = "markdown",
+             markup: telebot.types.JsonSerializable | str | None = None,
+             message_id: int | None = None) -> None:
+    """
+    Sends a message with inline buttons `btns`, or with a prepared `markup` (serialized markup is sent as is).
+
+    If `message_id` is given (and EDIT_IN_PLACE is on), the message with this id is edited instead,
+    so a message with a question is replaced by the next one with a single Bot API call.
+
+    `msg` is sent as is: texts of questionnaires shall have their "\\n" replaced (see ``cr_processing``);
+    questions and results of a quiz are prepared so once, when they are compiled or cached.
+    """
+    if markup is None and btns is not None:
         markup = telebot.types.InlineKeyboardMarkup(row_width=1)
         markup.add(*btns)
-    else:
+    if message_id is not None and EDIT_IN_PLACE:
+        outbox.edit_message(chat_id, message_id, msg, reply_markup=markup, parse_mode=parse_mode)
+        return
+    if message_id is not None:
+        del_msg(chat_id, message_id)
+    if markup is None:
         markup = telebot.types.ReplyKeyboardRemove()
-    msg = bot.send_message(chat_id, msg, reply_markup=markup, parse_mode=parse_mode)
+    outbox.send_message(chat_id, msg, reply_markup=markup, parse_mode=parse_mode)
+
+
+def say_goodbye(chat_id: int, locale: str | None = None) -> None:
+    show_msg(chat_id, msg=messages_for(locale).session_over)
+
+
+def quiz_changed(chat_id: int, locale: str | None = None, message_id: int | None = None) -> None:
+    """Tells a user that the quiz is stopped, as its questionnaire has changed, and shows the start menu"""
+    show_msg(chat_id, msg=messages_for(locale).quiz_changed, message_id=message_id)
+    show_menu(chat_id, start_menu, locale)
 
 
 def cr_processing(s: str) -> str:
     return s.replace('\\n','\n')
 
 
-def show_menu(message: telebot.types.Message, menu: Menu) -> None:
-    chat_id = message.chat.id
-    bot.send_message(chat_id, menu.msg, reply_markup=menu.kb)
-    bot.register_next_step_handler(message, menu.handler)
+def show_menu(chat_id: int, menu: Menu, locale: str | None = None) -> None:
+    """
+    Shows a reply keyboard menu in the language of the user.
+    A choice is handled by `menu.handler` (see ``menu_choice_handler``).
+    """
+    outbox.send_message(chat_id, messages_for(locale).start_menu, reply_markup=menu.kb)
 
 
 def remove_menu(chat_id: int, msg: str = "...") -> None:
     markup = telebot.types.ReplyKeyboardRemove(selective=False)
-    message = bot.send_message(chat_id, msg,
-                     reply_markup=markup, parse_mode="html")
-    del_msg(chat_id, message.id)
+    outbox.send_transient(chat_id, msg, reply_markup=markup, parse_mode="html")
+
+
+def replace_menu(chat_id: int, transient_msg: str, msg: str,
+                 btns: list[telebot.types.InlineKeyboardButton]) -> None:
+    """
+    Removes a reply keyboard menu and shows a message with inline buttons `btns`.
+    With EDIT_IN_PLACE the message removing the menu is edited into the new one (instead of being deleted).
+    """
+    msg = cr_processing(msg)
+    if not EDIT_IN_PLACE:
+        remove_menu(chat_id, transient_msg)
+        show_msg(chat_id, msg=msg, btns=btns)
+        return
+    markup = telebot.types.InlineKeyboardMarkup(row_width=1)
+    markup.add(*btns)
+    outbox.send_then_edit(chat_id, transient_msg, telebot.types.ReplyKeyboardRemove(selective=False),
+                          msg, reply_markup=markup, parse_mode="markdown")
 
 
 def del_msg(chat_id: int, message_id: int):
-    try:
-        bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except:
-        print(f'{message_id} doesn\'t exist')
+    outbox.delete_message(chat_id, message_id)
 
 
 @bot.message_handler(commands=['start'])
+@timed
 def starting_menu(message):
     """
     To be called when ``/start`` command is entered.
@@ -248,18 +370,20 @@ def starting_menu(message):
 
     :type message: telebot.types.Message
     """
+    locale = locale_of(message.from_user.language_code)
+    if STATELESS:  # no session is kept, a quiz is started by its title (see ``stateless_quiz_start``)
+        show_menu(message.chat.id, start_menu, locale)
+        return
     try:
-        make_new_user(message.from_user.id, message.chat.id)
+        make_new_user(message.from_user.id, message.chat.id, locale)
     except MaximumUsersNumberReached:
-        maximum_users_number_reached_notification = {"RU": "Достигнуто максимально количество пользователей, "
-                                                           "попробуйте позднее",
-                                                     "EN": "Max number of users is reached. Try again later"}[LANGUAGE]
-        show_msg(message.chat.id, msg=maximum_users_number_reached_notification)
+        show_msg(message.chat.id, msg=messages_for(locale).max_users)
     else:  # if everything is ok, and user is instantiated
-        show_menu(message, start_menu)
+        show_menu(message.chat.id, start_menu, locale)
 
 
 @bot.message_handler(commands=all_commands)
+@timed
 def commands_processing(message: telebot.types.Message):
     chat_id = message.chat.id
 
@@ -274,45 +398,30 @@ def commands_processing(message: telebot.types.Message):
         return  # no command discovered
 
     # commands executing
+    user = User.get_user(message.from_user.id)
+    locale = user.locale if user is not None else locale_of(message.from_user.language_code)  # as in the session
+    messages = messages_for(locale)
     if command == Commands.DISCLAIMER.value:
-        disclaimer_txt = {'RU': 'Представленная здесь информация не является профессиональной консультацией '\
-                          'и не заменяет обращения к специалисту. Не воспринимайте результаты тестов как '\
-                          'истину в последней инстанции. Вся информация размещена в информацонных и развлекательных '\
-                          'целях.',
-                          'EN': 'Information in this chatbot is not a professional advice, and is not any '\
-                          'kind of substitution for seeking a professional advice. Please, do not take test '\
-                          'results as ultimate truth. All information is presented for informational '\
-                          'and entertainment purposes.'
-                          }[LANGUAGE]
-        show_msg(chat_id, msg=disclaimer_txt)
+        show_msg(chat_id, msg=messages.disclaimer)
         return
     if command == Commands.AUTHOR.value:
-        about_author_txt = {'RU': 'Разработчик чатбота @EdFromChelly. Обращайтесь по вопросам развития чатбота, '\
-                            'присылайте сообщения о выявленных ошибках, предложения новых тестов.\n' \
-                            'Заказывайте разработку своего чатбота :).',
-                            'EN': 'This chatbot is developed by @EdFromChelly. Send a message regarding a '\
-                            'development of this chatbot, report about errors discovered by you, offer new '\
-                            'tests (questionnaire). \nOrder your own chatbot:).'}[LANGUAGE]
-        show_msg(chat_id, msg=about_author_txt)
+        show_msg(chat_id, msg=messages.author)
         return
     if command == Commands.CREDITS.value:
-        credits_txt = {'RU':'Разработчик благодарит за профессиональную помощь в развитии бота телеграм-каналы '\
-                       '@mariamalko и @psyhologia',
-                       'EN':'A developer of this chatbot appreciates telegram-channels @mariamalko and '\
-                       '@psyhologia for professional help with the chatbot\'s development'}[LANGUAGE]
-        show_msg(chat_id, msg=credits_txt)
+        show_msg(chat_id, msg=messages.credits)
         return
-    if command == Commands.QUIT.value and message.from_user.id in User.users:
-        User.users[message.from_user.id].ref.session_over(chat_id)
+    if command == Commands.QUIT.value and user is not None:
+        user.session_over(chat_id)
     elif command == Commands.MENU.value:
-        if message.from_user.id in User.users:
-            User.users[message.from_user.id].ref.reset_user_data()
-            show_menu(message, start_menu)
+        if user is not None:
+            user.reset_user_data()
+            show_menu(chat_id, start_menu, locale)
         else:
             starting_menu(message)
 
 
 @bot.callback_query_handler(func=lambda call: call.data in BUTTONS.keys())
+@timed
 def standard_buttons_handler(query: telebot.types.CallbackQuery):
     """
     When one of the standard buttons (*OK*, *Next*, *Quit*) is pressed,
@@ -322,43 +431,50 @@ def standard_buttons_handler(query: telebot.types.CallbackQuery):
 
     :param query: telebot.types.CallbackQuery
     """
-    bot.answer_callback_query(query.id)
-    if query.from_user.id not in User.users:
-        unregistered_user_input(query.from_user.id, query.message.chat.id)
+    outbox.answer_callback_query(query.message.chat.id, query.id)
+    user = User.get_user(query.from_user.id)  # the user is passed on: the sweeper may evict the session meanwhile
+    if user is None:
+        if STATELESS and query.data in ("ok", "quit"):  # a stateless session is over
+            if query.data == "quit":
+                del_msg(query.message.chat.id, query.message.message_id)
+            say_goodbye(query.message.chat.id, locale_of(query.from_user.language_code))
+            return
+        unregistered_user_input(query.from_user.id, query.message.chat.id, locale_of(query.from_user.language_code))
         return
     if query.data == "next":
-        next_pressed(query)
+        next_pressed(query, user)
     elif query.data == "quit":
-        quit_pressed(query)
+        quit_pressed(query, user)
     elif query.data == "ok":
-        ok_pressed(query)
+        ok_pressed(query, user)
 
 
-def unregistered_user_input(user_id, chat_id):
-    msg = {"RU": "Для начала работы введите команду /start",
-           "EN": "To start a session type the command /start"}[LANGUAGE]
-    show_msg(chat_id, msg=msg, btns=None)
+def unregistered_user_input(user_id, chat_id, locale=None):
+    show_msg(chat_id, msg=messages_for(locale).unregistered, btns=None)
 
 
-def next_pressed(query: telebot.types.CallbackQuery):
-    del_msg(query.message.chat.id, query.message.message_id)
-    User.users[query.from_user.id].ref.next_question(query.message.chat.id)
+def next_pressed(query: telebot.types.CallbackQuery, user: User):
+    if user.quiz is None:  # e.g. the saved quiz has been removed or changed since the session was saved
+        show_menu(query.message.chat.id, start_menu, user.locale)
+        return
+    user.next_question(query.message.chat.id, query.message.message_id)
 
 
-def quit_pressed(query):
+def quit_pressed(query: telebot.types.CallbackQuery, user: User):
     del_msg(query.message.chat.id, query.message.message_id)
-    User.users[query.from_user.id].ref.session_over(query.message.chat.id)
+    user.session_over(query.message.chat.id)
 
 
-def ok_pressed(query):
-    User.users[query.from_user.id].ref.send_ok(query.message.chat.id)
+def ok_pressed(query: telebot.types.CallbackQuery, user: User):
+    user.send_ok(query.message.chat.id)
 
 
-def make_new_user(user_id: int, chat_id: int):
-    User(user_id, chat_id)
+def make_new_user(user_id: int, chat_id: int, locale: str | None = None):
+    User(user_id, chat_id, locale)
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("Q#"))
+@timed
 def answer_buttons_handler(query: telebot.types.CallbackQuery):
     """
     When a button with answer option is pressed, this function
@@ -366,14 +482,101 @@ def answer_buttons_handler(query: telebot.types.CallbackQuery):
 
     :param query: telebot.types.CallbackQuery
     """
-    bot.answer_callback_query(query.id)
-    if query.from_user.id not in User.users:
-        unregistered_user_input(query.from_user.id, query.message.chat.id)
+    outbox.answer_callback_query(query.message.chat.id, query.id)
+    user = User.get_user(query.from_user.id)
+    if user is None:
+        unregistered_user_input(query.from_user.id, query.message.chat.id, locale_of(query.from_user.language_code))
         return
     question_num, answer_num = _parse_answer_callback(query.data)
-    User.users[query.from_user.id].ref.update_scores(question_num, answer_num)
-    del_msg(query.message.chat.id, query.message.message_id)
-    User.users[query.from_user.id].ref.next_question(query.message.chat.id)
+    if user.quiz is None:  # e.g. the saved quiz has been removed or changed since the session was saved
+        user.reset_user_data()
+        show_menu(query.message.chat.id, start_menu, user.locale)
+        return
+    if question_num != user.question_id or user.finished:  # a button of a question answered before
+        log.warning('Answer of user %s to question %s is ignored', user.user_id, question_num)
+        return
+    try:
+        user.update_scores(question_num, answer_num)
+    except IndexError as err:  # a button of an old keyboard (or forged callback data)
+        log.warning('Answer of user %s is rejected: %s', user.user_id, err)
+        return
+    user.next_question(query.message.chat.id, query.message.message_id)
+
+
+@bot.message_handler(func=lambda message: message.text in all_quizes)
+@timed
+def menu_choice_handler(message: telebot.types.Message):
+    """
+    Starts a quiz chosen in the start menu.
+
+    It is a message handler rather than a next step handler: telebot skips next step handlers
+    of some messages when a batch of updates has such messages of several chats.
+
+    :param message: telebot.types.Message
+    """
+    if STATELESS:
+        stateless_quiz_start(message)
+        return
+    user = User.get_user(message.from_user.id)  # the user is passed on: the sweeper may evict the session meanwhile
+    if user is None:
+        unregistered_user_input(message.from_user.id, message.chat.id, locale_of(message.from_user.language_code))
+        return
+    start_menu.handler(user, message)
+
+
+def stateless_quiz_start(message: telebot.types.Message):
+    """
+    Starts a quiz chosen in the start menu, if sessions are stateless (STATELESS is on).
+    The *Next* button carries the state of the quiz, so no ``User`` is created.
+    """
+    quiz = all_quizes[message.text]
+    locale = locale_of(message.from_user.language_code)
+    if quiz.quiz_id not in quizes_by_id:  # too many scales to keep scores in callback data
+        unregistered_user_input(message.from_user.id, message.chat.id, locale_of(message.from_user.language_code))
+        return
+    buttons = buttons_for(locale)
+    btn_next = BTN(buttons.next.text, callback_data=codec.start_callback(message.from_user.id, quiz))
+    replace_menu(message.chat.id, messages_for(locale).quiz_starting, msg=quiz.title + "\n" + quiz.description,
+                 btns=[btn_next, buttons.quit])
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(CALLBACK_PREFIX))
+@timed
+def stateless_buttons_handler(query: telebot.types.CallbackQuery):
+    """
+    Handles buttons of stateless sessions: callback data carry the quiz, the question, the answer
+    and scores so far (see stateless.py), so any worker can show the next question.
+
+    :param query: telebot.types.CallbackQuery
+    """
+    outbox.answer_callback_query(query.message.chat.id, query.id)
+    chat_id = query.message.chat.id
+    try:
+        state = codec.decode(query.from_user.id, query.data)
+        quiz = quizes_by_id.get(state.quiz_id)
+        if quiz is None:
+            raise InvalidCallbackData(f'unknown quiz {state.quiz_id}')  # e.g. it has been changed since
+        question_id, scores = stateless.advance(quiz, state)
+        payload = quiz.payloads[question_id] if question_id < len(quiz.questions) else None
+    except InvalidCallbackData as err:
+        log.warning('Callback data of user %s are rejected: %s', query.from_user.id, err)
+        unregistered_user_input(query.from_user.id, chat_id, locale_of(query.from_user.language_code))
+        return
+    except QuizFileChanged as err:  # questions of a large questionnaire are read on demand
+        log.warning('Quiz of user %s is stopped: %s', query.from_user.id, err)
+        quiz_changed(chat_id, locale_of(query.from_user.language_code), query.message.message_id)
+        return
+    if payload is None:
+        if not completions.add(chat_id, query.message.message_id):  # its results are shown already
+            log.warning('Repeated completion of user %s is ignored', query.from_user.id)
+            return
+        locale = locale_of(query.from_user.language_code)
+        percentiles = norms.record(quiz, scores) if norms is not None else None
+        show_msg(chat_id, msg=quiz.get_result(scores, locale, percentiles), btns=[buttons_for(locale).ok],
+                 message_id=query.message.message_id)
+        return
+    markup = codec.answers_kb_json(query.from_user.id, quiz, question_id, scores.tolist())
+    show_msg(chat_id, msg=payload.text, markup=markup, message_id=query.message.message_id)
 
 
 def _parse_answer_callback(callback_data: str) -> tuple[int, int]:
@@ -383,42 +586,215 @@ def _parse_answer_callback(callback_data: str) -> tuple[int, int]:
     return question_num, answer_num
 
 
+def get_tests_dir() -> str:
+    """
+    Returns full path of the directory with questionnaires (global variable TESTS_DIR)
+    """
+    return os.path.join(os.getcwd(), TESTS_DIR)
+
+
 def get_tests_filenames() -> list[str]:
     """
     Returns list of filenames of questionnaires using global variables TESTS_DIR and TEST_EXTN
 
     :return: list of filenames of questionnaires
     """
-    pwd = os.getcwd()
-    tests_full_path = os.path.join(pwd, TESTS_DIR)
+    tests_full_path = get_tests_dir()
     filenames = [os.path.join(tests_full_path, name)
-                 for name in os.listdir(tests_full_path)
+                 for name in sorted(os.listdir(tests_full_path))
                  if name.endswith(TEST_EXTN)]
     return filenames
 
 
-def initialize():
-    global start_menu
-    for name in get_tests_filenames():  # iterate over filenames of questionnaires
-        quiz = Quiz.quiz_from_file(name)
-        all_quizes[quiz.title] = quiz
-    start_message = {"RU": "В этом чатботе можно пройти несколько проверенных психологических тестов.\n"
-                           "Выбирите тест из списка ниже.",
-                     "EN": "You can take few psychological assessments (test) using this chatbot.\n"
-                           "Please, choose a test from the list below."}[LANGUAGE]
-    start_menu_buttons = list(map(telebot.types.KeyboardButton,
-                                  [title for title in all_quizes]))
+catalog_watcher: CatalogWatcher | None = None
+_menu_buttons: dict[str, telebot.types.KeyboardButton] = {}  # buttons of the start menu by quiz titles
+
+
+def build_start_menu() -> Menu:
+    """
+    Makes the start menu for titles of `all_quizes`. Buttons of titles which are already
+    in the menu are reused, so only buttons of new questionnaires are created.
+    """
+    global _menu_buttons
+    _menu_buttons = {title: _menu_buttons.get(title) or telebot.types.KeyboardButton(title)
+                     for title in all_quizes}
     start_kb = telebot.types.ReplyKeyboardMarkup(one_time_keyboard=True,
                                                  resize_keyboard=True,
-                                                 row_width=1, ).add(*start_menu_buttons)
-    start_menu = Menu(msg=start_message,
-                      kb=start_kb,
-                      handler=lambda msg: User.users[msg.from_user.id].ref.start_quiz(msg.text, msg.chat.id))
+                                                 row_width=1, ).add(*_menu_buttons.values())
+    return Menu(kb=start_kb,
+                handler=lambda user, msg: user.start_quiz(msg.text, msg.chat.id))
+
+
+def update_catalog(quizes: dict[str, Quiz]) -> None:
+    """
+    Replaces the catalog of questionnaires and the start menu. Both are swapped
+    by a single assignment, so handlers see either the old or the new version.
+    Users who have started a quiz keep their ``Quiz`` object.
+    """
+    global all_quizes, start_menu, quizes_by_id
+    all_quizes = quizes
+    quizes_by_id = index_stateless(quizes)
+    start_menu = build_start_menu()
+
+
+def index_stateless(quizes: dict[str, Quiz]) -> dict[int, Quiz]:
+    """Returns quizes which may be taken in stateless sessions by their ids"""
+    index = {}
+    for title, quiz in quizes.items():
+        if stateless.fits(quiz):
+            index[quiz.quiz_id] = quiz
+        elif STATELESS:
+            log.warning('%s: scores do not fit into callback data, it cannot be taken in stateless mode', title)
+    return index
+
+
+def initialize(load_workers: int | None = LOAD_WORKERS):
+    """
+    Loads the catalog of questionnaires and builds the start menu.
+
+    :param load_workers: int (number of processes loading questionnaires, see ``catalog.load_catalog``)
+    """
+    global start_menu, catalog_watcher, quizes_by_id
+    # questionnaires are loaded in parallel (precompiled ones are taken from the cache)
+    reports = load_catalog(get_tests_filenames(), workers=load_workers)
+    for report in reports:
+        if report.quiz is not None:
+            all_quizes[report.quiz.title] = report.quiz
+    log_report(reports)
+    quizes_by_id = index_stateless(all_quizes)
+    catalog_watcher = CatalogWatcher(get_tests_dir(), TEST_EXTN, on_change=update_catalog, interval=RELOAD_INTERVAL)
+    catalog_watcher.seed(reports)
+    start_menu = build_start_menu()
+    if session_db is not None:
+        now = time.time()
+        purged = session_db.purge(idle_before=now - MAX_IDLE_TIME, started_before=now - MAX_SESSION_TIME)
+        log.info('%s expired session(s) are removed from %s', purged, session_db.path)
     return start_menu
 
 
+# removes expired sessions in background and says goodbye to their users (started if SWEEP_INTERVAL > 0)
+expiry_sweeper = ExpirySweeper(User.users, SWEEP_INTERVAL, GOODBYE_RATE,
+                               on_drop=lambda user_id, user: user._forget())
+
+metrics.registry.register(metrics.Gauge("psybot_active_sessions", "Sessions in memory", lambda: len(User.users)))
+metrics.registry.register(metrics.Gauge("psybot_evicted_sessions", "Sessions evicted as expired since start",
+                                        lambda: User.users.evictions))
+metrics.registry.register(metrics.Gauge("psybot_expired_idle_sessions", "Sessions evicted as idle longer than "
+                                        "MAX_IDLE_TIME since start", lambda: User.users.expired_idle))
+metrics.registry.register(metrics.Gauge("psybot_expired_long_sessions", "Sessions evicted as lasting longer than "
+                                        "MAX_SESSION_TIME since start", lambda: User.users.expired_long))
+metrics.registry.register(metrics.Gauge("psybot_pending_goodbyes", "Users of expired sessions waiting for "
+                                        "a goodbye message", lambda: len(expiry_sweeper.pending)))
+metrics.registry.register(metrics.Gauge("psybot_dropped_goodbyes", "Goodbye messages dropped since start "
+                                        "as too late", lambda: expiry_sweeper.dropped))
+
+
+def _result_cache_total(counter: str) -> Callable[[], int]:
+    """Returns a function summing a counter of caches of rendered results over all quizes"""
+    return lambda: sum(getattr(quiz.result_cache, counter) for quiz in all_quizes.values())
+
+
+metrics.registry.register(metrics.Gauge("psybot_result_cache_hits", "Results served from caches of rendered results",
+                                        _result_cache_total("hits")))
+metrics.registry.register(metrics.Gauge("psybot_result_cache_misses", "Results rendered and put to caches",
+                                        _result_cache_total("misses")))
+metrics.registry.register(metrics.Gauge("psybot_result_cache_bypassed", "Results rendered without caches "
+                                        "(large score spaces, unreachable scores)", _result_cache_total("bypassed")))
+
+
+def configure_logging(level: str | None = LOG_LEVEL) -> None:
+    """Sets the level of logging (None turns logging off, so logging calls return at once)"""
+    if level is None:
+        logging.disable(logging.CRITICAL)
+        return
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+def set_outbox(new_outbox: Outbox) -> None:
+    global outbox
+    outbox = new_outbox
+
+
+def run_worker(index: int, processes: int, updates) -> None:
+    """
+    Main function of a worker process of the multi-process mode (see workers.py).
+    The worker owns sessions of its shard of chats; rate limits are shared by all workers equally.
+    """
+    global expiry_sweeper
+    import workers
+    import scheduler
+    configure_logging()
+    initialize(load_workers=1)  # a daemonic process cannot have a pool; the dispatcher has compiled the catalog
+    if METRICS_PORT is not None:
+        metrics.serve(METRICS_PORT + 1 + index)  # the dispatcher takes METRICS_PORT
+    if RELOAD_INTERVAL > 0:
+        catalog_watcher.start()
+    if SWEEP_INTERVAL > 0:
+        expiry_sweeper = ExpirySweeper(User.users, SWEEP_INTERVAL, GOODBYE_RATE / processes,
+                                       on_drop=lambda user_id, user: user._forget())
+        expiry_sweeper.start()
+    if RATE_LIMIT:
+        set_outbox(ScheduledOutbox(bot, global_rate=scheduler.GLOBAL_RATE / processes,
+                                   global_burst=max(1, scheduler.GLOBAL_BURST // processes)))
+    try:
+        workers.process_updates(bot, updates)
+    finally:
+        if isinstance(outbox, ScheduledOutbox):
+            outbox.flush(timeout=5)
+        if session_db is not None:
+            session_db.close()
+        if norms is not None:
+            norms.close()
 
 
 if __name__ == "__main__":
-    start_menu = initialize()
-    bot.infinity_polling()
+    import argparse
+    parser = argparse.ArgumentParser(description="Telegram bot for psychological testing")
+    parser.add_argument("--mode", choices=("polling", "async", "webhook", "workers"), default="polling",
+                        help="polling: infinity polling (default); "
+                             "async: asyncio runtime processing updates of different chats concurrently; "
+                             "webhook: HTTP server receiving updates; "
+                             "workers: updates are sharded by chats to worker processes")
+    parser.add_argument("--host", default=None, help="webhook mode: interface to listen on")
+    parser.add_argument("--port", type=int, default=None, help="webhook mode: port to listen on")
+    parser.add_argument("--url", default=None, help="webhook mode: public URL to set as the bot's webhook")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="workers mode: number of worker processes (default: number of CPUs)")
+    args = parser.parse_args()
+    configure_logging()
+    if METRICS_PORT is not None:
+        metrics.serve(METRICS_PORT)
+    if args.mode == "workers":  # the dispatcher only routes updates, workers load questionnaires themselves
+        import workers
+        # stale questionnaires are compiled to the cache in parallel once, workers load them from the cache
+        compile_catalog(get_tests_filenames(), workers=LOAD_WORKERS)
+        workers.polling(TOKEN, run_worker, processes=args.processes)
+    else:
+        start_menu = initialize()
+        if session_db is not None:
+            import atexit
+            atexit.register(session_db.close)  # pending changes are written on exit
+        if norms is not None:
+            import atexit
+            atexit.register(norms.close)  # histograms are saved, so logs are not replayed at the next start
+        if RELOAD_INTERVAL > 0:
+            catalog_watcher.start()  # hot reload of questionnaires
+        if SWEEP_INTERVAL > 0:
+            expiry_sweeper.start()
+        if args.mode == "async":
+            import asyncio
+            import async_mode
+            asyncio.run(async_mode.polling(bot, TOKEN, set_outbox))
+        elif args.mode == "webhook":
+            import webhook
+            if RATE_LIMIT:
+                set_outbox(ScheduledOutbox(bot))
+            webhook.serve(bot,
+                          host=args.host or webhook.WEBHOOK_HOST,
+                          port=args.port if args.port is not None else webhook.WEBHOOK_PORT,
+                          url=args.url,
+                          secret_token=os.getenv('WEBHOOK_SECRET'))
+        else:
+            if RATE_LIMIT:
+                set_outbox(ScheduledOutbox(bot))
+            bot.infinity_polling()
@@ -0,0 +1,203 @@
+"""
+Lazy storage of questions for very large questionnaires (item banks).
+
+A ``QuestionBank`` keeps only an index of byte offsets of QUESTION blocks in the source file; the offsets
+are recorded while the file is parsed (see ``scan_file``).
+A question is read and parsed when it is requested; recently used questions are kept in a bounded LRU,
+so memory does not grow with the number of questions. Scores of answers are not read lazily:
+they are compiled into ``Quiz.score_tensor`` at load time.
+
+Blocks are read with ``seek`` and ``read`` rather than a memory map: a questionnaire edited in place
+(truncated) while it is mapped would crash the process with SIGBUS instead of raising an error.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from typing import Any, BinaryIO, Optional
+
+import numpy as np
+
+from errors import QuizFileChanged
+from quiz import Question, RawData
+from quiz_parser import QuizParser, parse_question
+
+QUESTION_CACHE_SIZE = 256  # decoded questions (and messages) kept in memory per questionnaire
+
+
+class LazySequence(Sequence):
+    """
+    A read-only sequence of items loaded on demand. Recently used items are kept in an LRU cache.
+
+    :param length: int (number of items)
+    :param load: callable, returns an item by its index
+    :param cache_size: int (maximum number of cached items)
+    """
+
+    def __init__(self, length: int, load: Callable[[int], Any], cache_size: int = QUESTION_CACHE_SIZE):
+        self._length = length
+        self._load = load
+        self.cache_size = max(1, cache_size)
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[int, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int | slice) -> Any:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(f'index {index} is out of range 0...{self._length - 1}')
+        with self._lock:
+            item = self._cache.get(index)
+            if item is not None:
+                self._cache.move_to_end(index)
+                self.hits += 1
+                return item
+        item = self._load(index)  # outside of the lock: other items are served meanwhile
+        with self._lock:
+            self.misses += 1
+            self._cache[index] = item
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return item
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_cache"], state["_lock"]
+        state["hits"] = state["misses"] = 0
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+
+def _snapshot(file: BinaryIO) -> tuple[int, int]:
+    """Returns modification time (in ns) and size of an open file"""
+    stat = os.fstat(file.fileno())
+    return stat.st_mtime_ns, stat.st_size
+
+
+def scan_file(filename: str, comments: str = "#", delimiter: str = "=",
+              lazy_questions: int = 0) -> tuple[RawData, Optional[QuestionBank]]:
+    """
+    Parses a questionnaire file in a single pass, indexing byte offsets of its QUESTION blocks meanwhile.
+    Texts of questions after `lazy_questions` are not kept, so memory at load time does not grow
+    with the number of questions.
+
+    :return: parsed data and a bank of questions if there are more than `lazy_questions` of them
+             (None otherwise, questions of the parsed data are complete)
+    :raise FileNotFoundError: if the file is not available
+    :raise QuizSyntaxError: if the questionnaire is malformed
+    """
+    try:
+        file = open(filename, "rb")
+    except OSError as err:
+        raise FileNotFoundError(f"{filename} not found") from err
+    try:
+        snapshot = _snapshot(file)
+        parser = QuizParser(filename, comments, delimiter, lazy_questions)
+        index = array("q")  # the first byte, the byte after the last line and the first line of every block
+        offset = 0
+        start: Optional[tuple[int, int]] = None  # of the current QUESTION block
+        for line in file:
+            parser.feed(line.decode("utf8"))
+            if parser.keyword == "QUESTION":
+                if start is None:
+                    start = (offset, parser.line_no)
+            elif start is not None:  # the block is ended by this line (a delimiter)
+                index.extend((start[0], offset, start[1]))
+                start = None
+            offset += len(line)
+        if start is not None:  # the last block is not followed by a delimiter
+            index.extend((start[0], offset, start[1]))
+        raw_data = parser.finish()
+        if len(index) // 3 <= lazy_questions:
+            file.close()
+            return raw_data, None
+        if _snapshot(file) != snapshot:  # offsets may point to another content
+            raise QuizFileChanged(filename)
+    except BaseException:
+        file.close()
+        raise
+    bank = QuestionBank(filename, np.frombuffer(index, dtype=np.int64).reshape(-1, 3).copy(), snapshot,
+                        raw_data.answers_type, comments, delimiter, file=file)
+    return raw_data, bank
+
+
+class QuestionBank(LazySequence):
+    """
+    Questions of a questionnaire file read on demand (a drop-in replacement of a list of ``Question``).
+
+    The bank keeps the file it is indexed from open, so a questionnaire replaced by a new file (e.g. by renaming)
+    is still read from the old one. Every read checks that the file has the modification time and the size
+    it had when it was indexed; questions of a file changed in place are not read (``QuizFileChanged``).
+
+    :param filename: str (full path to the questionnaire file)
+    :param index: int64 array of shape (number of questions, 3): the first byte of a block,
+                  the byte after its last line and the number of its first line (see ``scan_file``)
+    :param snapshot: tuple of modification time (in ns) and size of the file when it was indexed
+    :param answers_type: str (COMMON or SPECIFIC, as in ANSWERS block of the file)
+    :param comments: str (a line starting with this char(s) is dropped)
+    :param delimiter: str (a line starting with this char(s) divides blocks)
+    :param cache_size: int (maximum number of decoded questions kept in memory)
+    :param file: the file open in binary mode the bank is indexed from, None - the file is opened by name
+    """
+
+    def __init__(self, filename: str, index: np.ndarray, snapshot: tuple[int, int], answers_type: str = "COMMON",
+                 comments: str = "#", delimiter: str = "=", cache_size: int = QUESTION_CACHE_SIZE,
+                 file: Optional[BinaryIO] = None):
+        self.filename = os.path.abspath(filename)  # the working directory may change
+        self.index = index
+        self.snapshot = tuple(snapshot)
+        self.answers_type = answers_type
+        self.comments = comments
+        self.delimiter = delimiter
+        self._file = file
+        self._file_lock = threading.Lock()
+        super().__init__(len(self.index), self._read, cache_size)
+
+    def _open(self) -> None:
+        try:
+            self._file = open(self.filename, "rb")
+        except OSError:
+            self._file = None
+
+    def _read(self, question_id: int) -> Question:
+        """:raise QuizFileChanged: if the file has changed since it was indexed"""
+        start, end, line_no = self.index[question_id].tolist()
+        with self._file_lock:
+            if self._file is None:
+                self._open()
+            if self._file is None or _snapshot(self._file) != self.snapshot:
+                raise QuizFileChanged(self.filename)
+            self._file.seek(start)
+            block = self._file.read(end - start)
+        return parse_question(block.decode("utf8").splitlines(keepends=True), question_id, self.answers_type,
+                              self.filename, line_no, self.comments, self.delimiter)
+
+    def close(self) -> None:
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __getstate__(self) -> dict:
+        state = super().__getstate__()
+        del state["_file"], state["_file_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        super().__setstate__(state)
+        self._file_lock = threading.Lock()
+        self._open()  # a bank restored from a cache holds the file from now on, as a parsed one does
@@ -4,21 +4,46 @@ from collections import namedtuple
 
 from collections import defaultdict
 
+import bisect
+
+import hashlib
+
+import logging
+
+import math
+
 from collections.abc import Sequence, Generator
 
 from typing import Any, Optional
 
 from dataclasses import dataclass
 
-LANGUAGE = "RU"
+import numpy as np
+
+from buttons import answers_kb_json, answers_kb_template, render_answers_kb
+
+from messages import messages_for, resolve_locale
+
+from result_cache import ResultCache
+
+log = logging.getLogger(__name__)
 
 QUIZ_FILENAME = "test1.txt"
 
+KEYBOARD_CACHE_SIZE = 1024  # distinct sets of answers whose keyboards are shared, per quiz (bounds item banks)
+
 Answer: namedtuple = namedtuple("Answer", ["id", "text", "scales"])  # datatype for answer options
 
 Question: namedtuple = namedtuple("Question", ["id", "text", "answers"])  # datatype for a quiz question
 
 
+# Datatype for a message with a question ready to be sent: text with "(i/n)" prefix, serialized keyboard
+# (rendered once from a template shared by questions with the same answer options,
+# see ``buttons.answers_kb_template``), the question id and pairs of answer id and answer text
+# (to build keyboards with other callback data)
+QuestionPayload: namedtuple = namedtuple("QuestionPayload", ["text", "markup", "question_id", "answers"])
+
+
 @dataclass
 class Scale:
     """
@@ -59,6 +84,67 @@ interval of scores on the given scale (measurements).
         return (f'{self.__class__.__name__}: {self.interval}, text: "{self.description}"')
 
 
+class ScaleIndex:
+    """Lookup index of interpretations (``ResultRecord``) of a single scale.
+
+Intervals are sorted by their lower bounds, so a lookup is a binary search.
+If the reachable range of scores is small, a dense table maps every reachable
+score to its interpretation, and a lookup is a single indexing.
+"""
+    DENSE_TABLE_LIMIT = 4096  # maximum size of a dense table (number of reachable scores)
+
+    def __init__(self, records: list[ResultRecord], score_range: Optional[tuple[int, int]] = None):
+        self.records = sorted(records, key=lambda r: -math.inf if r.interval.min_ is None else r.interval.min_)
+        self.starts = [-math.inf if r.interval.min_ is None else r.interval.min_ for r in self.records]
+        self.table: Optional[list[Optional[ResultRecord]]] = None
+        self.low = None
+        if score_range is not None and score_range[1] - score_range[0] < self.DENSE_TABLE_LIMIT:
+            self.low = score_range[0]
+            # the first matching record in file order wins, as in a linear scan
+            self.table = [next((r for r in records if v in r.interval), None)
+                          for v in range(score_range[0], score_range[1] + 1)]
+
+    def lookup(self, v: int) -> ResultRecord | None:
+        if self.table is not None:
+            position = v - self.low
+            if 0 <= position < len(self.table):
+                return self.table[position]
+        position = bisect.bisect_right(self.starts, v) - 1
+        if position < 0:
+            return None
+        record = self.records[position]
+        return record if v in record.interval else None
+
+    def issues(self, score_range: Optional[tuple[int, int]] = None) -> list[str]:
+        """
+        Returns descriptions of overlapping intervals and of gaps between intervals
+        (only gaps within the reachable range of scores, if it is given)
+        """
+        low, high = score_range if score_range is not None else (-math.inf, math.inf)
+        found = []
+
+        def gap(first: float, last: float) -> None:  # reports a gap if it is within the reachable range
+            first, last = max(first, low), min(last, high)
+            if first <= last:
+                found.append(f'no interpretation for scores {_interval_str((first, last))}')
+
+        covered = -math.inf  # upper bound of scores covered by intervals checked so far
+        for number, (record, start) in enumerate(zip(self.records, self.starts)):
+            end = math.inf if record.interval.max_ is None else record.interval.max_
+            if number > 0 and start <= covered:
+                found.append(f'interval {_interval_str(record.interval)} overlaps with the previous one')
+            elif start > covered + 1:
+                gap(covered + 1, start - 1)
+            covered = max(covered, end)
+        gap(covered + 1, math.inf)
+        return found
+
+
+def _interval_str(interval: tuple) -> str:
+    bounds = ["" if b is None or math.isinf(b) else str(int(b)) for b in interval]
+    return "...".join(bounds)
+
+
 class Result(defaultdict):
     """This dictionary-like object will create an empty list by default if a key is absent.
 Keys are names of scales (str). Values are list of interpretations for the relevant scale
@@ -67,17 +153,37 @@ Keys are names of scales (str). Values are list of interpretations for the relev
 
     def __init__(self):
         super().__init__(list)
+        self._index: dict[str, ScaleIndex] = {}
+
+    def __reduce__(self):
+        # ``defaultdict`` pickles its default factory as an argument of ``__init__``
+        return self.__class__, (), self.__dict__, None, iter(self.items())
 
     def update(self, other, **kwargs):
         for k, v in other.items():
             self[k].append(v)
 
+    def build_index(self, score_ranges: Optional[dict[str, tuple[int, int]]] = None) -> list[str]:
+        """
+        Builds lookup indexes of all scales.
+
+        :param score_ranges: reachable ranges of scores (min, max) by scale names
+        :return: list of detected problems (gaps and overlaps of intervals)
+        """
+        score_ranges = score_ranges or {}
+        issues = []
+        self._index = {}
+        for k, records in self.items():
+            index = ScaleIndex(records, score_ranges.get(k))
+            self._index[k] = index
+            issues.extend(f'RESULTS {k}: {issue}' for issue in index.issues(score_ranges.get(k)))
+        return issues
+
     def get_by_interval(self, k, v: int) -> ResultRecord | None:
-        try:
-            records = self[k]
-        except KeyError:
-            return None
-        for record in records:
+        index = self._index.get(k)
+        if index is not None:
+            return index.lookup(v)
+        for record in self.get(k, ()):
             if v in record.interval:
                 return record
         return None
@@ -112,162 +218,40 @@ class Quiz:
     """
 
     @classmethod
-    def quiz_from_file(cls, filename: str = QUIZ_FILENAME, comments: str = "#", delimiter: str = "=") -> Quiz:
+    def quiz_from_file(cls, filename: str = QUIZ_FILENAME, comments: str = "#", delimiter: str = "=",
+                       lazy_questions: Optional[int] = None) -> Quiz:
         """
         Class method of ``Quiz`` class, creates an instance of ``Quiz`` from a special formatted text file.        
         
         :param filename: str (full path to a text file)
         :param comments: str (a line starting with this char(s) will be dropped)
         :param delimiter: str (a line starting with this char(s) divides blocks of information)
+        :param lazy_questions: int (if the questionnaire has more questions, they are read from the file
+                               on demand, see question_bank.py), None - questions are always kept in memory
         :return: Quiz class instance
+        :raise FileNotFoundError: if the file is not available
+        :raise QuizSyntaxError: if the file is malformed (the message points to the line and the column)
         """
-        block = []
-        # `handlers` maps keywords to handlers (class methods)
-        handlers = {"TITLE": __class__.title_handle,
-                    "ANSWERS": __class__.answers_handle,
-                    "QUESTION": __class__.question_handle,
-                    "DESCRIPTION": __class__.description_handle,
-                    "SCALES": __class__.scales_handle,
-                    "RESULTS": __class__.results_handle,
-                    }
-
-        raw_data = RawData()  # stores raw data before creating ``Quiz`` object
-        raw_data.results = Result()
+        if lazy_questions is None:
+            from quiz_parser import parse_file  # the parser depends on datatypes of this module
 
-        try:
-            with open(filename, "r", encoding="utf8") as f:
-                for line in f:
-                    if line.startswith(comments):  # drop comment lines
-                        continue
-                    if line.startswith(delimiter):  # If a line starts with a delimiter,
-                        if len(block) > 0:          # lines above (`block`) will be handled
-                            keyword = block[0].split()[0]
-                            if keyword in handlers:
-                                handlers[keyword](block, raw_data)  # calls a relevant handler method
-                                block = []
-                    else:
-                        block.append(line.strip())  # adds a line to `block`
-        except OSError as err:  # catch an exception if file is not found / no available
-            raise FileNotFoundError(f"{filename} not found") from err
+            raw_data, question_bank = parse_file(filename, comments, delimiter), None
+        else:  # texts of questions are dropped while the file is parsed, their offsets are indexed
+            from question_bank import scan_file
+
+            raw_data, question_bank = scan_file(filename, comments, delimiter, lazy_questions)
         return cls(title=raw_data.title,
                    description=raw_data.description,
                    questions=raw_data.questions,
                    results=raw_data.results,
                    answers=raw_data.answers,
                    scales=raw_data.scales,
-                   answers_type=raw_data.answers_type)
-
-    @staticmethod
-    def title_handle(lines: str, raw_data: RawData) -> RawData:
-        raw_data.title = lines[0][len("title") + 1:]
-        return raw_data
-
-    @staticmethod
-    def answers_handle(lines: list[str], raw_data: RawData) -> RawData:
-        answers_type: str = lines[0][len("answers") + 1:].strip()
-        if answers_type == "SPECIFIC":
-            raw_data.answers_type = answers_type
-            raw_data.answers = None
-            return raw_data
-        elif answers_type == "COMMON":
-            answers = Quiz.answers_list(lines[1:])
-            raw_data.answers_type = "COMMON"
-            raw_data.answers = answers
-            return raw_data
-
-    @staticmethod
-    def answers_list(lines: list[str]) -> Sequence[Answer]:
-        answers = []
-        answer: Answer
-        for answer_id, line in enumerate(lines):
-            answer_text, raw_scales, _ = Quiz.parse_curly_braces(line)
-            answer_scales: dict[str, int] = {}
-            for scale in raw_scales.split(","):
-                scale_name, scale_score = scale.strip().split()
-                answer_scales.update({scale_name.strip(): int(scale_score)})
-            answer = Answer(answer_id, answer_text.strip(), answer_scales)
-            answers.append(answer)
-        return answers
-
-    @staticmethod
-    def question_handle(lines: list[str], raw_data: RawData):
-        if raw_data.questions is None:
-            question_id = 0
-            raw_data.questions = []
-        else:
-            question_id = raw_data.questions[-1].id + 1
-        question_text = lines[0][len("question") + 1:].strip()
-        if raw_data.answers_type == "SPECIFIC" and len(lines) > 1:
-            answers = Quiz.answers_list(lines[1:])
-        else:
-            answers = None
-        raw_data.questions.append(Question(question_id, question_text, answers))
-        return raw_data
-
-    @staticmethod
-    def description_handle(lines: list[str], raw_data: RawData) -> RawData:
-        raw_string: str = "".join(lines)
-        _, into_curly, _ = Quiz.parse_curly_braces(raw_string)
-        raw_data.description = into_curly
-        return raw_data
-
-    @staticmethod
-    def scales_handle(lines: list[str], raw_data: RawData):
-        lines.pop(0)
-        scales = {}
-        for line in lines:
-            scale_id, scale_name = line.strip().split(maxsplit=1)
-            scales[scale_id] = Scale(name=scale_name)
-        raw_data.scales = scales
-        return raw_data
-
-    @staticmethod
-    def results_handle(lines: list[str], raw_data: RawData):
-        lines.pop(0)
-        raw_string = "".join(lines)
-        results = raw_string.split("}")
-        for result in results:
-            if result.count("{") == 0:
-                continue
-            header, body = result.split("{", maxsplit=1)
-            header = header.strip()
-            body = body.strip()
-            scale_id, interval_as_string = header.split(maxsplit=1)
-            if interval_as_string.startswith("..."):
-                min_ = None
-                max_ = int(interval_as_string.strip("..."))
-            elif interval_as_string.endswith("..."):
-                max_ = None
-                min_ = int(interval_as_string.strip("..."))
-            else:
-                min_, max_ = map(int, interval_as_string.split("..."))
-            result_record = ResultRecord(interval=Interval(min_, max_), description=body)
-            raw_data.results[scale_id].append(result_record)
-        return raw_data
-
-    @staticmethod
-    def parse_curly_braces(raw_string: str) -> tuple[str, str, str]:
-        """
-        Parses a text with curly braces and returns a tuple of three strings (``str``):
-
-        * before "{"
-        * into "{" and "}"
-        * after "}"
-
-        :param raw_string: str (a text with curly braces)
-        :return: tuple of 3 (three) strings
-        """
-        if raw_string.count("{") == 0 or raw_string.count("}") == 0:
-            return (raw_string, "", "")
-        l: int = raw_string.find("{")
-        r: int = raw_string.rfind("}")
-        before_curly: str = raw_string[:l].strip("{}")
-        into_curly: str = raw_string[l:r].strip("{}")
-        after_curly: str = raw_string[r:].strip("{}")
-        return (before_curly, into_curly, after_curly)
+                   answers_type=raw_data.answers_type,
+                   question_bank=question_bank)
 
     def __init__(self, title: str, description: str, questions: Sequence[Question], results: Result,
-                 answers: Sequence[Answer] = None, scales: dict = None, answers_type: str = "COMMON", ):
+                 answers: Sequence[Answer] = None, scales: dict = None, answers_type: str = "COMMON",
+                 question_bank: Optional[Sequence[Question]] = None):
         self.results = results
         self.answers_type = answers_type
         self.questions = questions
@@ -275,6 +259,174 @@ class Quiz:
         self.description = description
         self.answers = answers
         self.scales = scales if scales is not None else {"SC": Scale(name="Scores")}
+        self.scale_ids: list[str] = list(self.scales)  # order of scales in score vectors
+        self.answer_sets: int = self._intern_answers()
+        self._keyboards: dict[tuple, tuple[list[tuple[int, str]], Optional[tuple[str, ...]]]] = {}
+        self.score_tensor: np.ndarray = self._compile_scores()
+        self.answer_counts: np.ndarray = np.array([len(self._get_answers_list(question.id) or [])
+                                                   for question in self.questions or []], dtype=np.int32)
+        self.score_ranges: dict[str, tuple[int, int]] = self._score_ranges()
+        self.result_issues: list[str] = self.results.build_index(self.score_ranges)
+        self.result_cache: ResultCache = self._result_cache()
+        self.quiz_id: int = self._fingerprint()
+        if question_bank is not None:  # scores are compiled, texts of questions are read on demand
+            from question_bank import LazySequence
+
+            self.questions = question_bank
+            self.payloads: Sequence[QuestionPayload] = LazySequence(len(question_bank), self._payload,
+                                                                    question_bank.cache_size)
+        else:
+            self.payloads = self._compile_payloads()
+
+    def _fingerprint(self) -> int:
+        """
+        Returns a 32-bit id of the quiz. It is the same in every process loading the same questionnaire,
+        and changes if the title, scales, questions or scores change.
+        """
+        digest = hashlib.blake2b(digest_size=4)
+        digest.update(self.title.encode())
+        digest.update("\0".join(self.scale_ids).encode())
+        digest.update(repr(self.score_tensor.shape).encode())
+        digest.update(self.score_tensor.tobytes())
+        return int.from_bytes(digest.digest(), "big")
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Number of questions with answers per distinct set of answers"""
+        if self.answers_type == "COMMON":
+            return float(len(self.questions or [])) if self.answers else 1.0
+        return self._answered_questions / max(self.answer_sets, 1)
+
+    def _intern_answers(self) -> int:
+        """
+        Makes questions with identical answers (texts and scores) share one list of ``Answer``,
+        and identical answers share one tuple and one dictionary of scores
+        (SPECIFIC questionnaires repeat the same options from question to question).
+
+        :return: number of distinct sets of answers
+        """
+        if self.answers_type == "COMMON":
+            self._answered_questions = len(self.questions or []) if self.answers else 0
+            return 1 if self.answers else 0
+        answers_pool: dict[tuple, Answer] = {}
+        sets: dict[tuple, list[Answer]] = {}
+        questions = []
+        for question in self.questions or []:
+            if question.answers:
+                answers = []
+                for answer in question.answers:
+                    key = (answer.id, answer.text, tuple(answer.scales.items()))
+                    answers.append(answers_pool.setdefault(key, answer))
+                question = question._replace(answers=sets.setdefault(tuple(map(id, answers)), answers))
+            questions.append(question)
+        self.questions = questions
+        self._answered_questions = sum(1 for question in questions if question.answers)
+        return len(sets)
+
+    def _keyboard(self, answers: Sequence[Answer]) -> tuple[list[tuple[int, str]], Optional[tuple[str, ...]]]:
+        """Returns answer options as pairs of id and text and a keyboard template, shared by identical sets"""
+        key = tuple((answer.id, answer.text) for answer in answers)
+        keyboard = self._keyboards.get(key)
+        if keyboard is None:
+            pairs = list(key)
+            keyboard = (pairs, answers_kb_template(pairs))
+            if len(self._keyboards) < KEYBOARD_CACHE_SIZE:
+                self._keyboards[key] = keyboard
+        return keyboard
+
+    def _compile_payloads(self) -> list[QuestionPayload]:
+        """Prepares messages with questions (texts and keyboards are immutable for a quiz)"""
+        return [self._payload(question.id) for question in self.questions or []]
+
+    def _payload(self, question_id: int) -> QuestionPayload:
+        question = self.questions[question_id]
+        prefix = f'({question.id + 1}/{len(self.questions)}) '
+        text = (prefix + question.text).replace('\\n', '\n')
+        answers_list = self._get_answers_list(question.id)
+        if not answers_list:
+            return QuestionPayload(text, answers_kb_json([], question.id), question.id, [])
+        answers, template = self._keyboard(answers_list)
+        if template is None:  # the placeholder is found in answer texts
+            markup = answers_kb_json(answers, question.id)
+        else:
+            markup = render_answers_kb(template, question.id)
+        return QuestionPayload(text, markup, question.id, answers)
+
+    def _compile_scores(self) -> np.ndarray:
+        """
+        Compiles scores of all answers into a dense tensor of shape
+        (number of questions, maximum number of answers, number of scales).
+        An element [question_id, answer_id] is a vector of scores added to every scale.
+        """
+        scale_index = {scale_id: index for index, scale_id in enumerate(self.scale_ids)}
+        questions = self.questions or []
+        answers_lists = [self._get_answers_list(question.id) or [] for question in questions]
+        max_answers = max((len(answers) for answers in answers_lists), default=0)
+        tensor = np.zeros((len(questions), max_answers, len(self.scale_ids)), dtype=np.int32)
+        for question_id, answers in enumerate(answers_lists):
+            for answer in answers:
+                for scale_id, score in answer.scales.items():
+                    if scale_id not in scale_index:
+                        raise ValueError(f'{self.title}: scale {scale_id} of answer "{answer.text}" '
+                                         f'(question #{question_id + 1}) is not listed in SCALES')
+                    tensor[question_id, answer.id, scale_index[scale_id]] = score
+        return tensor
+
+    def _score_ranges(self) -> dict[str, tuple[int, int]]:
+        """Returns reachable ranges of scores (min, max) by scale names"""
+        low = np.zeros(len(self.scale_ids), dtype=np.int64)
+        high = np.zeros(len(self.scale_ids), dtype=np.int64)
+        for question in self.questions or []:
+            answers_number = len(self._get_answers_list(question.id) or [])
+            if answers_number:
+                scores = self.score_tensor[question.id, :answers_number]
+                low += scores.min(axis=0)
+                high += scores.max(axis=0)
+        return {scale_id: (int(low[i]), int(high[i])) for i, scale_id in enumerate(self.scale_ids)}
+
+    def _result_cache(self) -> ResultCache:
+        """Makes a cache of results over scales having interpretations (other scales are not shown)"""
+        positions = [i for i, scale_id in enumerate(self.scale_ids) if scale_id in self.results]
+        return ResultCache(positions, [self.score_ranges[self.scale_ids[i]] for i in positions])
+
+    def new_scores(self) -> np.ndarray:
+        """Returns a zero score vector (one element per scale, in the order of `scale_ids`)"""
+        return np.zeros(len(self.scale_ids), dtype=np.int32)
+
+    def add_answer_scores(self, scores: np.ndarray, question_id: int, answer_id: int) -> None:
+        """
+        Adds scores of an answer to a score vector (in place).
+        Raises IndexError if there is no such question or answer (rows of the tensor are padded with zeros,
+        so they shall not be indexed by unchecked ids, e.g. from callback data of an old keyboard)
+        """
+        if not 0 <= question_id < len(self.answer_counts):
+            raise IndexError(f'There is no question with id# {question_id}')
+        if not 0 <= answer_id < self.answer_counts[question_id]:
+            raise IndexError(f'There is no answer with id# {answer_id} to question id# {question_id}')
+        scores += self.score_tensor[question_id, answer_id]
+
+    def score_batch(self, responses: np.ndarray) -> np.ndarray:
+        """
+        Scores many respondents at once.
+
+        :param responses: int array of shape (number of respondents, number of questions),
+                          an element is an id of the answer chosen by a respondent
+        :raise ValueError: if an answer id is not an answer of its question (the first one is named)
+        :return: int array of shape (number of respondents, number of scales) with scale totals
+                 (scales are in the order of `scale_ids`)
+        """
+        responses = np.asarray(responses)
+        n_questions, n_answers, _ = self.score_tensor.shape
+        if responses.ndim != 2 or responses.shape[1] != n_questions:
+            raise ValueError(f'responses shall have shape (n, {n_questions}), {responses.shape} is given')
+        invalid = (responses < 0) | (responses >= self.answer_counts)  # as ``add_answer_scores`` checks them
+        if invalid.any():  # rows of the tensor are padded with zeros, an unchecked id would be scored as 0
+            row, question_id = np.argwhere(invalid)[0].tolist()
+            raise ValueError(f'respondent #{row}: there is no answer with id# {responses[row, question_id]} '
+                             f'to question id# {question_id}')
+        flat_index = responses + np.arange(n_questions) * n_answers  # index in (question, answer) plane
+        flat_tensor = self.score_tensor.reshape(n_questions * n_answers, -1)
+        return flat_tensor[flat_index].sum(axis=1, dtype=np.int64)
 
     def question_text(self, question_id: int) -> str:
         """
@@ -286,8 +438,7 @@ class Quiz:
         try:
             return self.questions[question_id].text
         except IndexError as err:
-            print(f'There is no question with {question_id} number')
-            print(err)
+            log.warning('There is no question with %s number: %s', question_id, err)
             return ""
 
     def answers_text(self, question_id: int) -> Generator[tuple[int, str], Any, Any]:
@@ -325,18 +476,40 @@ class Quiz:
             except IndexError as err:
                 raise IndexError(f'There is no question with id# {question_id}')
 
-    def get_result(self, scores: dict[str, Scale]) -> str:
-        results_for_user: str = {"RU": "Ваши результаты:\n",
-                                 "EN": "That is your results:\n",
-                                 }[LANGUAGE]
+    def get_result(self, scores: np.ndarray, locale: Optional[str] = None,
+                   percentiles: Optional[Sequence[int]] = None) -> str:
+        """
+        Returns interpretation of test results, ready to be sent as Markdown ("\\n" of the questionnaire
+        are replaced by line breaks). Texts are cached by score vectors (see result_cache.py).
+
+        :param scores: score vector (in the order of `scale_ids`)
+        :param locale: str (language of headers, see messages.py), None - the default language
+        :param percentiles: percentile ranks of scores among other users (in the order of `scale_ids`,
+                            see norms.py), None - they are not shown
+        """
+        locale = resolve_locale(locale)
+        values = scores.tolist()
+        key = self.result_cache.key(values)
+        results_for_user = self.result_cache.get(locale, key)
+        if results_for_user is None:
+            results_for_user = self._render_result(values, locale)
+            self.result_cache.put(locale, key, results_for_user)
+        if percentiles is not None:  # they change with every completion, so they are not cached
+            messages = messages_for(locale)
+            lines = messages.percentiles + "".join(
+                messages.percentile.format(scale=self.scales[scale_id].name, percentile=percentile)
+                for scale_id, percentile in zip(self.scale_ids, percentiles) if scale_id in self.results)
+            results_for_user += lines.replace('\\n', '\n')  # names of scales are texts of the questionnaire
+        return results_for_user
+
+    def _render_result(self, values: list[int], locale: str) -> str:
+        messages = messages_for(locale)
+        results_for_user: str = messages.results
         scale_id: str
-        score: Scale
-        for scale_id, score in scores.items():
+        for scale_id, value in zip(self.scale_ids, values):
             if scale_id in self.results:
-                result_record = self.results.get_by_interval(scale_id, score.value)
-                about_scale: str = {"RU": "По шкале ",
-                                    "EN": "Measurements of the scale ",
-                                    }[LANGUAGE]
-                results_for_user += f'{about_scale}{self.scales[scale_id].name}: {score.value}\n'
-                results_for_user += result_record.description + '\n'
-        return results_for_user
+                result_record = self.results.get_by_interval(scale_id, value)
+                results_for_user += f'{messages.about_scale}{self.scales[scale_id].name}: {value}\n'
+                if result_record is not None:  # gaps between intervals are reported at load time
+                    results_for_user += result_record.description + '\n'
+        return results_for_user.replace('\\n', '\n')  # the cached text is sent as is
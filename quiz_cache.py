@@ -0,0 +1,180 @@
+"""
+Cache of precompiled questionnaires.
+
+A compiled questionnaire is a pickled ``Quiz`` object stored in `QUIZ_CACHE_DIR` subdirectory
+next to the source file. The cache file starts with a header (format version, mtime, size and SHA-256
+of the source file), so a stale cache is detected without unpickling the questionnaire itself.
+
+Run this module to precompile all questionnaires of a directory:
+    python quiz_cache.py [directory] [--force]
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import pickle
+import time
+from typing import Optional
+
+from config import LAZY_QUESTIONS, QUIZ_CACHE_DIR, TEST_EXTN, TESTS_DIR
+from quiz import Quiz
+
+log = logging.getLogger(__name__)
+
+CACHE_FORMAT = 11  # increase it whenever ``Quiz`` attributes change, so old caches are recompiled
+
+CACHE_EXTN = "quiz"
+
+
+def cache_filename(filename: str) -> str:
+    """
+    Returns a path of the cache file for a questionnaire file
+    """
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, QUIZ_CACHE_DIR, f'{name}.{CACHE_EXTN}')
+
+
+def _source_hash(filename: str) -> str:
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _read_header(cache_name: str) -> Optional[dict]:
+    try:
+        with open(cache_name, "rb") as f:
+            header = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if not isinstance(header, dict) or header.get("format") != CACHE_FORMAT:
+        return None
+    if header.get("lazy_questions") != LAZY_QUESTIONS:  # compiled with another threshold of lazy questions
+        return None
+    return header
+
+
+def _read_quiz(cache_name: str) -> Optional[Quiz]:
+    try:
+        with open(cache_name, "rb") as f:
+            pickle.load(f)  # header
+            quiz = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError):
+        return None
+    return quiz if isinstance(quiz, Quiz) else None
+
+
+def _write(cache_name: str, header: dict, quiz: Quiz) -> None:
+    os.makedirs(os.path.dirname(cache_name), exist_ok=True)
+    tmp_name = f'{cache_name}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_name, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(quiz, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_name, cache_name)  # readers never see a partially written cache
+    except OSError as err:
+        log.warning('Cache for %s is not saved: %s', cache_name, err)
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+
+def compile_quiz(filename: str) -> Quiz:
+    """
+    Parses a questionnaire file and saves the compiled questionnaire to the cache.
+
+    :param filename: str (full path to a text file)
+    :return: Quiz class instance
+    """
+    stat = os.stat(filename)
+    quiz = Quiz.quiz_from_file(filename, lazy_questions=LAZY_QUESTIONS)
+    header = {"format": CACHE_FORMAT,
+              "lazy_questions": LAZY_QUESTIONS,
+              "mtime_ns": stat.st_mtime_ns,
+              "size": stat.st_size,
+              "sha256": _source_hash(filename),
+              }
+    _write(cache_filename(filename), header, quiz)
+    return quiz
+
+
+def load_quiz(filename: str) -> Quiz:
+    """
+    Returns a questionnaire from the cache. The text file is parsed (and the cache is updated)
+    only if the source file has changed since it was compiled.
+
+    The cache is valid if mtime and size of the source file match the header.
+    If only mtime differs, the content hash decides.
+
+    :param filename: str (full path to a text file)
+    :return: Quiz class instance
+    """
+    cache_name = cache_filename(filename)
+    try:
+        stat = os.stat(filename)
+    except OSError as err:
+        raise FileNotFoundError(f"{filename} not found") from err
+    header = _read_header(cache_name)
+    if header is None or header["size"] != stat.st_size:
+        return compile_quiz(filename)
+    if header["mtime_ns"] != stat.st_mtime_ns:
+        if header["sha256"] != _source_hash(filename):
+            return compile_quiz(filename)
+        quiz = _read_quiz(cache_name)
+        if quiz is None:
+            return compile_quiz(filename)
+        header["mtime_ns"] = stat.st_mtime_ns  # the file is touched but not changed
+        _write(cache_name, header, quiz)
+        return quiz
+    quiz = _read_quiz(cache_name)
+    return quiz if quiz is not None else compile_quiz(filename)
+
+
+def refresh_cache(filename: str) -> str:
+    """
+    Compiles a questionnaire if its cache is stale. Unlike ``load_quiz``, an up-to-date cache is not unpickled,
+    so a process compiling questionnaires for another one passes them through cache files (see catalog.py).
+
+    :param filename: str (full path to a text file)
+    :return: str (the cache filename)
+    """
+    cache_name = cache_filename(filename)
+    try:
+        stat = os.stat(filename)
+    except OSError as err:
+        raise FileNotFoundError(f"{filename} not found") from err
+    header = _read_header(cache_name)
+    if header is None or header["size"] != stat.st_size or header["mtime_ns"] != stat.st_mtime_ns:
+        load_quiz(filename)  # the content hash decides whether the questionnaire is recompiled
+    return cache_name
+
+
+def precompile(directory: str = TESTS_DIR, extension: str = TEST_EXTN, force: bool = False) -> int:
+    """
+    Compiles all questionnaires of a directory.
+
+    :param directory: str (a directory with questionnaires)
+    :param extension: str (extension of questionnaire files)
+    :param force: bool (recompile even if the cache is up to date)
+    :return: number of compiled questionnaires
+    """
+    count = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(extension):
+            continue
+        filename = os.path.join(directory, name)
+        if force:
+            compile_quiz(filename)
+        else:
+            load_quiz(filename)
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Precompiles questionnaires to the quiz cache")
+    parser.add_argument("directory", nargs="?", default=TESTS_DIR, help="a directory with questionnaires")
+    parser.add_argument("--force", action="store_true", help="recompile up-to-date questionnaires too")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    compiled = precompile(args.directory, force=args.force)
+    print(f'{compiled} questionnaire(s) compiled in {time.perf_counter() - start:.3f} sec.')
@@ -0,0 +1,337 @@
+"""
+Single-pass parser of questionnaire files (see the format in README.md).
+
+The file is streamed line by line and every line is handled at once by the handler of the current block,
+so nothing is re-joined or re-split. Texts in curly braces may span several lines; they are scanned
+with ``str.find``, keeping only the parts of the current text. Errors are reported with line and column.
+"""
+from __future__ import annotations
+
+from collections.abc import Iterable
+from typing import Optional
+
+from errors import QuizSyntaxError
+from quiz import Answer, Interval, Question, RawData, Result, ResultRecord, Scale
+
+INTERVAL_DELIMITER = "..."
+
+
+class QuizParser:
+    """
+    A state machine consuming lines of a questionnaire.
+
+    Usage: call ``feed`` for every line, then ``finish`` to get ``RawData``.
+
+    :param filename: str (used in error messages)
+    :param comments: str (a line starting with this char(s) is dropped)
+    :param delimiter: str (a line starting with this char(s) ends a block)
+    :param lazy_questions: int (texts of questions after this number are not kept, such questions are read
+                           on demand, see question_bank.py), None - all questions are kept
+    """
+
+    def __init__(self, filename: str = "<string>", comments: str = "#", delimiter: str = "=",
+                 lazy_questions: Optional[int] = None):
+        self.filename = filename
+        self.comments = comments
+        self.delimiter = delimiter
+        self.lazy_questions = lazy_questions
+        self.raw = RawData()
+        self.raw.results = Result()
+        self._blocks = {"TITLE": (self._title_start, self._ignore, self._no_end),
+                        "SCALES": (self._scales_start, self._scales_line, self._scales_end),
+                        "DESCRIPTION": (self._description_line, self._description_line, self._description_end),
+                        "ANSWERS": (self._answers_start, self._answers_line, self._answers_end),
+                        "QUESTION": (self._question_start, self._question_line, self._question_end),
+                        "RESULTS": (self._ignore, self._results_line, self._results_end),
+                        }
+        self._line_no = 0
+        self._keyword: Optional[str] = None  # keyword of the current block (None - between blocks)
+        self._block_line = 0  # number of the line with the keyword
+        self._on_line = self._on_end = None
+        # state of the current block
+        self._scales: dict[str, Scale] = {}
+        self._answers: list[Answer] = []
+        self._answers_common = False
+        self._question_text = ""
+        self._parts: list[str] = []  # parts of a text in curly braces
+        self._header: list[str] = []  # parts of a text before curly braces (a header of a result)
+        self._header_pos: Optional[tuple[int, int]] = None
+        self._brace_pos: Optional[tuple[int, int]] = None  # position of an open curly brace
+        # answers of questions not kept: only their scores are compiled, so they are shared by ids and scores
+        self._answers_pool: dict[tuple, Answer] = {}
+        self._answer_sets: dict[tuple, list[Answer]] = {}
+
+    @property
+    def keyword(self) -> Optional[str]:
+        """Keyword of the current block (None - between blocks)"""
+        return self._keyword
+
+    @property
+    def line_no(self) -> int:
+        """Number of the last fed line"""
+        return self._line_no
+
+    def error(self, message: str, column: int = 1, line: Optional[int] = None) -> QuizSyntaxError:
+        return QuizSyntaxError(self.filename, self._line_no if line is None else line, column, message)
+
+    def feed(self, line: str) -> None:
+        self._line_no += 1
+        if line.startswith(self.comments):
+            return
+        if line.startswith(self.delimiter):
+            self._end_block()
+            return
+        text = line.strip()
+        column = len(line) - len(line.lstrip()) + 1  # column of the first char of `text`
+        if self._keyword is not None:
+            self._on_line(text, column)
+            return
+        if not text:
+            return
+        keyword = text.split(maxsplit=1)[0]
+        if keyword not in self._blocks:
+            raise self.error(f'unknown keyword {keyword!r}, expected one of: {", ".join(self._blocks)}', column)
+        on_start, self._on_line, self._on_end = self._blocks[keyword]
+        self._keyword = keyword
+        self._block_line = self._line_no
+        on_start(text, column)
+
+    def finish(self) -> RawData:
+        """Ends the last block (it may be not followed by a delimiter) and returns parsed data"""
+        self._end_block()
+        if not hasattr(self.raw, "title"):
+            raise self.error("TITLE block is missing", line=1)
+        return self.raw
+
+    def _end_block(self) -> None:
+        if self._keyword is not None:
+            self._on_end()
+            self._keyword = None
+
+    def _ignore(self, text: str, column: int) -> None:
+        pass
+
+    def _no_end(self) -> None:
+        pass
+
+    # TITLE
+
+    def _title_start(self, text: str, column: int) -> None:
+        self.raw.title = text[len("TITLE") + 1:]
+
+    # SCALES
+
+    def _scales_start(self, text: str, column: int) -> None:
+        self._scales = {}
+
+    def _scales_line(self, text: str, column: int) -> None:
+        if not text:
+            return
+        parts = text.split(maxsplit=1)
+        if len(parts) < 2:
+            raise self.error(f'a scale shall have an id and a name, got {text!r}', column)
+        self._scales[parts[0]] = Scale(name=parts[1])
+
+    def _scales_end(self) -> None:
+        self.raw.scales = self._scales
+
+    # DESCRIPTION: the text from the first "{" to the last "}" of the block (lines are joined without separators)
+
+    def _description_line(self, text: str, column: int) -> None:
+        if self._brace_pos is None:
+            start = text.find("{")
+            if start < 0:
+                return
+            self._brace_pos = (self._line_no, column + start)
+            self._parts = [text[start:]]
+        else:
+            self._parts.append(text)
+
+    def _description_end(self) -> None:
+        if self._brace_pos is None:
+            raise self.error("DESCRIPTION shall be enclosed in curly brackets", line=self._block_line)
+        text = "".join(self._parts)
+        end = text.rfind("}")
+        if end < 0:
+            line, column = self._brace_pos
+            raise self.error("unclosed curly bracket", column, line)
+        self.raw.description = text[:end].strip("{}")
+        self._parts = []
+        self._brace_pos = None
+
+    # ANSWERS and answers of QUESTION blocks: an answer text followed by scores {scale score, scale score}
+
+    def _answers_start(self, text: str, column: int) -> None:
+        answers_type = text[len("ANSWERS") + 1:].strip()
+        if answers_type not in ("COMMON", "SPECIFIC"):
+            raise self.error(f'ANSWERS shall be COMMON or SPECIFIC, got {answers_type!r}', column)
+        self._answers_common = answers_type == "COMMON"
+        self._answers = []
+
+    def _answers_line(self, text: str, column: int) -> None:
+        if not text:
+            return
+        if not self._answers_common:
+            raise self.error("answers of ANSWERS SPECIFIC shall be in QUESTION blocks", column)
+        self._answers.append(self._answer(text, column))
+
+    def _answers_end(self) -> None:
+        if self._answers_common:
+            self.raw.answers_type = "COMMON"
+            self.raw.answers = self._answers
+        else:
+            self.raw.answers_type = "SPECIFIC"
+            self.raw.answers = None
+
+    def _answer(self, text: str, column: int) -> Answer:
+        start = text.find("{")
+        end = text.rfind("}")
+        if start < 0 or end < start:
+            raise self.error("scores of an answer shall be enclosed in curly brackets: {scale score, ...}",
+                             column + (start if start >= 0 else len(text)))
+        scales: dict[str, int] = {}
+        position = start + 1  # of the current item, to report its column
+        for item in text[position:end].split(","):
+            parts = item.split()
+            if len(parts) != 2:
+                raise self.error(f'expected "scale score", got {item.strip()!r}', self._column(column, position, item))
+            try:
+                scales[parts[0].strip("{}")] = int(parts[1].strip("{}"))
+            except ValueError:
+                raise self.error(f'score shall be an integer, got {parts[1]!r}',
+                                 self._column(column, position, item)) from None
+            position += len(item) + 1
+        return Answer(len(self._answers), text[:start].strip("{}").strip(), scales)
+
+    @staticmethod
+    def _column(column: int, position: int, item: str) -> int:
+        return column + position + len(item) - len(item.lstrip())
+
+    # QUESTION
+
+    def _question_start(self, text: str, column: int) -> None:
+        self._question_text = text[len("QUESTION") + 1:].strip()
+        self._answers = []
+
+    def _question_line(self, text: str, column: int) -> None:
+        if text and self.raw.answers_type == "SPECIFIC":
+            self._answers.append(self._answer(text, column))
+
+    def _question_end(self) -> None:
+        if self.raw.questions is None:
+            self.raw.questions = []
+        answers = self._answers if self.raw.answers_type == "SPECIFIC" and self._answers else None
+        text = self._question_text
+        if self.lazy_questions is not None and len(self.raw.questions) >= self.lazy_questions:
+            text = ""  # only scores are compiled at load time, the question is read on demand
+            if answers is not None:
+                answers = [self._answers_pool.setdefault((answer.id, tuple(answer.scales.items())),
+                                                         answer._replace(text=""))
+                           for answer in answers]
+                answers = self._answer_sets.setdefault(tuple(map(id, answers)), answers)
+        self.raw.questions.append(Question(len(self.raw.questions), text, answers))
+        self._answers = []
+
+    # RESULTS: pairs of a header "scale interval" and an interpretation in curly braces
+
+    def _results_line(self, text: str, column: int) -> None:
+        position = 0
+        while position < len(text) or not text:
+            if self._brace_pos is None:
+                start = text.find("{", position)
+                header = text[position:] if start < 0 else text[position:start]
+                if header.strip() and self._header_pos is None:
+                    self._header_pos = (self._line_no, column + position + len(header) - len(header.lstrip()))
+                self._header.append(header)
+                if start < 0:
+                    return
+                self._brace_pos = (self._line_no, column + start)
+                position = start + 1
+            else:
+                end = text.find("}", position)
+                self._parts.append(text[position:] if end < 0 else text[position:end])
+                if end < 0:
+                    return
+                self._add_result()
+                position = end + 1
+
+    def _add_result(self) -> None:
+        header = "".join(self._header).strip()
+        line, column = self._header_pos or self._brace_pos
+        parts = header.split(maxsplit=1)
+        if len(parts) < 2:
+            raise self.error(f'a result shall start with a scale and an interval, got {header!r}', column, line)
+        scale_id, interval = parts
+        self.raw.results[scale_id].append(ResultRecord(interval=self._interval(interval, line, column),
+                                                       description="".join(self._parts).strip()))
+        self._header = []
+        self._parts = []
+        self._header_pos = self._brace_pos = None
+
+    def _interval(self, text: str, line: int, column: int) -> Interval:
+        try:
+            if text.startswith(INTERVAL_DELIMITER):
+                return Interval(None, int(text.strip(".")))
+            if text.endswith(INTERVAL_DELIMITER):
+                return Interval(int(text.strip(".")), None)
+            low, high = text.split(INTERVAL_DELIMITER)
+            return Interval(int(low), int(high))
+        except ValueError:
+            raise self.error(f'interval shall be "min...max", "...max" or "min...", got {text!r}',
+                             column, line) from None
+
+    def _results_end(self) -> None:
+        if self._brace_pos is not None:
+            line, column = self._brace_pos
+            raise self.error("unclosed curly bracket", column, line)
+        if self._header_pos is not None:
+            line, column = self._header_pos
+            raise self.error("a result has no interpretation in curly brackets", column, line)
+        self._header = []
+
+
+def parse_lines(lines: Iterable[str], filename: str = "<string>", comments: str = "#",
+                delimiter: str = "=") -> RawData:
+    """
+    Parses lines of a questionnaire.
+
+    :raise QuizSyntaxError: if the questionnaire is malformed
+    """
+    parser = QuizParser(filename, comments, delimiter)
+    for line in lines:
+        parser.feed(line)
+    return parser.finish()
+
+
+def parse_question(lines: Iterable[str], question_id: int, answers_type: str = "COMMON",
+                   filename: str = "<string>", line_no: int = 1, comments: str = "#",
+                   delimiter: str = "=") -> Question:
+    """
+    Parses a single QUESTION block (questions of large questionnaires are read on demand, see question_bank.py).
+
+    :param line_no: int (number of the first line of the block in the file, for error messages)
+    :raise QuizSyntaxError: if the block is malformed
+    """
+    parser = QuizParser(filename, comments, delimiter)
+    parser.raw.answers_type = answers_type
+    parser._line_no = line_no - 1
+    for line in lines:
+        parser.feed(line)
+    parser._end_block()
+    if not parser.raw.questions:
+        raise parser.error("QUESTION block is expected", line=line_no)
+    return parser.raw.questions[0]._replace(id=question_id)
+
+
+def parse_file(filename: str, comments: str = "#", delimiter: str = "=") -> RawData:
+    """
+    Parses a questionnaire file in a single pass.
+
+    :raise FileNotFoundError: if the file is not available
+    :raise QuizSyntaxError: if the questionnaire is malformed
+    """
+    try:
+        with open(filename, "r", encoding="utf8") as f:
+            return parse_lines(f, filename, comments, delimiter)
+    except OSError as err:
+        raise FileNotFoundError(f"{filename} not found") from err
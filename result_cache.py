@@ -0,0 +1,118 @@
+"""
+Cache of rendered results of a questionnaire.
+
+The text of results is a pure function of a locale and of totals of scales having interpretations,
+and totals of a scale are within its small reachable range (e.g. 0...21 for GAD-7). If the product
+of the ranges (the score space) is small, a score vector is mapped to a position in a table of rendered
+texts per locale, filled as results are requested. Larger score spaces share a bounded LRU of texts.
+Score spaces above `RESULT_SPACE_LIMIT` are not cached: repeated score vectors are unlikely there.
+"""
+from __future__ import annotations
+
+import math
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable, Sequence
+from typing import Optional
+
+RESULT_TABLE_LIMIT = 4096  # score spaces up to this size get a table of rendered results per locale
+RESULT_CACHE_SIZE = 1024  # rendered results kept in the LRU of a larger score space
+RESULT_SPACE_LIMIT = 100_000  # results of larger score spaces are rendered every time
+
+
+class ResultCache:
+    """
+    Rendered results by locales and score vectors.
+
+    Usage: ``key`` of a score vector is passed to ``get``; if it returns None, the rendered text is ``put``.
+
+    :param positions: list of int (positions of scales having interpretations in score vectors)
+    :param score_ranges: list of reachable ranges of scores (min, max) of these scales
+    :param cache_size: int (maximum number of texts in the LRU of a large score space)
+    """
+
+    def __init__(self, positions: Sequence[int], score_ranges: Sequence[tuple[int, int]],
+                 cache_size: int = RESULT_CACHE_SIZE):
+        self.positions = list(positions)
+        self.lows = [low for low, _ in score_ranges]
+        self.sizes = [high - low + 1 for low, high in score_ranges]
+        self.space = math.prod(self.sizes)
+        self.cache_size = max(1, cache_size)
+        self.mode = ("table" if self.space <= RESULT_TABLE_LIMIT else
+                     "lru" if self.space <= RESULT_SPACE_LIMIT else "off")
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0  # results rendered without the cache (a large score space or an unreachable vector)
+        self._tables: dict[Optional[str], list[Optional[str]]] = {}
+        self._cache: OrderedDict[tuple, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses + self.bypassed
+        return self.hits / requests if requests else 0.0
+
+    def key(self, scores: Sequence[int]) -> Optional[Hashable]:
+        """
+        Returns the key of a score vector (all scales, in the order of ``Quiz.scale_ids``),
+        None if results of the vector are not cached
+        """
+        if self.mode == "off":
+            return None
+        if self.mode == "lru":
+            return tuple(scores[position] for position in self.positions)
+        index = 0
+        for position, low, size in zip(self.positions, self.lows, self.sizes):
+            offset = scores[position] - low
+            if not 0 <= offset < size:  # e.g. scores restored from a session of a previous version of the quiz
+                return None
+            index = index * size + offset
+        return index
+
+    def get(self, locale: Optional[str], key: Optional[Hashable]) -> Optional[str]:
+        if key is None:
+            self.bypassed += 1
+            return None
+        if self.mode == "table":
+            table = self._tables.get(locale)
+            text = table[key] if table is not None else None
+        else:
+            with self._lock:
+                text = self._cache.get((locale, key))
+                if text is not None:
+                    self._cache.move_to_end((locale, key))
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return text
+
+    def put(self, locale: Optional[str], key: Optional[Hashable], text: str) -> None:
+        if key is None:
+            return
+        if self.mode == "table":
+            table = self._tables.get(locale)
+            if table is None:
+                table = self._tables.setdefault(locale, [None] * self.space)
+            table[key] = text
+            return
+        with self._lock:
+            self._cache[(locale, key)] = text
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def __len__(self) -> int:
+        """Number of cached texts"""
+        return sum(self.space - table.count(None) for table in self._tables.values()) + len(self._cache)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_tables"], state["_cache"], state["_lock"]
+        state["hits"] = state["misses"] = state["bypassed"] = 0
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._tables = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
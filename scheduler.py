@@ -0,0 +1,450 @@
+from __future__ import annotations
+
+import logging
+import heapq
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import Any, Optional
+
+import telebot
+
+from outbox import Outbox, not_modified
+
+log = logging.getLogger(__name__)
+
+GLOBAL_RATE = 30.0  # messages per second to all chats (Bot API limit)
+
+GLOBAL_BURST = 30  # maximum number of messages sent at once to all chats
+
+CHAT_RATE = 1.0  # messages per second to a single chat (Bot API limit)
+
+CHAT_BURST = 3  # maximum number of messages sent at once to a single chat
+
+EDIT_RATE = 10.0  # edits per second of messages of a single chat (a message is edited when its button is pressed)
+
+EDIT_BURST = 10  # maximum number of edits made at once in a single chat
+
+MAX_RETRIES = 5  # a failed call is retried this number of times, then it is dropped
+
+BACKOFF = 0.5  # in sec., delay before the first retry (it doubles for every next retry)
+
+MAX_BACKOFF = 30.0  # in sec.
+
+CHAT_QUEUE_LIMIT = 50  # maximum number of pending calls of a single chat
+
+QUEUE_LIMIT = 100_000  # maximum number of pending calls of all chats
+
+SCHEDULER_WORKERS = 8  # number of threads making Bot API calls
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: `rate` tokens per second are added to the bucket up to `capacity` tokens.
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """
+        Returns time (in sec.) until `cost` tokens are available (0 if they are available right now).
+        A cost above the capacity waits for a full bucket (tokens of the rest are taken in advance by ``take``).
+        """
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= cost
+
+    def block(self, seconds: float, now: float) -> None:
+        """Takes all tokens for `seconds` ahead, so nothing passes until then (e.g. after a 429 response)"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class Operation:
+    """A pending Bot API call (or a pair of calls made one after another)"""
+    __slots__ = ("kind", "chat_id", "message_id", "text", "reply_markup", "parse_mode", "extra", "attempts")
+
+    SEND = "send"
+    TRANSIENT = "transient"  # send and delete
+    SEND_THEN_EDIT = "send_then_edit"
+    EDIT = "edit"
+    DELETE = "delete"
+    ANSWER = "answer"
+
+    def __init__(self, kind: str, chat_id: int, message_id: Optional[int] = None, text: Optional[str] = None,
+                 reply_markup: Any = None, parse_mode: Optional[str] = None, extra: Any = None):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.parse_mode = parse_mode
+        self.extra = extra  # callback query id, or the first message of SEND_THEN_EDIT
+        self.attempts = 0
+
+    @property
+    def lane(self) -> tuple[int, bool]:
+        """
+        Key of the queue of the call: answers to callback queries of a chat are queued apart from its messages,
+        so they are not kept waiting by rate limits of messages
+        """
+        return self.chat_id, self.kind == self.ANSWER
+
+    @property
+    def cost(self) -> int:
+        """Number of messages counted by rate limits (answers to callback queries are not limited)"""
+        if self.kind == self.ANSWER:
+            return 0
+        if self.kind in (self.TRANSIENT, self.SEND_THEN_EDIT) and self.message_id is None:
+            return 2
+        return 1
+
+
+def _editable(reply_markup: Any) -> bool:
+    """Tells if a message with this markup can be an edit of another message (only inline keyboards)"""
+    return reply_markup is None or isinstance(reply_markup, (telebot.types.InlineKeyboardMarkup, str))
+
+
+class ScheduledOutbox(Outbox):
+    """
+    Outbox which queues Bot API calls and makes them in worker threads under rate limits.
+
+    * Calls are limited by a global token bucket and token buckets per chat. Edits of messages
+      (the reply to a pressed button) have a per-chat bucket of their own with a larger rate than new messages,
+      answers to callback queries are limited by none of them.
+    * Calls of a chat are made one by one, in the order of queueing (answers to callback queries
+      have a queue of their own and do not wait for pending messages).
+    * A call is retried with exponential backoff; if Telegram responds with 429,
+      no calls are made for `retry_after` seconds.
+    * Redundant calls are coalesced: deleting a message followed by sending a new one
+      becomes a single edit, and consecutive edits of the same message keep only the last one.
+    * Calls exceeding queue limits are dropped.
+
+    Counters (`stats()`): queue depth, sent, coalesced, retried, dropped and failed calls.
+    """
+
+    def __init__(self, bot: telebot.TeleBot, workers: int = SCHEDULER_WORKERS,
+                 global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST,
+                 chat_rate: float = CHAT_RATE, chat_burst: float = CHAT_BURST,
+                 edit_rate: float = EDIT_RATE, edit_burst: float = EDIT_BURST,
+                 max_retries: int = MAX_RETRIES, chat_queue_limit: int = CHAT_QUEUE_LIMIT,
+                 queue_limit: int = QUEUE_LIMIT, clock: Callable[[], float] = time.monotonic):
+        super().__init__(bot)
+        self.clock = clock
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.edit_rate = edit_rate
+        self.edit_burst = edit_burst
+        self.max_retries = max_retries
+        self.chat_queue_limit = chat_queue_limit
+        self.queue_limit = queue_limit
+        self.global_bucket = TokenBucket(global_rate, global_burst, clock())
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.dropped = 0
+        self.failed = 0
+        self._depth = 0
+        self._queues: dict[tuple[int, bool], deque[Operation]] = {}  # by lanes (see ``Operation.lane``)
+        self._buckets: dict[int, TokenBucket] = {}  # buckets of new messages by chats
+        self._edit_buckets: dict[int, TokenBucket] = {}  # buckets of edits by chats
+        self._ready: deque[tuple[int, bool]] = deque()  # lanes whose next call can be made
+        self._delayed: list[tuple[float, tuple[int, bool]]] = []  # heap of (time, lane) waiting for tokens or a retry
+        self._throttled: deque[tuple[int, bool]] = deque()  # lanes waiting for tokens of the global bucket
+        self._scheduled: set[tuple[int, bool]] = set()  # lanes in `_ready`, `_delayed` or `_throttled`
+        self._busy: set[tuple[int, bool]] = set()  # lanes whose call is being made
+        self._cond = threading.Condition()
+        self._closed = False
+        self._workers = [threading.Thread(target=self._work, daemon=True, name=f"outbox-{n}")
+                         for n in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    # public interface of ``Outbox``: calls are queued and the methods return immediately
+
+    def send_message(self, chat_id: int, text: str, reply_markup: Any = None,
+                     parse_mode: Optional[str] = None) -> None:
+        self._enqueue(Operation(Operation.SEND, chat_id, text=text, reply_markup=reply_markup,
+                                parse_mode=parse_mode))
+
+    def send_transient(self, chat_id: int, text: str, reply_markup: Any = None,
+                       parse_mode: Optional[str] = None) -> None:
+        self._enqueue(Operation(Operation.TRANSIENT, chat_id, text=text, reply_markup=reply_markup,
+                                parse_mode=parse_mode))
+
+    def edit_message(self, chat_id: int, message_id: int, text: str, reply_markup: Any = None,
+                     parse_mode: Optional[str] = None) -> None:
+        self._enqueue(Operation(Operation.EDIT, chat_id, message_id=message_id, text=text,
+                                reply_markup=reply_markup, parse_mode=parse_mode))
+
+    def send_then_edit(self, chat_id: int, first_text: str, first_markup: Any, text: str,
+                       reply_markup: Any = None, parse_mode: Optional[str] = None) -> None:
+        self._enqueue(Operation(Operation.SEND_THEN_EDIT, chat_id, text=text, reply_markup=reply_markup,
+                                parse_mode=parse_mode, extra=(first_text, first_markup)))
+
+    def delete_message(self, chat_id: int, message_id: int) -> None:
+        self._enqueue(Operation(Operation.DELETE, chat_id, message_id=message_id))
+
+    def answer_callback_query(self, chat_id: int, callback_query_id: str) -> None:
+        self._enqueue(Operation(Operation.ANSWER, chat_id, extra=callback_query_id))
+
+    def stats(self) -> dict[str, int]:
+        with self._cond:
+            return {"depth": self._depth,
+                    "chats": len({chat_id for chat_id, _ in self._queues}),
+                    "sent": self.sent,
+                    "coalesced": self.coalesced,
+                    "retried": self.retried,
+                    "dropped": self.dropped,
+                    "failed": self.failed,
+                    }
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until all queued calls are made.
+
+        :return: False if the timeout has expired
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        with self._cond:
+            while self._depth or self._busy:
+                remaining = None if deadline is None else deadline - self.clock()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    # queueing
+
+    def _enqueue(self, op: Operation) -> None:
+        with self._cond:
+            lane = op.lane
+            queue = self._queues.get(lane)
+            if queue and self._coalesce(queue, op):
+                self.coalesced += 1
+                return
+            if self._depth >= self.queue_limit or (queue is not None and len(queue) >= self.chat_queue_limit):
+                self.dropped += 1
+                return
+            if queue is None:
+                queue = self._queues[lane] = deque()
+            queue.append(op)
+            self._depth += 1
+            self._schedule(lane, 0.0)
+
+    @staticmethod
+    def _coalesce(queue: deque[Operation], op: Operation) -> bool:
+        """Merges `op` into the last pending call of the chat if possible"""
+        last = queue[-1]
+        if last.kind == Operation.DELETE and op.kind == Operation.SEND and _editable(op.reply_markup):
+            last.kind = Operation.EDIT  # delete + send = edit (it falls back to delete + send if fails)
+            last.text, last.reply_markup, last.parse_mode = op.text, op.reply_markup, op.parse_mode
+            return True
+        if last.kind == Operation.EDIT and last.message_id == op.message_id and \
+                op.kind in (Operation.EDIT, Operation.DELETE):
+            queue[-1] = op  # only the last state of the message matters
+            return True
+        return False
+
+    def _schedule(self, lane: tuple[int, bool], delay: float) -> None:
+        """Puts a lane to `_ready` or `_delayed` (shall be called under the lock)"""
+        if lane in self._scheduled or lane in self._busy:
+            return
+        self._scheduled.add(lane)
+        if delay <= 0:
+            self._ready.append(lane)
+        else:
+            heapq.heappush(self._delayed, (self.clock() + delay, lane))
+        self._cond.notify()
+
+    def _next(self) -> Optional[Operation]:
+        """Waits for a call which can be made under rate limits and takes it from its queue"""
+        with self._cond:
+            while not self._closed:
+                now = self.clock()
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._delayed)[1])
+                throttled_wait = None
+                if self._throttled:  # lanes waiting for the global bucket are served in turn
+                    lane = self._throttled[0]
+                    op = self._queues[lane][0]
+                    throttled_wait = self.global_bucket.wait_time(op.cost, now)
+                    if throttled_wait == 0:
+                        self._throttled.popleft()
+                        return self._take(lane, op, now)
+                if not self._ready:
+                    timeouts = [t for t in (throttled_wait, self._delayed[0][0] - now if self._delayed else None)
+                                if t is not None]
+                    self._cond.wait(min(timeouts) if timeouts else None)
+                    continue
+                lane = self._ready.popleft()
+                op = self._queues[lane][0]
+                if op.cost:
+                    wait = self._chat_bucket(op, now).wait_time(op.cost, now)
+                    if wait > 0:
+                        heapq.heappush(self._delayed, (now + wait, lane))
+                        continue
+                    if self._throttled or self.global_bucket.wait_time(op.cost, now) > 0:
+                        # a call of two messages is not kept waiting by calls of single ones made meanwhile
+                        self._throttled.append(lane)
+                        continue
+                return self._take(lane, op, now)
+        return None
+
+    def _take(self, lane: tuple[int, bool], op: Operation, now: float) -> Operation:
+        """Takes tokens of a call which can be made and takes it from its queue (shall be called under the lock)"""
+        if op.cost:
+            self.global_bucket.take(op.cost, now)
+            self._chat_bucket(op, now).take(op.cost, now)
+        self._queues[lane].popleft()
+        self._depth -= 1
+        self._scheduled.discard(lane)
+        self._busy.add(lane)
+        return op
+
+    def _chat_bucket(self, op: Operation, now: float) -> TokenBucket:
+        """Returns the bucket of the chat limiting a call (shall be called under the lock)"""
+        if op.kind == Operation.EDIT:
+            buckets, rate, burst = self._edit_buckets, self.edit_rate, self.edit_burst
+        else:
+            buckets, rate, burst = self._buckets, self.chat_rate, self.chat_burst
+        bucket = buckets.get(op.chat_id)
+        if bucket is None:
+            bucket = buckets[op.chat_id] = TokenBucket(rate, burst, now)
+        return bucket
+
+    def _done(self, op: Operation, retry_after: Optional[float]) -> None:
+        """Releases the lane of a made call; the call is queued again if it shall be retried"""
+        lane = op.lane
+        with self._cond:
+            self._busy.discard(lane)
+            queue = self._queues[lane]
+            delay = 0.0
+            if retry_after is not None:
+                queue.appendleft(op)
+                self._depth += 1
+                delay = retry_after
+            if queue:
+                self._schedule(lane, delay)
+            else:
+                del self._queues[lane]
+                now = self.clock()
+                for buckets in (self._buckets, self._edit_buckets):
+                    bucket = buckets.get(op.chat_id)
+                    if bucket is not None and bucket.wait_time(bucket.capacity, now) == 0:
+                        del buckets[op.chat_id]  # a full bucket is the same as a new one
+            self._cond.notify_all()
+
+    def _work(self) -> None:
+        while True:
+            op = self._next()
+            if op is None:
+                return
+            self._done(op, self._make_call(op))
+
+    # Bot API calls
+
+    def _make_call(self, op: Operation) -> Optional[float]:
+        """
+        Makes a call.
+
+        :return: delay (in sec.) before the call shall be retried, or None if it is done (or failed)
+        """
+        try:
+            self._execute(op)
+        except telebot.apihelper.ApiTelegramException as err:
+            if err.error_code == 429:
+                parameters = (err.result_json or {}).get("parameters") or {}
+                retry_after = float(parameters.get("retry_after", BACKOFF))
+                with self._cond:  # Telegram wants no calls at all for a while
+                    self.global_bucket.block(retry_after, self.clock())
+                return self._retry(op, retry_after, err)
+            if err.error_code >= 500:
+                return self._retry(op, None, err)
+            with self._cond:
+                self.failed += 1
+            log.warning('%s to chat %s failed: %s', op.kind, op.chat_id, err.description)
+            return None
+        except Exception as err:  # network errors
+            return self._retry(op, None, err)
+        with self._cond:
+            self.sent += 1
+        return None
+
+    def _retry(self, op: Operation, retry_after: Optional[float], err: Exception) -> Optional[float]:
+        op.attempts += 1
+        with self._cond:
+            if op.attempts > self.max_retries:
+                self.dropped += 1
+                log.error('%s to chat %s is dropped after %s attempts: %s', op.kind, op.chat_id, op.attempts, err)
+                return None
+            self.retried += 1
+        if retry_after is None:
+            retry_after = min(MAX_BACKOFF, BACKOFF * 2 ** (op.attempts - 1))
+        return retry_after
+
+    def _execute(self, op: Operation) -> None:
+        bot = self.bot
+        if op.kind == Operation.SEND:
+            bot.send_message(op.chat_id, op.text, reply_markup=op.reply_markup, parse_mode=op.parse_mode)
+        elif op.kind == Operation.ANSWER:
+            bot.answer_callback_query(op.extra)
+        elif op.kind == Operation.DELETE:
+            self._delete(op.chat_id, op.message_id)
+        elif op.kind == Operation.EDIT:
+            self._edit(op)
+        elif op.kind == Operation.TRANSIENT:
+            if op.message_id is None:  # a retried call does not send the message again
+                op.message_id = bot.send_message(op.chat_id, op.text, reply_markup=op.reply_markup,
+                                                 parse_mode=op.parse_mode).id
+            self._delete(op.chat_id, op.message_id)
+        elif op.kind == Operation.SEND_THEN_EDIT:
+            if op.message_id is None:
+                first_text, first_markup = op.extra
+                op.message_id = bot.send_message(op.chat_id, first_text, reply_markup=first_markup).id
+            self._edit(op)
+
+    def _delete(self, chat_id: int, message_id: int) -> None:
+        try:
+            self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except telebot.apihelper.ApiTelegramException as err:
+            if err.error_code == 429 or err.error_code >= 500:
+                raise
+            log.warning('%s is not deleted: %s', message_id, err.description)  # e.g. it is already deleted
+
+    def _edit(self, op: Operation) -> None:
+        try:
+            self.bot.edit_message_text(op.text, chat_id=op.chat_id, message_id=op.message_id,
+                                       reply_markup=op.reply_markup, parse_mode=op.parse_mode)
+        except telebot.apihelper.ApiTelegramException as err:
+            if err.error_code == 429 or err.error_code >= 500:
+                raise
+            if not_modified(err):
+                return
+            self._delete(op.chat_id, op.message_id)
+            op.kind = Operation.SEND  # a retry shall only send the message
+            self.bot.send_message(op.chat_id, op.text, reply_markup=op.reply_markup, parse_mode=op.parse_mode)
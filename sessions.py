@@ -0,0 +1,355 @@
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import Callable, Hashable, Iterator
+from typing import Any, Optional
+
+log = logging.getLogger(__name__)
+
+SWEEP_INTERVAL = 1.0  # in sec., how often ``ExpirySweeper`` removes expired sessions
+
+EVICT_RATE = 10.0  # callbacks of expired sessions (goodbye messages) per sec. called by ``ExpirySweeper``
+
+SWEEP_BATCH = 10_000  # sessions removed under one acquisition of the lock of a store
+
+CALLBACK_MAX_DELAY = 60.0  # in sec., callbacks which ``ExpirySweeper`` cannot call within this delay are dropped
+
+
+class _Entry:
+    """A record of the session store: a stored value and its timestamps."""
+    __slots__ = ("value", "created", "touched")
+
+    def __init__(self, value: Any, now: float, created: Optional[float] = None):
+        self.value = value
+        self.created = now if created is None else created
+        self.touched = now
+
+
+class Session:
+    """
+    State of a user's session. Sessions have ``__slots__`` (no ``__dict__`` per session), so a million
+    of them fit in memory: a session takes a few hundred bytes with its scores.
+
+    Timestamps of a session are kept by ``SessionStore`` only.
+
+    :param user_id: int
+    :param chat_id: int
+    :param locale: str (language of messages, see messages.py), None - the default language
+    """
+    __slots__ = ("user_id", "chat_id", "locale", "quiz", "question_id", "scores", "finished")
+
+    def __init__(self, user_id: int, chat_id: int, locale: Optional[str] = None):
+        self.user_id = user_id
+        self.chat_id = user_id if chat_id == user_id else chat_id  # one int object for a private chat
+        self.locale = locale  # one of messages.LOCALES
+        self.quiz = None  # a shared ``Quiz`` object: a reference takes no more than a small integer id
+        self.question_id: Optional[int] = None  # the last shown question (None - the quiz is not started)
+        self.scores = None  # a fixed-width int32 vector, one element per scale of the quiz
+        self.finished = False  # results are shown, *OK* ends the session
+
+
+class SessionStore:
+    """
+    Bounded in-memory storage of user sessions.
+
+    Sessions are kept in LRU order (the least recently active session first),
+    so lookup, touch and eviction are O(1).
+
+    A session is expired when it is idle longer than `idle_ttl` seconds or
+    lasts longer than `session_ttl` seconds. Idle sessions are found at the LRU head;
+    long sessions are found by a hashed timing wheel: lists of keys by ticks (a tick is
+    `session_ttl` / `WHEEL_TICKS` seconds) when their sessions reach `session_ttl`. So ``sweep``
+    checks only expired sessions (and keys of sessions removed before they expired). When the store
+    is full, expired sessions are evicted to make room. If none is expired, the store refuses a new session.
+
+    Changes and reads of the store take its lock (sessions are read by handlers while the sweeper thread
+    removes them); `on_evict` is called after the lock is released, so a callback may send messages
+    or take its time.
+
+    :param maxsize: int (maximum number of sessions at the same time)
+    :param idle_ttl: float (maximum duration of inactivity, in sec.)
+    :param session_ttl: float (maximum duration of a session, in sec.)
+    :param on_evict: callable, is called with a key and a value of every evicted session
+    :param clock: callable, returns current time in sec.
+    """
+    WHEEL_TICKS = 1024  # ticks of the timing wheel within session_ttl
+
+    def __init__(self, maxsize: int, idle_ttl: float, session_ttl: float,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+                 clock: Callable[[], float] = time.time):
+        if maxsize < 1:
+            raise ValueError(f'maxsize shall be positive, {maxsize} is given')
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self.session_ttl = session_ttl
+        self.on_evict = on_evict
+        self.clock = clock
+        self.evictions = 0
+        self.expired_idle = 0  # sessions evicted as idle longer than idle_ttl
+        self.expired_long = 0  # sessions evicted as lasting longer than session_ttl
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._tick = max(session_ttl, 0.001) / self.WHEEL_TICKS  # in sec.
+        self._wheel: dict[int, list[Hashable]] = {}  # keys of sessions by ticks when they reach session_ttl
+        self._next_tick = math.floor(clock() / self._tick)  # the first tick not swept yet
+        self._overdue: list[Hashable] = []  # keys of sessions due at swept ticks, checked by every sweep
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._entries)
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self._lock:
+            return self._entries[key].value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry.value
+
+    def created(self, key: Hashable) -> float:
+        """Returns time when a session was added to the store"""
+        with self._lock:
+            return self._entries[key].created
+
+    def touched(self, key: Hashable) -> float:
+        """Returns time of the last activity of a session"""
+        with self._lock:
+            return self._entries[key].touched
+
+    def lookup(self, key: Hashable) -> Optional[tuple[Any, float, float]]:
+        """
+        Returns a session with time when it was added and time of its last activity,
+        None if there is no such session (e.g. it has been evicted)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else (entry.value, entry.created, entry.touched)
+
+    def add(self, key: Hashable, value: Any, created: Optional[float] = None) -> bool:
+        """
+        Adds a new session (or replaces the existing one with the same key).
+        `created` is the start time of a restored session (now, if omitted).
+
+        :return: True if the session is added, False if the store is full
+        and there is no expired session to evict
+        """
+        now = self.clock()
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+            elif len(self._entries) >= self.maxsize:
+                evicted = self._sweep(now)
+                if len(self._entries) >= self.maxsize:
+                    self._notify(evicted)
+                    return False
+            entry = self._entries[key] = _Entry(value, now, created)
+            self._schedule(key, entry)
+        self._notify(evicted)
+        return True
+
+    def touch(self, key: Hashable) -> None:
+        """
+        Marks a session as active right now and moves it to the tail of LRU order
+        (a session evicted meanwhile is not added back)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.touched = self.clock()
+                self._entries.move_to_end(key)
+
+    def pop(self, key: Hashable, *default: Any) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return entry.value
+
+    def is_expired(self, entry: _Entry, now: float) -> bool:
+        return (now - entry.touched) > self.idle_ttl or (now - entry.created) > self.session_ttl
+
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        """
+        Evicts expired sessions and calls `on_evict` for each of them.
+
+        :return: number of evicted sessions
+        """
+        evicted = self.sweep(now)
+        self._notify(evicted)
+        return len(evicted)
+
+    def sweep(self, now: Optional[float] = None, limit: Optional[int] = None) -> list[tuple[Hashable, Any]]:
+        """
+        Removes expired sessions without calling `on_evict` (see ``ExpirySweeper``).
+        The work is proportional to the number of expired sessions.
+
+        :param limit: int (maximum number of removed sessions, the rest is removed by next sweeps),
+                      None - all expired sessions are removed
+        :return: keys and values of removed sessions
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            return self._sweep(now, limit)
+
+    def _sweep(self, now: float, limit: Optional[int] = None) -> list[tuple[Hashable, Any]]:
+        evicted = []
+        limit = math.inf if limit is None else limit
+        while self._entries and len(evicted) < limit:  # idle sessions are at the LRU head
+            head_key = next(iter(self._entries))
+            if (now - self._entries[head_key].touched) <= self.idle_ttl:
+                break
+            evicted.append((head_key, self._entries.pop(head_key).value))
+        self.expired_idle += len(evicted)
+        last_tick = math.floor(now / self._tick)
+        due = [(self._next_tick - 1, self._overdue)] if self._overdue else []
+        self._overdue = []
+        if last_tick >= self._next_tick:
+            if last_tick - self._next_tick < len(self._wheel):
+                ticks = range(self._next_tick, last_tick + 1)
+            else:  # the store has not been swept for long
+                ticks = sorted(tick for tick in self._wheel if tick <= last_tick)
+            due.extend((tick, self._wheel.pop(tick)) for tick in ticks if tick in self._wheel)
+        for tick, keys in due:
+            for position, key in enumerate(keys):
+                if len(evicted) >= limit:  # the rest is checked by the next sweep
+                    self._overdue.extend(keys[position:])
+                    break
+                entry = self._entries.get(key)
+                if entry is None or self._deadline(entry) > tick:  # removed, or replaced by a later session
+                    continue
+                if (now - entry.created) > self.session_ttl:
+                    del self._entries[key]
+                    evicted.append((key, entry.value))
+                    self.expired_long += 1
+                else:  # it expires later within the last tick
+                    self._overdue.append(key)
+        self._next_tick = max(self._next_tick, last_tick + 1)
+        self.evictions += len(evicted)
+        return evicted
+
+    def _deadline(self, entry: _Entry) -> int:
+        """Returns the tick within which a session reaches `session_ttl`"""
+        return math.floor((entry.created + self.session_ttl) / self._tick)
+
+    def _schedule(self, key: Hashable, entry: _Entry) -> None:
+        tick = self._deadline(entry)
+        if tick < self._next_tick:  # e.g. a restored session
+            self._overdue.append(key)
+        else:
+            keys = self._wheel.get(tick)
+            if keys is None:
+                keys = self._wheel[tick] = []
+            keys.append(key)
+
+    def _notify(self, evicted: list[tuple[Hashable, Any]]) -> None:
+        if self.on_evict is not None:
+            for key, value in evicted:
+                self.on_evict(key, value)
+
+
+class ExpirySweeper:
+    """
+    A background thread removing expired sessions of a store every `interval` seconds.
+
+    Sessions are removed at once (in batches of `SWEEP_BATCH`, so handlers do not wait for the lock
+    of the store for long); their `on_evict` callbacks (e.g. goodbye messages) are called from a queue,
+    at most `rate` per second, so a batch of expired sessions does not flood Bot API.
+    Callbacks are called without the lock of the store.
+
+    The queue holds callbacks which may be called within `max_delay` seconds (`rate` * `max_delay` of them).
+    If more sessions expire at once, callbacks of the earliest removed ones are dropped (a goodbye minutes
+    late is of no use), `on_drop` is called for them instead, and the number of dropped callbacks is logged.
+
+    :param store: SessionStore
+    :param interval: float (in sec., how often the store is swept)
+    :param rate: float (maximum number of callbacks per second)
+    :param max_delay: float (in sec., maximum delay of a callback)
+    :param on_drop: callable, is called with a key and a value of every session whose callback is dropped
+                    (e.g. to forget the session without a message), None - nothing is called
+    """
+
+    def __init__(self, store: SessionStore, interval: float = SWEEP_INTERVAL, rate: float = EVICT_RATE,
+                 max_delay: float = CALLBACK_MAX_DELAY, on_drop: Optional[Callable[[Hashable, Any], None]] = None):
+        self.store = store
+        self.interval = interval
+        self.rate = rate
+        self.burst = max(1.0, rate * interval)  # callbacks allowed in a tick after a pause
+        self.max_delay = max_delay
+        self.max_pending = max(1, math.ceil(rate * max_delay))
+        self.on_drop = on_drop
+        self.dropped = 0  # callbacks dropped as they could not be called within max_delay
+        self.pending: deque[tuple[Hashable, Any]] = deque()  # removed sessions waiting for callbacks
+        self._allowance = self.burst
+        self._last = time.monotonic()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def tick(self, now: Optional[float] = None) -> int:
+        """
+        Sweeps the store once and calls callbacks allowed by the rate.
+
+        :return: number of called callbacks
+        """
+        dropped = 0
+        while True:
+            evicted = self.store.sweep(now, SWEEP_BATCH)
+            self.pending.extend(evicted)
+            dropped += self._drop_overflow()
+            if len(evicted) < SWEEP_BATCH:
+                break
+        if dropped:
+            log.warning('%s callback(s) of expired sessions are dropped: they cannot be called within %s sec.',
+                        dropped, self.max_delay)
+        current = time.monotonic()
+        self._allowance = min(self.burst, self._allowance + (current - self._last) * self.rate)
+        self._last = current
+        called = 0
+        while self.pending and self._allowance >= 1:
+            key, value = self.pending.popleft()
+            self._allowance -= 1
+            called += 1
+            if self.store.on_evict is not None:
+                try:
+                    self.store.on_evict(key, value)
+                except Exception:  # one failed goodbye does not stop the sweeper
+                    log.exception('Callback of expired session %s failed', key)
+        return called
+
+    def _drop_overflow(self) -> int:
+        """Drops the earliest removed sessions beyond `max_pending`, returns their number"""
+        overflow = max(0, len(self.pending) - self.max_pending)
+        for _ in range(overflow):
+            key, value = self.pending.popleft()
+            if self.on_drop is not None:
+                try:
+                    self.on_drop(key, value)
+                except Exception:
+                    log.exception('Callback of dropped session %s failed', key)
+        self.dropped += overflow
+        return overflow
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.tick()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True, name="session-sweeper")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,221 @@
+"""
+Stateless sessions: progress of a quiz travels in callback data of inline buttons.
+
+Every answer button carries the quiz id, the question index, the answer index and running totals
+of all scales, signed with a truncated HMAC bound to the user. So any worker (process or host)
+can continue a session from the callback query alone, without a shared session store.
+
+Callback data layout (before Base85 encoding, all integers are big-endian):
+    format      1 byte
+    quiz id     4 bytes (``Quiz.quiz_id``)
+    question    2 bytes (START for the button starting a quiz)
+    answer      1 byte
+    totals      zigzag varint per scale, in the order of ``Quiz.scale_ids``
+    tag         TAG_SIZE bytes of HMAC-SHA256 of the user id and all bytes above
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import struct
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import NamedTuple
+
+import numpy as np
+
+from buttons import make_inline_kb
+from errors import InvalidCallbackData
+from quiz import Quiz
+
+CALLBACK_PREFIX = ":"  # is not used by Base85 and by other callback data
+
+CALLBACK_LIMIT = 64  # bytes, Telegram limit of callback data
+
+FORMAT = 1
+
+TAG_SIZE = 8  # bytes of HMAC kept in callback data
+
+START = 0xFFFF  # question index of the button which shows the first question
+
+_HEADER = struct.Struct(">BIHB")
+
+# raw bytes which fit the limit after Base85 encoding (5 characters per 4 bytes) and the prefix
+MAX_PAYLOAD = (CALLBACK_LIMIT - len(CALLBACK_PREFIX)) * 4 // 5
+
+COMPLETIONS_KEPT = 10_000  # messages with results remembered by ``Completions``
+
+
+class QuizState(NamedTuple):
+    """Progress of a stateless session carried by a button"""
+    quiz_id: int
+    question_id: int  # START before the first question
+    answer_id: int
+    totals: tuple[int, ...]  # scores of scales before the answer
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def _varint_size(value: int) -> int:
+    return max(1, (_zigzag(value).bit_length() + 6) // 7)
+
+
+def _put_varint(buffer: bytearray, value: int) -> None:
+    value = _zigzag(value)
+    while value > 0x7F:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _get_varint(data: bytes, position: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        if position >= len(data) or shift > 63:
+            raise InvalidCallbackData("truncated scores")
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return _unzigzag(value), position
+
+
+def partial_ranges(quiz: Quiz) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns bounds of running totals of scales at any point of a quiz
+    (they may lie outside of the ranges of final scores).
+    """
+    tensor = quiz.score_tensor.astype(np.int64)
+    if tensor.size == 0:
+        zeros = np.zeros(len(quiz.scale_ids), dtype=np.int64)
+        return zeros, zeros
+    return np.minimum(tensor.min(axis=1), 0).sum(axis=0), np.maximum(tensor.max(axis=1), 0).sum(axis=0)
+
+
+def fits(quiz: Quiz) -> bool:
+    """Tells if any state of a quiz fits into callback data"""
+    low, high = partial_ranges(quiz)
+    totals_size = sum(max(_varint_size(int(lo)), _varint_size(int(hi))) for lo, hi in zip(low, high))
+    return _HEADER.size + totals_size + TAG_SIZE <= MAX_PAYLOAD and len(quiz.questions or []) < START
+
+
+class CallbackCodec:
+    """
+    Encodes and decodes ``QuizState`` to/from callback data.
+
+    :param secret: bytes (a key of HMAC shared by all workers of the bot)
+    """
+
+    def __init__(self, secret: bytes):
+        self._secret = secret
+
+    def _tag(self, user_id: int, body: bytes) -> bytes:
+        message = user_id.to_bytes(8, "big", signed=True) + body
+        return hmac.new(self._secret, message, hashlib.sha256).digest()[:TAG_SIZE]
+
+    def encode(self, user_id: int, state: QuizState) -> str:
+        body = bytearray(_HEADER.pack(FORMAT, state.quiz_id, state.question_id, state.answer_id))
+        for total in state.totals:
+            _put_varint(body, total)
+        body += self._tag(user_id, bytes(body))
+        data = CALLBACK_PREFIX + base64.b85encode(bytes(body)).decode()
+        if len(data) > CALLBACK_LIMIT:
+            raise ValueError(f'{len(state.totals)} scales do not fit into callback data')
+        return data
+
+    def decode(self, user_id: int, data: str, scales_number: int | None = None) -> QuizState:
+        """
+        :param user_id: int (id of the user who has pressed the button)
+        :param data: str (callback data)
+        :param scales_number: int (number of totals, None - all the rest up to the tag)
+        :raise InvalidCallbackData: if data is malformed, or the tag does not match
+        """
+        if not data.startswith(CALLBACK_PREFIX):
+            raise InvalidCallbackData(f'no prefix {CALLBACK_PREFIX!r}')
+        try:
+            raw = base64.b85decode(data[len(CALLBACK_PREFIX):])
+        except ValueError as err:
+            raise InvalidCallbackData(str(err)) from err
+        if len(raw) < _HEADER.size + TAG_SIZE:
+            raise InvalidCallbackData("too short")
+        body, tag = raw[:-TAG_SIZE], raw[-TAG_SIZE:]
+        if not hmac.compare_digest(tag, self._tag(user_id, body)):
+            raise InvalidCallbackData("tag mismatch")
+        version, quiz_id, question_id, answer_id = _HEADER.unpack_from(body)
+        if version != FORMAT:
+            raise InvalidCallbackData(f'unknown format {version}')
+        totals = []
+        position = _HEADER.size
+        while position < len(body) and (scales_number is None or len(totals) < scales_number):
+            total, position = _get_varint(body, position)
+            totals.append(total)
+        if position != len(body) or (scales_number is not None and len(totals) != scales_number):
+            raise InvalidCallbackData("wrong number of scores")
+        return QuizState(quiz_id, question_id, answer_id, tuple(totals))
+
+    def answers_kb_json(self, user_id: int, quiz: Quiz, question_id: int, totals: Sequence[int]) -> str:
+        """Returns serialized keyboard with answer options of a question carrying the state of the quiz"""
+        totals = tuple(int(total) for total in totals)
+        answers = quiz.payloads[question_id].answers
+        return make_inline_kb([text for _, text in answers],
+                              [self.encode(user_id, QuizState(quiz.quiz_id, question_id, answer_id, totals))
+                               for answer_id, _ in answers]).to_json()
+
+    def start_callback(self, user_id: int, quiz: Quiz) -> str:
+        """Returns callback data of the button which shows the first question of a quiz"""
+        return self.encode(user_id, QuizState(quiz.quiz_id, START, 0, (0,) * len(quiz.scale_ids)))
+
+
+def advance(quiz: Quiz, state: QuizState) -> tuple[int, np.ndarray]:
+    """
+    Applies the answer of a state.
+
+    :return: index of the next question (``len(quiz.questions)`` if the quiz is over) and totals after the answer
+    :raise InvalidCallbackData: if the state does not match the quiz
+    """
+    scores = quiz.new_scores()
+    if len(state.totals) != len(scores):
+        raise InvalidCallbackData("wrong number of scores")
+    scores[:] = state.totals
+    if state.question_id == START:
+        return 0, scores
+    if state.question_id >= len(quiz.questions) or \
+            all(answer_id != state.answer_id for answer_id, _ in quiz.payloads[state.question_id].answers):
+        raise InvalidCallbackData(f'no answer #{state.answer_id} of question #{state.question_id}')
+    quiz.add_answer_scores(scores, state.question_id, state.answer_id)
+    return state.question_id + 1, scores
+
+
+class Completions:
+    """
+    Messages whose quizzes have been completed recently. A stateless session has no state to be marked finished,
+    so a repeated tap on the last answer (or a callback query delivered twice) is recognized by its message,
+    and the completion is recorded once. Updates of a chat are processed by the same process (see workers.py).
+
+    :param maxsize: int (number of remembered messages, the oldest ones are forgotten)
+    """
+
+    def __init__(self, maxsize: int = COMPLETIONS_KEPT):
+        self.maxsize = max(1, maxsize)
+        self._messages: OrderedDict[tuple[int, int], None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, chat_id: int, message_id: int) -> bool:
+        """Remembers a message with results, returns False if it is remembered already"""
+        key = (chat_id, message_id)
+        with self._lock:
+            if key in self._messages:
+                return False
+            self._messages[key] = None
+            if len(self._messages) > self.maxsize:
+                self._messages.popitem(last=False)
+        return True
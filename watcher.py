@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from collections.abc import Callable
+from typing import Optional
+
+from catalog import LoadReport
+from quiz import Quiz
+from quiz_cache import cache_filename, load_quiz
+
+log = logging.getLogger(__name__)
+
+
+class CatalogWatcher:
+    """
+    Polls a directory with questionnaires and reloads changed files without restarting the bot.
+
+    Only new and changed files (by mtime and size) are parsed. After every change
+    `on_change` is called with a new catalog (a new dictionary, titles -> ``Quiz``), so a catalog
+    in use is never mutated. Users who have started a quiz keep their ``Quiz`` object.
+
+    :param directory: str (a directory with questionnaires)
+    :param extension: str (extension of questionnaire files)
+    :param on_change: callable, receives a new catalog
+    :param interval: float (in sec., how often the directory is checked)
+    """
+
+    def __init__(self, directory: str, extension: str, on_change: Callable[[dict[str, Quiz]], None],
+                 interval: float):
+        self.directory = directory
+        self.extension = extension
+        self.on_change = on_change
+        self.interval = interval
+        self.quizzes: dict[str, Quiz] = {}  # filename -> questionnaire
+        self._stamps: dict[str, tuple[int, int]] = {}  # filename -> (mtime, size)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def seed(self, reports: list[LoadReport]) -> None:
+        """Remembers questionnaires loaded at start, so they are not parsed again"""
+        for report in reports:
+            try:
+                self._stamps[report.filename] = self._stamp(report.filename)
+            except OSError:
+                continue
+            if report.quiz is not None:
+                self.quizzes[report.filename] = report.quiz
+
+    @staticmethod
+    def _stamp(filename: str) -> tuple[int, int]:
+        stat = os.stat(filename)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        stamps = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(self.extension):
+                    stat = entry.stat()
+                    stamps[os.path.join(self.directory, entry.name)] = (stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    def catalog(self) -> dict[str, Quiz]:
+        """Returns questionnaires by titles in the order of filenames"""
+        return {self.quizzes[filename].title: self.quizzes[filename] for filename in sorted(self.quizzes)}
+
+    def poll(self) -> bool:
+        """
+        Checks the directory once and reloads changed questionnaires.
+
+        :return: True if the catalog has changed
+        """
+        try:
+            stamps = self._scan()
+        except OSError as err:
+            log.error('%s is not available: %s', self.directory, err)
+            return False
+        removed = [filename for filename in self._stamps if filename not in stamps]
+        changed = [filename for filename, stamp in stamps.items() if self._stamps.get(filename) != stamp]
+        if not removed and not changed:
+            return False
+        for filename in removed:
+            del self._stamps[filename]
+            self.quizzes.pop(filename, None)
+            try:
+                os.remove(cache_filename(filename))
+            except OSError:
+                pass
+            log.info('Questionnaire removed: %s', filename)
+        for filename in changed:
+            self._stamps[filename] = stamps[filename]
+            try:
+                self.quizzes[filename] = load_quiz(filename)
+            except Exception as err:  # the previous version (if any) stays in the catalog
+                log.error('Questionnaire is not reloaded: %s: %s: %s', filename, err.__class__.__name__, err)
+                continue
+            log.info('Questionnaire reloaded: %s', filename)
+        self.on_change(self.catalog())
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True, name="catalog-watcher")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import logging
+import json
+import queue
+import threading
+from collections.abc import Callable
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+import telebot
+
+log = logging.getLogger(__name__)
+
+WEBHOOK_HOST = "127.0.0.1"
+
+WEBHOOK_PORT = 8443
+
+WEBHOOK_WORKERS = 8  # number of threads processing updates
+
+WEBHOOK_QUEUE_SIZE = 1024  # maximum number of updates waiting for processing (per worker)
+
+MAX_BODY_SIZE = 1 << 20  # in bytes, larger requests are rejected
+
+RETRY_AFTER = 1  # in sec., is sent to a client together with 503 status code when queues are full
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+MESSAGE_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post")  # fields of updates with messages
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_message(message: Any) -> bool:
+    return isinstance(message, dict) and isinstance(message.get("chat"), dict) and _is_int(message["chat"].get("id"))
+
+
+def valid_update(update: Any) -> bool:
+    """
+    Checks that a raw update (parsed JSON) is an object with an integer ``update_id``, and that its messages
+    and callback queries are objects with integer chat (user) ids, so the update may be routed by ``raw_chat_id``
+    """
+    if not isinstance(update, dict) or not _is_int(update.get("update_id")):
+        return False
+    if not all(_is_message(update[field]) for field in MESSAGE_FIELDS if field in update):
+        return False
+    if "callback_query" in update:
+        query = update["callback_query"]
+        if not isinstance(query, dict) or not isinstance(query.get("from"), dict) \
+                or not _is_int(query["from"].get("id")):
+            return False
+        if "message" in query and not _is_message(query["message"]):
+            return False
+    return True
+
+
+def raw_chat_id(update: dict) -> Optional[int]:
+    """
+    Returns id of the chat a raw update (parsed JSON) belongs to, or None.
+    The update shall be valid (see ``valid_update``).
+    """
+    message = update.get("message")
+    if message is None:
+        query = update.get("callback_query")
+        if query is None:
+            return None
+        message = query.get("message")
+        if message is None:
+            return query.get("from", {}).get("id")
+    return message.get("chat", {}).get("id")
+
+
+class UpdateQueue:
+    """
+    Bounded queues of updates, one queue per worker.
+
+    Updates are sharded by chat id, so updates of the same chat are processed by the same worker in order.
+    A batch of updates is either accepted entirely or rejected if any of its queues has no room.
+    """
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, maxsize: int = WEBHOOK_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.queues: list[queue.Queue] = [queue.Queue() for _ in range(workers)]
+        self.accepted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def shard(self, update: dict) -> int:
+        chat_id = raw_chat_id(update)
+        key = chat_id if chat_id is not None else update.get("update_id", 0)
+        return hash(key) % len(self.queues)
+
+    def put_batch(self, updates: list[dict], parsed: Optional[list[telebot.types.Update]] = None) -> bool:
+        """
+        Puts a batch of raw updates to the queues.
+
+        :param updates: list of raw updates (they are routed by chat ids)
+        :param parsed: list of these updates parsed, they are queued instead of raw ones if given
+        :return: True if the batch is accepted, False if queues are overloaded
+        """
+        shards = [self.shard(update) for update in updates]
+        with self._lock:
+            demand: dict[int, int] = {}
+            for shard in shards:
+                demand[shard] = demand.get(shard, 0) + 1
+            if any(self.queues[shard].qsize() + n > self.maxsize for shard, n in demand.items()):
+                self.rejected += len(updates)
+                return False
+            for shard, update in zip(shards, parsed if parsed is not None else updates):
+                self.queues[shard].put_nowait(update)
+            self.accepted += len(updates)
+        return True
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """
+    Accepts POST requests with a single update (as Telegram sends them) or a JSON array of updates.
+
+    Responds with 200 if updates are queued, 503 with ``Retry-After`` header if queues are overloaded,
+    400 for malformed requests and 403 if the secret token does not match.
+    """
+    server: WebhookServer
+
+    def do_POST(self):
+        if self.server.secret_token is not None and \
+                self.headers.get(SECRET_HEADER) != self.server.secret_token:
+            self._respond(HTTPStatus.FORBIDDEN)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self._respond(HTTPStatus.LENGTH_REQUIRED)
+            return
+        if length < 0:
+            self._respond(HTTPStatus.BAD_REQUEST)
+            return
+        if length > MAX_BODY_SIZE:
+            self._respond(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            return
+        try:
+            payload = json.loads(self.rfile.read(length))
+        except (ValueError, UnicodeDecodeError):
+            self._respond(HTTPStatus.BAD_REQUEST)
+            return
+        updates = payload if isinstance(payload, list) else [payload]
+        if not all(valid_update(update) for update in updates):
+            self._respond(HTTPStatus.BAD_REQUEST)
+            return
+        try:
+            parsed = [telebot.types.Update.de_json(update) for update in updates]
+        except Exception as err:  # telebot raises whatever a missing or mistyped field leads to
+            log.debug('Malformed update: %r', err)
+            self._respond(HTTPStatus.BAD_REQUEST)
+            return
+        if self.server.updates.put_batch(updates, parsed):
+            self._respond(HTTPStatus.OK)
+        else:
+            self._respond(HTTPStatus.SERVICE_UNAVAILABLE, {"Retry-After": str(RETRY_AFTER)})
+
+    def _respond(self, status: HTTPStatus, headers: Optional[dict[str, str]] = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # requests are not logged
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    HTTP server receiving updates. Every request is read and parsed (up to ``telebot.types.Update``) in its own thread,
+    so the accept loop is never blocked; updates are processed by worker threads.
+
+    :param address: tuple of host and port (port 0 means any free port)
+    :param process: callable, processes a list of ``telebot.types.Update`` objects
+    :param workers: int (number of worker threads)
+    :param queue_size: int (maximum number of queued updates per worker)
+    :param secret_token: str (expected value of the secret token header), None means no check
+    """
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], process: Callable[[list[telebot.types.Update]], Any],
+                 workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE,
+                 secret_token: Optional[str] = None):
+        super().__init__(address, WebhookHandler)
+        self.process = process
+        self.secret_token = secret_token
+        self.updates = UpdateQueue(workers, queue_size)
+        self._workers = [threading.Thread(target=self._work, args=(q,), daemon=True, name=f"webhook-{n}")
+                         for n, q in enumerate(self.updates.queues)]
+        for worker in self._workers:
+            worker.start()
+
+    def _work(self, updates: queue.Queue) -> None:
+        while True:
+            update = updates.get()
+            if update is None:
+                return
+            try:
+                self.process([update])
+            except Exception as err:
+                log.exception('Update is not processed: %s', err)
+            finally:
+                updates.task_done()
+
+    def join(self) -> None:
+        """Waits until all queued updates are processed"""
+        for q in self.updates.queues:
+            q.join()
+
+    def server_close(self) -> None:
+        super().server_close()
+        for q in self.updates.queues:
+            q.put(None)
+        for worker in self._workers:
+            worker.join()
+
+
+def serve(bot: telebot.TeleBot, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+          url: Optional[str] = None, secret_token: Optional[str] = None,
+          workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE) -> None:
+    """
+    Webhook runtime mode: runs an HTTP server passing received updates to handlers of `bot`.
+
+    :param bot: telebot.TeleBot (a bot with registered handlers)
+    :param host: str (interface to listen on)
+    :param port: int (port to listen on)
+    :param url: str (public URL of the webhook); if given, the webhook is set via Bot API,
+                otherwise the server only listens locally (e.g. behind a reverse proxy or for offline tests)
+    :param secret_token: str (secret token to check in incoming requests)
+    :param workers: int (number of worker threads)
+    :param queue_size: int (maximum number of queued updates per worker)
+    """
+    bot.threaded = False  # handlers run in worker threads of the server
+    server = WebhookServer((host, port), bot.process_new_updates, workers, queue_size, secret_token)
+    if url is not None:
+        bot.remove_webhook()
+        bot.set_webhook(url=url, secret_token=secret_token)
+    log.info('Listening for updates at http://%s:%s', host, server.server_address[1])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,171 @@
+"""
+Multi-process runtime mode: a dispatcher process receives updates (long polling) and shards them
+by chat id to worker processes. Each worker processes updates of its shard one by one, so updates
+of a chat are handled in order, and owns sessions of its chats.
+
+If a worker dies, it is restarted with a new queue; only updates already queued to that worker are lost.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from collections.abc import Callable
+from typing import Optional
+
+import telebot
+
+import config
+from webhook import raw_chat_id
+
+log = logging.getLogger(__name__)
+
+WORKER_PROCESSES = None  # number of worker processes (None - number of CPUs)
+
+WORKER_QUEUE_SIZE = 1024  # maximum number of updates waiting for a worker
+
+POLLING_TIMEOUT = 20  # in sec., long polling timeout of getUpdates
+
+PUT_TIMEOUT = 1  # in sec., how long the dispatcher waits for room in a worker's queue before checking the worker
+
+
+def shard(update: dict, processes: int) -> int:
+    """Returns index of the worker processing a raw update (the same for all updates of a chat)"""
+    chat_id = raw_chat_id(update)
+    key = chat_id if chat_id is not None else update.get("update_id", 0)
+    return key % processes
+
+
+def settings() -> dict:
+    """Returns settings of config.py as they are in this process (they may be changed after import)"""
+    return {name: value for name, value in vars(config).items() if name.isupper() and name != "SETTINGS_ENV"}
+
+
+def process_updates(bot: telebot.TeleBot, updates: multiprocessing.Queue) -> None:
+    """
+    Main loop of a worker: processes raw updates from `updates` until None is received.
+
+    :param bot: telebot.TeleBot (a bot with registered handlers)
+    :param updates: a queue of raw updates (parsed JSON)
+    """
+    bot.threaded = False  # updates of a shard are processed one by one
+    while True:
+        raw_update = updates.get()
+        if raw_update is None:
+            return
+        try:
+            bot.process_new_updates([telebot.types.Update.de_json(raw_update)])
+        except Exception as err:
+            log.exception('Update is not processed: %s', err)
+
+
+class Dispatcher:
+    """
+    Runs worker processes and routes raw updates to them.
+
+    Workers are spawned, so they import config.py anew; current settings of the dispatcher are passed to them
+    (see ``config.SETTINGS_ENV``), so settings changed at run time apply to workers too.
+
+    :param target: callable, the main function of a worker; is called in a new process with the worker's index,
+                   number of workers and a queue of raw updates (shall be importable, i.e. picklable)
+    :param processes: int (number of worker processes)
+    :param queue_size: int (maximum number of queued updates per worker)
+    """
+
+    def __init__(self, target: Callable[[int, int, multiprocessing.Queue], None],
+                 processes: Optional[int] = WORKER_PROCESSES, queue_size: int = WORKER_QUEUE_SIZE):
+        self.target = target
+        self.processes = processes or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.restarts = 0
+        self.lost = 0  # updates queued to crashed workers
+        self._context = multiprocessing.get_context("spawn")  # workers do not inherit threads of the dispatcher
+        os.environ[config.SETTINGS_ENV] = json.dumps(settings())  # spawned processes inherit the environment
+        self._queues: list[multiprocessing.Queue] = [None] * self.processes
+        self._workers: list[multiprocessing.Process] = [None] * self.processes
+        for index in range(self.processes):
+            self._start(index)
+
+    def _start(self, index: int) -> None:
+        updates = self._context.Queue(self.queue_size)
+        worker = self._context.Process(target=self.target, args=(index, self.processes, updates),
+                                       daemon=True, name=f"worker-{index}")
+        worker.start()
+        self._queues[index] = updates
+        self._workers[index] = worker
+
+    def check(self) -> int:
+        """
+        Restarts dead workers. Updates waiting in a dead worker's queue are dropped
+        (the queue may be broken if the worker died while reading it).
+
+        :return: number of restarted workers
+        """
+        restarted = 0
+        for index, worker in enumerate(self._workers):
+            if worker.is_alive():
+                continue
+            log.error('%s has exited with code %s, restarting', worker.name, worker.exitcode)
+            try:
+                self.lost += self._queues[index].qsize()
+            except NotImplementedError:  # qsize() is not available on macOS
+                pass
+            self._queues[index].close()
+            self._start(index)
+            restarted += 1
+        self.restarts += restarted
+        return restarted
+
+    def put(self, update: dict) -> None:
+        """Routes a raw update to its worker. Blocks while the worker's queue is full."""
+        index = shard(update, self.processes)
+        while True:
+            try:
+                self._queues[index].put(update, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                self.check()  # the worker may be dead
+
+    def close(self, timeout: float = 10) -> None:
+        """Lets workers finish queued updates and stops them"""
+        for updates in self._queues:
+            updates.put(None)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                worker.terminate()
+
+
+def polling(token: str, target: Callable[[int, int, multiprocessing.Queue], None],
+            processes: Optional[int] = WORKER_PROCESSES, timeout: int = POLLING_TIMEOUT) -> None:
+    """
+    Multi-process runtime mode: receives updates with long polling and passes them to worker processes.
+    Updates are not parsed by the dispatcher, they are routed as raw JSON.
+
+    :param token: str (the bot's token)
+    :param target: callable, the main function of a worker (see ``Dispatcher``)
+    :param processes: int (number of worker processes)
+    :param timeout: int (long polling timeout, in sec.)
+    """
+    dispatcher = Dispatcher(target, processes)
+    log.info('%s worker process(es) are started', dispatcher.processes)
+    offset = None
+    try:
+        while True:
+            try:
+                updates = telebot.apihelper.get_updates(token, offset=offset, timeout=timeout,
+                                                        long_polling_timeout=timeout)
+            except Exception as err:
+                log.error('getUpdates failed: %s', err)
+                time.sleep(1)
+                continue
+            dispatcher.check()
+            for update in updates:
+                offset = update["update_id"] + 1
+                dispatcher.put(update)
+    finally:
+        dispatcher.close()